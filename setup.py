@@ -49,6 +49,10 @@ setup(
         'python-daemon',
         'docopt',
     ],
+    extras_require={
+        'msgpack': ['msgpack'],
+        'cbor': ['cbor2'],
+    },
     entry_points={
         'console_scripts': ['thingpin=thingpin.main:main'],
     },
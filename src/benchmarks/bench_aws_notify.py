@@ -0,0 +1,67 @@
+"""
+Compare the per message cost of AWSIoTNotifier.notify() with the Thing per
+publish approach it replaced.
+
+The MQTT client is a stub so only thingpin's own work is measured.
+
+    python src/benchmarks/bench_aws_notify.py
+"""
+import os
+import sys
+import logging
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from thingamon import Thing
+from thingpin.aws import AWSIoTNotifier
+
+N = 100000
+
+STATES = {'HIGH': {'state': 'open'}, 'LOW': {'state': 'closed'}}
+THINGS = dict(('door{}'.format(i), {'pin': i, 'iot_states': STATES})
+              for i in range(8))
+
+
+class StubClient(object):
+    def publish(self, topic, message):
+        pass
+
+
+def main():
+    logging.getLogger('thingpin').disabled = True
+    client = StubClient()
+
+    notifier = AWSIoTNotifier(host='h', client_cert='c', private_key='k')
+    notifier.client = client
+    for name, config in THINGS.items():
+        notifier.things[name] = notifier.cache_thing(
+            name, config['iot_states'].values())
+
+    names = sorted(THINGS)
+    values = [STATES['HIGH'], STATES['LOW']]
+
+    def before():
+        for i in range(N):
+            Thing(names[i % 8], client).publish_state(values[i % 2])
+
+    def after():
+        for i in range(N):
+            notifier.notify(names[i % 8], values[i % 2])
+
+    payloads = [notifier.encode(value) for value in values]
+
+    def precompiled():
+        for i in range(N):
+            notifier.notify(names[i % 8], values[i % 2], payloads[i % 2])
+
+    for label, fn in [('Thing per publish', before),
+                      ('cached Thing', after),
+                      ('Pin payload', precompiled)]:
+        seconds = min(timeit.repeat(fn, number=1, repeat=3))
+        print('{:20} {:8.2f} us/message'.format(label, seconds / N * 1e6))
+
+
+if __name__ == '__main__':
+    main()
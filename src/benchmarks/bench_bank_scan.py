@@ -0,0 +1,63 @@
+"""
+Compare the cost of a quiet Scanner loop reading each pin with reading
+all pin levels at once from a BankGPIO.
+
+The bank is a file standing in for /dev/gpiomem, so this runs anywhere.
+
+    python src/benchmarks/bench_bank_scan.py
+"""
+import os
+import sys
+import shutil
+import timeit
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import thingpin.pin
+from thingpin.pin import Scanner
+from thingpin.gpio import BankGPIO
+
+N = 20000
+
+
+class Observer(object):
+    def update_pin(self, pin, reading):
+        pass
+
+
+def scan_time(gpio, pins):
+    thingpin.pin.use_gpio(gpio)
+    scanner = Scanner(sleep=.01)
+    for pin in range(pins):
+        scanner.add(Observer(), pin)
+    scanner.scan()
+    return min(timeit.repeat(scanner.scan, number=N, repeat=3)) / N
+
+
+class PerPinGPIO(object):
+    """Hides `read_bank()` so that the Scanner reads each pin"""
+
+    def __init__(self, gpio):
+        self.input = gpio.input
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'gpiomem')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 64)
+        gpio = BankGPIO(path)
+        print('pins  per pin read  bank read')
+        for pins in (1, 8, 32, 54):
+            print('{:4d}  {:9.2f} us  {:6.2f} us'.format(
+                pins, scan_time(PerPinGPIO(gpio), pins) * 1e6,
+                scan_time(gpio, pins) * 1e6))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
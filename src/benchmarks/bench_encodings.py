@@ -0,0 +1,101 @@
+"""
+Compare notifier payload encodings by encode time and wire size.
+
+Encodes the states of typical `iot_states` configs the way each encoding
+publishes them: a thing toggling between two states, a thing with more
+fields, a counter, a batch of changes and a heartbeat snapshot. Sizes are
+of the payload alone, with the AWS shadow document around JSON states.
+`delta` is the size of a change from the previous state, after the first.
+Encodings whose library is not installed are skipped.
+
+    python src/benchmarks/bench_encodings.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from thingpin.payloads import ENCODINGS, create_encoding, Delta
+from thingpin.thingpin import freeze
+
+N = 20000
+
+# each case is a sequence of states published for one thing
+CASES = [
+    ('door', [freeze({'state': 'open'}), freeze({'state': 'closed'})]),
+    ('alarm', [
+        freeze({'state': 'armed', 'zone': 3, 'label': 'Front door',
+                'tamper': False, 'battery': 97}),
+        freeze({'state': 'triggered', 'zone': 3, 'label': 'Front door',
+                'tamper': False, 'battery': 97}),
+    ]),
+    ('counter', [
+        {'count': 12, 'rate': 0.2, 'total': 10412, 'state': 0.2},
+        {'count': 9, 'rate': 0.15, 'total': 10421, 'state': 0.15},
+    ]),
+    ('batch', [
+        dict(('pin{}'.format(i), {'state': 'open' if i % 3 else 'closed'})
+             for i in range(20)),
+        dict(('pin{}'.format(i), {'state': 'open' if i % 4 else 'closed'})
+             for i in range(20)),
+    ]),
+    ('snapshot', [
+        {'things': dict(('pin{}'.format(i), {'state': 'open'})
+                        for i in range(50)),
+         'health': {'uptime': 3600, 'time': 1700000000.5, 'threads': 4,
+                    'stopped': []}},
+        {'things': dict(('pin{}'.format(i), {'state': 'open' if i else
+                                             'closed'})
+                        for i in range(50)),
+         'health': {'uptime': 3660, 'time': 1700000060.5, 'threads': 4,
+                    'stopped': []}},
+    ]),
+]
+
+
+def shadow(value):
+    return {'state': {'reported': value}}
+
+
+def measure(encoding, states):
+    """Encode time in us and size in bytes of a change"""
+    if encoding.delta:
+        delta = Delta()
+        delta.published('thing', states[0])
+
+        def run():
+            # the patch too, without the payload cache
+            return encoding.dumps(delta.patch('thing', states[1]))
+
+        payload = encoding.dumps(shadow(delta.patch('thing', states[1])))
+    else:
+        def run():
+            return encoding.dumps(states[1])
+
+        value = states[1] if encoding.binary else shadow(states[1])
+        payload = encoding.dumps(value)
+    seconds = min(timeit.repeat(run, number=N, repeat=3)) / N
+    return seconds * 1e6, len(payload)
+
+
+def main():
+    encodings = []
+    for name in sorted(ENCODINGS):
+        try:
+            encodings.append(create_encoding(name))
+        except ValueError as e:
+            print('skipping {}: {}'.format(name, e))
+
+    print('{:10} {:8} {:>10} {:>8}'.format('case', 'encoding', 'encode us',
+                                           'bytes'))
+    for case, states in CASES:
+        for encoding in encodings:
+            us, size = measure(encoding, states)
+            print('{:10} {:8} {:10.2f} {:8d}'.format(case, encoding.name, us,
+                                                     size))
+
+
+if __name__ == '__main__':
+    main()
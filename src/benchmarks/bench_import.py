@@ -0,0 +1,66 @@
+"""
+Measure thingpin cold start and fail when it is over budget.
+
+Each run starts a fresh Python that imports thingpin.main, which is what
+`thingpin -h` and service start pay before doing anything, and reports the
+median wall time. Exits 1 when the median is over the budget or when an
+optional dependency that should only load on demand was imported.
+
+    python src/benchmarks/bench_import.py [RUNS] [BUDGET_MS]
+"""
+import os
+import sys
+import time
+import subprocess
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# only imported when a config needs them
+LAZY = ['yaml', 'pkg_resources', 'thingamon', 'Adafruit_IO', 'http.server',
+        'msgpack', 'cbor2']
+
+CHECK = '''
+import sys
+import thingpin.main
+print(' '.join(m for m in {!r} if m in sys.modules))
+'''.format(LAZY)
+
+
+def cold_start():
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', 'import thingpin.main'],
+                          cwd=SRC)
+    return time.time() - start
+
+
+def baseline():
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', 'pass'])
+    return time.time() - start
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def main(runs=10, budget_ms=150):
+    python = median([baseline() for _ in range(runs)]) * 1000
+    total = median([cold_start() for _ in range(runs)]) * 1000
+    loaded = subprocess.check_output([sys.executable, '-c', CHECK],
+                                     cwd=SRC).decode('utf-8').split()
+
+    print('python {:7.1f} ms'.format(python))
+    print('import {:7.1f} ms (thingpin {:.1f} ms, budget {} ms)'.format(
+        total, total - python, budget_ms))
+    ok = True
+    if total - python > budget_ms:
+        print('over budget')
+        ok = False
+    if loaded:
+        print('imported eagerly: {}'.format(', '.join(loaded)))
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(a) for a in sys.argv[1:3]]))
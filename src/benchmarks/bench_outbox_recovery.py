@@ -0,0 +1,90 @@
+"""
+Measure how fast a QueuedNotifier recovers after a broker outage.
+
+A fake broker notifier is disconnected while changes are spooled to an
+outbox in a temporary directory, then connected. The time until the outbox
+is drained gives the recovery throughput.
+
+    python src/benchmarks/bench_outbox_recovery.py [CHANGES] [THINGS]
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from thingpin.notifiers import Notifier, QueuedNotifier
+from thingpin.outbox import Outbox
+
+
+class FakeBroker(Notifier):
+    """Notifier that records what it publishes and can be disconnected"""
+
+    def __init__(self):
+        self.up = False
+        self.published = 0
+
+    @property
+    def connected(self):
+        return self.up
+
+    def initialize(self, things=None):
+        pass
+
+    def cleanup(self):
+        pass
+
+    def notify(self, name, value, payload=None):
+        if not self.up:
+            raise IOError('not connected')
+        self.published += 1
+
+
+def run(changes, things, max_bytes):
+    path = tempfile.mkdtemp()
+    try:
+        broker = FakeBroker()
+        outbox = Outbox(path, max_bytes=max_bytes)
+        queue = QueuedNotifier(broker, size=changes, outbox=outbox,
+                               retry_min=.01, retry_max=.01)
+        queue.initialize()
+
+        start = time.time()
+        for i in range(changes):
+            queue.notify('thing{}'.format(i % things), {'state': i})
+        while queue.depth:
+            time.sleep(.001)
+        spool_seconds = time.time() - start
+        spooled = len(outbox)
+
+        start = time.time()
+        broker.up = True
+        while len(outbox):
+            time.sleep(.001)
+        recover_seconds = time.time() - start
+        queue.cleanup()
+
+        print('{:>7} changes {:>4} things max_bytes {:>9}: spooled {:>7} '
+              '({:>8.0f}/s), replayed {:>7} ({:>8.0f}/s), compactions '
+              '{}'.format(changes, things, max_bytes, spooled,
+                          changes / spool_seconds, broker.published,
+                          broker.published / recover_seconds,
+                          outbox.stats['compactions']))
+    finally:
+        shutil.rmtree(path)
+
+
+def main():
+    logging.getLogger('thingpin').disabled = True
+    changes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    things = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    run(changes, things, max_bytes=64 * 1024 * 1024)
+    run(changes, things, max_bytes=64 * 1024)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Benchmark the sampling to publish pipeline with simulated GPIO pins.
+
+Usage: bench_pipeline.py [options]
+
+Runs a Thingpin with N square wave GPIO pins that each toggle M times a second,
+publishing through a QueuedNotifier to a notifier that records when each
+change arrives. Reports for each mode:
+
+    - cpu: process CPU time as a percentage of one core
+    - threads: number of threads while running
+    - latency percentiles: time from a pin edge to the notifier publishing
+      the new state
+    - missed: edges that were never published
+    - sample_rate: average samples per second of each pin
+
+Options:
+    -h --help           show usage and exit
+    -n --pins=N         number of pins [default: 16]
+    -r --rate=M         toggles per second of each pin [default: 2]
+    -d --duration=S     seconds to run each mode [default: 5]
+    -s --sleep=S        poll sleep in seconds [default: 0.010]
+    --max-sleep=S       longest poll sleep of a quiet pin in seconds, for
+                        adaptive polling [default: 0]
+    --debounce=S        debounce delay in seconds [default: 0]
+    -m --modes=MODES    comma separated modes to run: watcher, scanner,
+                        edge [default: watcher,scanner,edge]
+    -o --output=FILE    write results as JSON to FILE
+    --child             run one mode and print its result as JSON. Each
+                        mode runs in a child process so that threads of
+                        one mode do not affect the next.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import resource
+import threading
+import subprocess
+
+import docopt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from thingpin.gpio import BaseGPIO, clock
+
+
+class SquareWaveGPIO(BaseGPIO):
+    """
+    GPIO backend where each pin is a square wave.
+
+    Pin `i` changes level `rate` times a second, offset by a fraction of a
+    period per pin so that pins do not all change at once. Edge times are
+    known exactly so publish latency can be measured.
+    """
+
+    def __init__(self, pins, rate):
+        super(SquareWaveGPIO, self).__init__()
+        self.rate = float(rate)
+        self.start = clock()
+        self.phase = dict((pin, float(pin) / pins) for pin in range(pins))
+
+    def edge_number(self, pin, t):
+        """Number of the last edge of pin at time t, its level is k % 2"""
+        return int((t - self.start) * self.rate + self.phase[pin])
+
+    def edge_time(self, pin, k):
+        return self.start + (k - self.phase[pin]) / self.rate
+
+    def level(self, pin, now):
+        return self.edge_number(pin, now) % 2
+
+    def wait_for_edge(self, pin, edge, timeout=None):
+        now = clock()
+        delay = self.edge_time(pin, self.edge_number(pin, now) + 1) - now
+        if timeout is not None:
+            delay = min(delay, timeout / 1000.0)
+        time.sleep(delay)
+
+
+class Recorder(object):
+    """Notifier that records the time of each publish"""
+
+    def __init__(self):
+        self.published = []
+        self.lock = threading.Lock()
+
+    connected = True
+
+    def initialize(self, things=None):
+        pass
+
+    def cleanup(self):
+        pass
+
+    def encode(self, value):
+        return json.dumps(value).encode('utf-8')
+
+    def notify(self, name, value, payload=None):
+        now = clock()
+        with self.lock:
+            self.published.append((now, name, value['level']))
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+def run_mode(mode, args, gpio):
+    from thingpin.thingpin import Thingpin
+    from thingpin.notifiers import QueuedNotifier
+
+    pins = int(args['--pins'])
+    duration = float(args['--duration'])
+    things = {}
+    for pin in range(pins):
+        things['pin{}'.format(pin)] = {
+            'pin': pin,
+            'sleep': float(args['--sleep']),
+            'max_sleep': float(args['--max-sleep']) or None,
+            'debounce_delay': float(args['--debounce']),
+            'mode': 'edge' if mode == 'edge' else 'poll',
+            'iot_states': {'HIGH': {'level': 1}, 'LOW': {'level': 0}},
+        }
+
+    recorder = Recorder()
+    service = Thingpin(QueuedNotifier(recorder, size=100000),
+                       pin_mode='BCM', things=things, gpio=gpio,
+                       scanner=({'sleep': float(args['--sleep']),
+                                 'max_sleep': float(args['--max-sleep']) or
+                                 None}
+                                if mode == 'scanner' else None))
+
+    threads_before = threading.active_count()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = clock()
+    service.start()
+    time.sleep(duration)
+    threads = threading.active_count() - threads_before
+    sample_rates = service.sample_rates()
+    elapsed = clock() - start
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    end = clock()
+
+    with recorder.lock:
+        published = list(recorder.published)
+
+    latencies = []
+    reported = dict((name, 0) for name in things)
+    for t, name, level in published:
+        reported[name] += 1
+        if reported[name] == 1:
+            # initial reading, not an edge
+            continue
+        pin = things[name]['pin']
+        k = gpio.edge_number(pin, t)
+        if k % 2 != level:
+            k -= 1
+        latencies.append(t - gpio.edge_time(pin, k))
+
+    edges = 0
+    missed = 0
+    for name, config in things.items():
+        pin = config['pin']
+        count = gpio.edge_number(pin, end) - gpio.edge_number(pin, start)
+        edges += count
+        # the first publish of each pin is its initial reading, not an edge
+        missed += max(count - max(reported[name] - 1, 0), 0)
+
+    cpu = (end_usage.ru_utime - usage.ru_utime +
+           end_usage.ru_stime - usage.ru_stime)
+    return {
+        'mode': mode,
+        'pins': pins,
+        'rate': gpio.rate,
+        'duration': elapsed,
+        'cpu_percent': 100.0 * cpu / elapsed,
+        'threads': threads,
+        'edges': edges,
+        'published': len(published),
+        'missed': missed,
+        'sample_rate': sum(sample_rates.values()) / len(sample_rates),
+        'latency_ms': dict(
+            ('p{}'.format(p), None if percentile(latencies, p) is None
+             else 1000 * percentile(latencies, p))
+            for p in [50, 90, 99, 100]),
+    }
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    logging.getLogger('thingpin').disabled = True
+
+    if args['--child']:
+        gpio = SquareWaveGPIO(int(args['--pins']), float(args['--rate']))
+        print(json.dumps(run_mode(args['--modes'], args, gpio)))
+        return
+
+    results = []
+    for mode in args['--modes'].split(','):
+        command = [sys.executable, os.path.abspath(__file__), '--child',
+                   '--modes', mode]
+        for option in ['--pins', '--rate', '--duration', '--sleep',
+                       '--max-sleep', '--debounce']:
+            command.extend([option, args[option]])
+        result = json.loads(subprocess.check_output(command).decode('utf-8'))
+        results.append(result)
+        print('{mode:8} pins {pins:4} rate {rate:6.1f}/s '
+              'cpu {cpu_percent:6.1f}% threads {threads:4} '
+              'published {published:6} missed {missed:5} '
+              'samples/s {sample_rate:6.1f} '
+              'latency p50 {p50} p99 {p99} ms'.format(
+                  p50=_ms(result['latency_ms']['p50']),
+                  p99=_ms(result['latency_ms']['p99']),
+                  **result))
+
+    if args['--output']:
+        import thingpin
+        with open(args['--output'], 'w') as f:
+            json.dump({
+                'thingpin': thingpin.__version__,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'args': dict((k, v) for k, v in args.items()
+                             if k not in ['--output', '--child', '--help']),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+def _ms(value):
+    return 'n/a' if value is None else '{:.2f}'.format(value)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
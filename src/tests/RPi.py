@@ -4,9 +4,17 @@ class GPIO:
     BOTH = 'both'
 
     @classmethod
-    def wait_for_edge(cls, pin, edge):
+    def wait_for_edge(cls, pin, edge, timeout=None):
         pass
 
     @classmethod
     def input(cls, pin):
         pass
+
+    @classmethod
+    def add_event_detect(cls, pin, edge, callback=None, bouncetime=None):
+        pass
+
+    @classmethod
+    def remove_event_detect(cls, pin):
+        pass
@@ -0,0 +1,159 @@
+try:
+    from unittest.mock import patch, Mock, call
+except ImportError:
+    from mock import patch, Mock, call
+
+import os
+import sys
+import time
+import threading
+import pytest
+
+# pick up our RPi stub
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import RPi
+import thingpin.pin
+import thingpin.thingpin
+from thingpin.thingpin import Thingpin
+from thingpin.notifiers import Notifier, QueuedNotifier, FanoutNotifier
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 5),
+                                reason='asyncio runtime needs Python 3.5')
+
+thingpin.pin.use_gpio(RPi.GPIO)
+HIGH = 1
+LOW = 0
+
+THINGS = {
+    'door': {'pin': 21, 'iot_states': {'HIGH': {'state': 'open'},
+                                       'LOW': {'state': 'closed'}}},
+    'window': {'pin': 20, 'iot_states': {'HIGH': {'state': 'open'},
+                                         'LOW': {'state': 'closed'}}},
+}
+
+
+def stop_when(runtime, condition, timeout=5):
+    def watch():
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(.01)
+        runtime.loop.call_soon_threadsafe(runtime.stop)
+    thread = threading.Thread(target=watch)
+    thread.daemon = True
+    thread.start()
+
+
+@patch.object(thingpin.thingpin, 'pin_cleanup')
+@patch.object(thingpin.thingpin, 'set_pin_mode')
+@patch.object(thingpin.thingpin, 'setup_input_pin')
+@patch.object(RPi.GPIO, 'input')
+def test_async_runtime(mock_input, mock_setup, mock_set_pin_mode,
+                       mock_cleanup):
+    from thingpin.aio import AsyncRuntime
+    mock_input.side_effect = lambda pin: HIGH if pin == 21 else LOW
+    inner = Mock()
+    inner.encode.side_effect = Notifier().encode
+    service = Thingpin(inner, 'BCM', THINGS, scanner={'sleep': .001},
+                       heartbeat={'interval': .01})
+    threads = threading.active_count()
+    runtime = AsyncRuntime(service)
+    # the notifier is queued and published from the loop, not a thread
+    assert isinstance(service.notifier, QueuedNotifier)
+    assert not service.notifier.threaded
+
+    stop_when(runtime, lambda: inner.notify_snapshot.called)
+    runtime.run()
+
+    assert sorted(c[1][:2] for c in inner.notify.mock_calls) == [
+        ('door', {'state': 'open'}), ('window', {'state': 'closed'})]
+    name, snapshot = inner.notify_snapshot.call_args[0]
+    assert snapshot['things'] == {'door': {'state': 'open'},
+                                  'window': {'state': 'closed'}}
+    assert service.scanner.stopped
+    assert service.scanner.ident is None
+    inner.cleanup.assert_called_once_with()
+    assert threading.active_count() <= threads + 1
+
+
+@patch.object(thingpin.thingpin, 'pin_cleanup')
+@patch.object(thingpin.thingpin, 'set_pin_mode')
+@patch.object(thingpin.thingpin, 'setup_input_pin')
+@patch.object(RPi.GPIO, 'input')
+def test_async_runtime_waits_for_connect(mock_input, mock_setup,
+                                         mock_set_pin_mode, mock_cleanup):
+    from thingpin.aio import AsyncRuntime
+    mock_input.side_effect = lambda pin: HIGH if pin == 21 else LOW
+    connected = threading.Event()
+    inner = Mock()
+    inner.encode.side_effect = Notifier().encode
+    inner.initialize.side_effect = lambda things: connected.wait(5)
+
+    def notify(name, value, payload):
+        if not connected.is_set():
+            raise RuntimeError('not connected')
+    inner.notify.side_effect = notify
+    notifier = FanoutNotifier([inner], connect_timeout=0)
+    service = Thingpin(notifier, 'BCM', THINGS, scanner={'sleep': .001})
+    runtime = AsyncRuntime(service)
+    queue = notifier.notifiers[0]
+
+    # connect once the pins queued their first states
+    threading.Timer(.2, connected.set).start()
+    stop_when(runtime, lambda: inner.notify.call_count >= 2)
+    runtime.run()
+
+    assert sorted(c[1][:2] for c in inner.notify.mock_calls) == [
+        ('door', {'state': 'open'}), ('window', {'state': 'closed'})]
+    assert queue.stats['failed'] == 0
+
+
+def test_count_publishes_from_executor():
+    import asyncio
+    from thingpin.aio import AsyncRuntime
+    runtime = AsyncRuntime(Mock(scanner_config=None,
+                                notifier=QueuedNotifier(Mock())))
+    runtime.loop = asyncio.new_event_loop()
+    threads = []
+    pin = Mock(interval=0)
+    pin.publish.side_effect = lambda: threads.append(
+        threading.current_thread())
+
+    async def count():
+        task = runtime.loop.create_task(runtime.count(pin))
+        while not threads:
+            await asyncio.sleep(.01)
+        task.cancel()
+
+    try:
+        runtime.loop.run_until_complete(count())
+    finally:
+        runtime.loop.close()
+        runtime.executor.shutdown()
+    # totals are saved off the loop thread
+    assert threads[0] is not threading.current_thread()
+
+
+def test_queue_send_pending():
+    inner = Mock()
+    q = QueuedNotifier(inner)
+    q.threaded = False
+    pending = Mock()
+    q.on_pending = pending
+    q.initialize()
+    assert q.sender is None
+    # woken to publish what was queued before initialize()
+    assert pending.call_count == 1
+    pending.reset_mock()
+
+    q.notify('door', 'open')
+    q.notify_snapshot('thingpin', {})
+    assert pending.call_count == 2
+    q.send_pending()
+    inner.notify.assert_called_once_with('door', 'open', None)
+    inner.notify_snapshot.assert_called_once_with('thingpin', {})
+
+    # cleanup publishes what is left
+    q.notify('door', 'closed')
+    q.cleanup()
+    assert inner.notify.call_args == call('door', 'closed', None)
@@ -0,0 +1,166 @@
+try:
+    from unittest.mock import patch, Mock, call
+except ImportError:
+    from mock import patch, Mock, call
+
+import struct
+import threading
+import pytest
+
+import thingpin.gpio
+from thingpin.gpio import create_gpio, SimulatedGPIO, ReplayGPIO, BankGPIO
+
+HIGH = 1
+LOW = 0
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    clock = Clock()
+    with patch.object(thingpin.gpio, 'clock', clock):
+        yield clock
+
+
+def test_create_gpio():
+    assert isinstance(create_gpio({'backend': 'simulated', 'seed': 1}),
+                      SimulatedGPIO)
+    with pytest.raises(ValueError):
+        create_gpio({'backend': 'abacus'})
+
+
+def test_simulated_square(clock):
+    gpio = SimulatedGPIO(interval=1, pattern='square')
+    gpio.setup(3, gpio.IN, pull_up_down=gpio.PUD_UP)
+    readings = []
+    for i in range(8):
+        readings.append(gpio.input(3))
+        clock.now += .5
+    assert readings[0] == HIGH
+    # changes every second: two readings per level after the first change
+    changes = [i for i in range(1, 8) if readings[i] != readings[i - 1]]
+    assert [b - a for a, b in zip(changes, changes[1:])] == [2, 2]
+
+
+def test_simulated_static(clock):
+    gpio = SimulatedGPIO(interval=0)
+    clock.now += 1e6
+    assert gpio.input(4) == LOW
+
+
+def test_simulated_bounce_and_noise(clock):
+    gpio = SimulatedGPIO(interval=1, pattern='square', bounce=.2, seed=3)
+    gpio.input(1)
+    while gpio.pins[1][1] == 1000.0:
+        clock.now += .01
+        gpio.input(1)
+    level = gpio.pins[1][0]
+    bounced = set()
+    for i in range(19):
+        bounced.add(gpio.input(1))
+        clock.now += .01
+    assert bounced == set([HIGH, LOW])
+    clock.now += .05
+    assert gpio.input(1) == level
+
+    noisy = SimulatedGPIO(interval=0, noise=.5, seed=3)
+    assert set(noisy.input(1) for i in range(100)) == set([HIGH, LOW])
+
+
+def test_replay(clock, tmpdir):
+    trace = tmpdir.join('trace.txt')
+    trace.write('# t pin level\n'
+                '0.5 21 1\n'
+                '1.5 21 0\n'
+                '1.0 7 0\n')
+    gpio = ReplayGPIO(str(trace), speed=2)
+    gpio.setup(7, gpio.IN, pull_up_down=gpio.PUD_UP)
+    gpio.setmode(gpio.BCM)
+
+    assert (gpio.input(21), gpio.input(7), gpio.input(8)) == (LOW, HIGH, LOW)
+    clock.now += .3
+    assert (gpio.input(21), gpio.input(7)) == (HIGH, HIGH)
+    clock.now += .3
+    assert (gpio.input(21), gpio.input(7)) == (HIGH, LOW)
+    clock.now += .3
+    assert (gpio.input(21), gpio.input(7)) == (LOW, LOW)
+
+
+def test_replay_loop(clock, tmpdir):
+    trace = tmpdir.join('trace.txt')
+    trace.write('1 21 1\n2 21 0\n')
+    gpio = ReplayGPIO(str(trace), loop=True)
+    clock.now += 3.5
+    assert gpio.input(21) == HIGH
+
+
+def test_bank(tmpdir):
+    registers = tmpdir.join('gpiomem')
+    # GPLEV0 at 0x34, GPLEV1 at 0x38
+    registers.write(b'\0' * 0x34 + struct.pack('<II', 1 << 4 | 1, 1 << 21) +
+                    b'\0' * 8, mode='wb')
+    gpio = create_gpio({'backend': 'gpiomem', 'path': str(registers)})
+    assert isinstance(gpio, BankGPIO)
+    assert gpio.read_bank() == 1 << 53 | 1 << 4 | 1
+    assert [gpio.input(pin) for pin in (0, 1, 4, 53)] == \
+        [HIGH, LOW, HIGH, HIGH]
+
+    gpio = BankGPIO(str(registers), pins=32)
+    assert gpio.read_bank() == 1 << 4 | 1
+    with pytest.raises(ValueError):
+        gpio.input(53)
+    with pytest.raises(ValueError):
+        gpio.setmode(gpio.BOARD)
+
+
+def test_bank_delegates_setup(tmpdir):
+    registers = tmpdir.join('gpiomem')
+    registers.write(b'\0' * 64, mode='wb')
+    setup = Mock(IN=1, PUD_UP=2, PUD_DOWN=3, PUD_OFF=4)
+    gpio = BankGPIO(str(registers), setup=setup)
+    gpio.setmode(gpio.BCM)
+    gpio.setup(21, gpio.IN, pull_up_down=gpio.PUD_UP)
+    setup.setup.assert_called_once_with(21, 1, pull_up_down=2)
+    gpio.cleanup()
+    setup.cleanup.assert_called_once_with()
+
+
+def test_bank_file_too_small(tmpdir):
+    registers = tmpdir.join('gpiomem')
+    registers.write(b'\0' * 16, mode='wb')
+    with pytest.raises(ValueError):
+        BankGPIO(str(registers))
+
+
+class ScriptedGPIO(thingpin.gpio.BaseGPIO):
+    edge_poll = .0001
+
+    def __init__(self, levels):
+        super(ScriptedGPIO, self).__init__()
+        self.levels = iter(levels)
+        self.done = threading.Event()
+
+    def level(self, pin, now):
+        try:
+            self.last = next(self.levels)
+        except StopIteration:
+            self.done.set()
+        return self.last
+
+
+def test_add_event_detect():
+    gpio = ScriptedGPIO([LOW, HIGH, HIGH, LOW, HIGH, LOW, LOW, HIGH])
+    edges = []
+    gpio.add_event_detect(21, gpio.RISING, callback=edges.append)
+    with pytest.raises(RuntimeError):
+        gpio.add_event_detect(21, gpio.BOTH)
+    assert gpio.done.wait(5)
+    gpio.remove_event_detect(21)
+    assert edges == [21, 21, 21]
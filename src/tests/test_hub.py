@@ -0,0 +1,170 @@
+try:
+    from unittest.mock import patch, Mock, call
+except ImportError:
+    from mock import patch, Mock, call
+
+import os
+import sys
+import time
+import socket
+import subprocess
+import pytest
+
+from thingpin.hub import (Hub, HubNotifier, Frame, STATE, SNAPSHOT, FRAME,
+                          MAGIC, VERSION, pack_frame, unpack_frames,
+                          pack_datagrams, serve_hub)
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_frames():
+    data = pack_frame(STATE, 'pi1', 7, 1, 'door', b'{"state":"open"}') + \
+        pack_frame(SNAPSHOT, 'pi1', 7, 2, 'thingpin', b'{}')
+    frames, rest = unpack_frames(data)
+    assert frames == [Frame(STATE, 'pi1', 7, 1, 'door', {'state': 'open'}),
+                      Frame(SNAPSHOT, 'pi1', 7, 2, 'thingpin', {})]
+    assert rest == b''
+
+    # a partial frame waits for the rest
+    frames, rest = unpack_frames(data[:-3])
+    assert len(frames) == 1
+    assert unpack_frames(rest + data[-3:])[0] == [frames[0]._replace(
+        kind=SNAPSHOT, seq=2, name='thingpin', value={})]
+
+    with pytest.raises(ValueError):
+        unpack_frames(b'GET / HTTP/1.1\r\n\r\n')
+
+
+def test_frame_encodings():
+    msgpack = pytest.importorskip('msgpack')
+    node = HubNotifier(node='pi1', encoding='msgpack')
+    payload = node.encode({'state': 'open'})
+    assert payload == msgpack.packb({'state': 'open'})
+    frames, _ = unpack_frames(pack_frame(STATE, 'pi1', 7, 1, 'door', payload,
+                                         node.encoding.code))
+    assert frames[0].value == {'state': 'open'}
+
+    with pytest.raises(ValueError):
+        unpack_frames(pack_frame(STATE, 'pi1', 7, 1, 'door', b'{}', 99))
+    with pytest.raises(ValueError):
+        unpack_frames(pack_frame(STATE, 'pi1', 7, 1, 'door', b'{'))
+    with pytest.raises(ValueError):
+        HubNotifier(encoding='delta')
+
+
+@pytest.mark.parametrize('body', [
+    b'',
+    # name lengths past the body
+    b'\x03pi',
+    b'\x03pi1\x09door',
+    # not UTF-8
+    b'\x01\xff\x04door{}',
+])
+def test_malformed_frames(body):
+    data = FRAME.pack(MAGIC, VERSION, STATE, 0, 1, 1, len(body)) + body
+    with pytest.raises(ValueError):
+        unpack_frames(data)
+
+
+def test_pack_datagrams():
+    assert list(pack_datagrams([b'ab', b'cd', b'ef'], size=4)) == [
+        b'abcd', b'ef']
+
+
+def test_hub_drops_duplicates():
+    notifier = Mock()
+    hub = Hub(notifier)
+    hub.receive([Frame(STATE, 'pi1', 7, 1, 'door', 'open'),
+                 Frame(STATE, 'pi1', 7, 1, 'door', 'open'),
+                 Frame(STATE, 'pi2', 9, 1, 'shed', 'open'),
+                 Frame(STATE, 'pi1', 7, 3, 'door', 'closed'),
+                 # late, older than the last one for door
+                 Frame(STATE, 'pi1', 7, 2, 'door', 'open'),
+                 # node restarted
+                 Frame(STATE, 'pi1', 8, 1, 'door', 'ajar'),
+                 Frame(SNAPSHOT, 'pi1', 8, 2, 'thingpin', {'things': {}})])
+    assert notifier.notify.mock_calls == [call('door', 'open'),
+                                          call('shed', 'open'),
+                                          call('door', 'closed'),
+                                          call('door', 'ajar')]
+    notifier.notify_snapshot.assert_called_once_with('thingpin-pi1',
+                                                     {'things': {}})
+    assert hub.stats == dict(frames=7, duplicates=2, invalid=0, nodes=2)
+
+
+NODE = '''
+import sys
+from thingpin.hub import HubNotifier
+port, transport, node = int(sys.argv[1]), sys.argv[2], sys.argv[3]
+notifier = HubNotifier(host='127.0.0.1', port=port, transport=transport,
+                       node=node)
+notifier.initialize()
+notifier.notify_batch([(node + '-door', {'state': 'open'}, None),
+                       (node + '-window', {'state': 'closed'}, None)])
+notifier.notify(node + '-door', {'state': 'closed'})
+notifier.cleanup()
+'''
+
+
+@pytest.mark.parametrize('transport', ['tcp', 'udp'])
+def test_hub_with_node_processes(transport):
+    notifier = Mock()
+    hub = Hub(notifier)
+    server, = serve_hub(hub, '127.0.0.1:0', [transport])
+    port = server.server_address[1]
+    try:
+        nodes = ['pi{}'.format(i) for i in range(3)]
+        for node in nodes:
+            subprocess.check_call([sys.executable, '-c', NODE, str(port),
+                                   transport, node], cwd=SRC)
+        deadline = time.time() + 5
+        while notifier.notify.call_count < 9 and time.time() < deadline:
+            time.sleep(.01)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    for node in nodes:
+        calls = [c for c in notifier.notify.mock_calls
+                 if c[1][0].startswith(node)]
+        assert calls == [call(node + '-door', {'state': 'open'}),
+                         call(node + '-window', {'state': 'closed'}),
+                         call(node + '-door', {'state': 'closed'})]
+    assert hub.stats['nodes'] == 3
+
+
+def test_hub_rejects_invalid_data():
+    hub = Hub(Mock())
+    server, = serve_hub(hub, '127.0.0.1:0', ['tcp'])
+    try:
+        sock = socket.create_connection(server.server_address[:2])
+        sock.sendall(b'GET / HTTP/1.1\r\n\r\n')
+        # the hub hangs up
+        assert sock.recv(10) == b''
+        sock.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert hub.stats['invalid'] == 1
+
+
+def test_hub_notifier_reconnects():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    notifier = HubNotifier(host='127.0.0.1', port=port, node='pi1')
+    # nothing listening yet
+    notifier.initialize()
+    assert not notifier.connected
+    with pytest.raises(socket.error):
+        notifier.notify('door', {'state': 'open'})
+
+    sock.listen(1)
+    notifier.notify('door', {'state': 'open'}, b'{"state":"open"}')
+    conn, _ = sock.accept()
+    frames, _ = unpack_frames(conn.recv(1024))
+    assert frames == [Frame(STATE, 'pi1', notifier.session, 2, 'door',
+                            {'state': 'open'})]
+    conn.close()
+    sock.close()
+    notifier.cleanup()
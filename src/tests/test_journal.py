@@ -0,0 +1,140 @@
+try:
+    from unittest.mock import patch, Mock, call
+except ImportError:
+    from mock import patch, Mock, call
+
+import os
+import sys
+import pytest
+
+# pick up our RPi stub
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import RPi
+import thingpin.pin
+import thingpin.journal
+from thingpin.pin import Scanner
+from thingpin.gpio import ReplayGPIO
+from thingpin.journal import Journal, Edge, read_journal, summarize
+
+thingpin.pin.use_gpio(RPi.GPIO)
+HIGH = 1
+LOW = 0
+
+
+def test_journal_records_edges(tmpdir):
+    path = str(tmpdir.join('edges.journal'))
+    j = Journal(path, capacity=8)
+    j.record(21, HIGH, ns=1000)
+    j.record(20, LOW, ns=2000)
+    assert j.edges() == [Edge(1000, 21, HIGH), Edge(2000, 20, LOW)]
+    j.close()
+    assert read_journal(path) == [Edge(1000, 21, HIGH), Edge(2000, 20, LOW)]
+
+
+def test_journal_is_a_ring(tmpdir):
+    path = str(tmpdir.join('edges.journal'))
+    j = Journal(path, capacity=3)
+    for i in range(5):
+        j.record(21, i % 2, ns=i)
+    assert len(j) == 3
+    assert [e.ns for e in j.edges()] == [2, 3, 4]
+    assert os.path.getsize(path) == 64 + 3 * 12
+    j.close()
+
+    # reopening continues the ring with the capacity of the file
+    j = Journal(path, capacity=100)
+    j.record(21, HIGH, ns=5)
+    assert [e.ns for e in j.edges()] == [3, 4, 5]
+    j.close()
+
+
+@patch.object(thingpin.journal, 'boot_id', return_value=b'a' * 16)
+@patch.object(thingpin.journal, 'wall_anchor', return_value=10 ** 12)
+def test_journal_rebases_after_reboot(mock_anchor, mock_boot, tmpdir):
+    path = str(tmpdir.join('edges.journal'))
+    j = Journal(path, capacity=8)
+    j.record(21, HIGH, ns=5 * 10 ** 9)
+    j.close()
+
+    # same boot, times are kept
+    j = Journal(path)
+    assert j.edges() == [Edge(5 * 10 ** 9, 21, HIGH)]
+    j.close()
+
+    # rebooted 100 s of wall time later, monotonic time starts over
+    mock_boot.return_value = b'b' * 16
+    mock_anchor.return_value = 10 ** 12 + 100 * 10 ** 9
+    j = Journal(path)
+    j.record(21, LOW, ns=2 * 10 ** 9)
+    assert j.edges() == [Edge(-95 * 10 ** 9, 21, HIGH),
+                         Edge(2 * 10 ** 9, 21, LOW)]
+    assert summarize(j.edges())[21]['last'] == pytest.approx(97)
+    j.close()
+
+
+def test_journal_rebooted_without_boot_ids():
+    assert not thingpin.journal.rebooted(None, None, 10 ** 12, 10 ** 12 + 1)
+    assert thingpin.journal.rebooted(None, None, 10 ** 12, 2 * 10 ** 12)
+    assert thingpin.journal.rebooted(b'a' * 16, b'b' * 16, 1, 1)
+
+
+def test_journal_survives_without_close(tmpdir):
+    path = str(tmpdir.join('edges.journal'))
+    j = Journal(path, capacity=8)
+    j.record(21, HIGH, ns=1)
+    # another reader sees the edge before the journal is flushed or closed
+    assert read_journal(path) == [Edge(1, 21, HIGH)]
+    j.close()
+
+
+def test_not_a_journal(tmpdir):
+    path = tmpdir.join('trace.txt')
+    path.write('0 21 1\n')
+    with pytest.raises(ValueError):
+        read_journal(str(path))
+
+
+def test_summarize():
+    edges = [Edge(0, 21, HIGH), Edge(1000000, 21, LOW),
+             Edge(2000000, 21, HIGH), Edge(500000000, 21, LOW),
+             Edge(10000000, 20, HIGH)]
+    summary = summarize(edges)
+    assert summary[20] == {'edges': 1, 'first': .01, 'last': .01,
+                           'bounces': 0, 'min_gap': None,
+                           'median_gap': None}
+    assert summary[21]['edges'] == 4
+    assert summary[21]['bounces'] == 2
+    assert summary[21]['min_gap'] == pytest.approx(.001)
+    assert summary[21]['last'] == pytest.approx(.5)
+
+
+@patch('time.sleep', return_value=None)
+@patch.object(thingpin.pin.GPIO, 'input')
+def test_scanner_journals_raw_edges(mock_input, mock_time, tmpdir):
+    """Bounces rejected by the debouncer are still journaled"""
+    mock_input.side_effect = [LOW, HIGH, LOW, LOW, HIGH]
+    j = Journal(str(tmpdir.join('edges.journal')))
+    observer = Mock()
+    s = Scanner(sleep=[0] * 5, journal=j)
+    s.add(observer, 19, debounce_delay=60)
+    s.start()
+    s.join()
+
+    assert [(e.pin, e.level) for e in j.edges()] == [
+        (19, LOW), (19, HIGH), (19, LOW), (19, HIGH)]
+    assert observer.update_pin.mock_calls == [call(19, LOW)]
+    j.close()
+
+
+def test_replay_journal(tmpdir):
+    path = str(tmpdir.join('edges.journal'))
+    j = Journal(path)
+    j.record(21, HIGH, ns=5000000000)
+    j.record(21, LOW, ns=7000000000)
+    j.close()
+
+    gpio = ReplayGPIO(path)
+    assert gpio.edges == {21: ([0.0, 2.0], [HIGH, LOW])}
+    assert gpio.level(21, gpio.start + 1) == HIGH
+    assert gpio.level(21, gpio.start + 2.5) == LOW
@@ -1,8 +1,93 @@
 import thingpin
-from thingpin.logger import Logger
+from thingpin.logger import Logger, LogWriter, QueueHandler
+import logging
+import os
+import time
+import tempfile
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 def test_logger_file():
     assert Logger(log_file='foo.log')
 
 def test_logger_stdout():
     assert Logger()
+
+def test_logger_queued():
+    path = os.path.join(tempfile.mkdtemp(), 'queued.log')
+    log = Logger(name='thingpin-queued', log_file=path, queued=True,
+                 flush_interval=60)
+    handler, = log.handlers
+    assert isinstance(handler, QueueHandler)
+
+    state = {'state': 'open'}
+    log.info('publish(%s=%s)', 'door', state)
+    log.error('boom')
+    # errors are flushed right away
+    for _ in range(100):
+        with open(path) as f:
+            text = f.read()
+        if 'boom' in text:
+            break
+        time.sleep(.01)
+    assert "publish(door={'state': 'open'})" in text
+    assert 'ERROR boom' in text
+
+class Handler(logging.Handler):
+    batching = False
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.written = []
+        self.flushes = 0
+
+    def emit(self, record):
+        self.written.append((record.getMessage(), self.batching))
+
+    def flush(self):
+        self.flushes += 1
+
+def test_log_writer_batches_flushes():
+    records = queue.Queue()
+    handler = Handler()
+    writer = LogWriter(records, handler, flush_interval=60)
+    q = QueueHandler(records)
+    for i in range(5):
+        q.handle(logging.LogRecord('t', logging.INFO, '', 0, 'msg %d',
+                                   (i,), None))
+    writer.start()
+    writer.stop()
+
+    assert handler.written == [('msg %d' % i, True) for i in range(5)]
+    assert handler.flushes == 1
+
+@patch('time.time', return_value=0.0)
+def test_log_writer_flush_ignores_wall_clock(mock_time):
+    # the wall clock stands still, as after a step back at boot
+    records = queue.Queue()
+    handler = Handler()
+    writer = LogWriter(records, handler, flush_interval=.05)
+    writer.start()
+    QueueHandler(records).handle(logging.LogRecord('t', logging.INFO, '', 0,
+                                                   'msg', (), None))
+    for _ in range(200):
+        if handler.flushes:
+            break
+        time.sleep(.01)
+    assert handler.flushes == 1
+    writer.stop()
+
+def test_queue_handler_drops_when_full():
+    q = QueueHandler(queue.Queue(1))
+    for i in range(3):
+        q.handle(logging.LogRecord('t', logging.INFO, '', 0, 'msg', (),
+                                   None))
+    assert q.dropped == 2
@@ -5,33 +5,37 @@ except ImportError:
 
 import os
 import sys
-import pkg_resources
+import time
+import threading
+import subprocess
 
 import thingpin
 import thingpin.main
+import thingpin.gpio
 from thingpin.main import main
 
 def test_run_not_on_pi():
-    config = pkg_resources.resource_filename('thingpin',
-                                             'thingpin-config.yml.sample')
-    with patch.object(sys, 'argv', ['thingpin', '-c', config, 'run']):
-        # returns non-zero (unless running on RPi)
-        assert main() == 1
+    config = thingpin.main.SAMPLE_CONFIG
+    # other tests put an RPi stub on sys.path, make sure it is not found
+    with patch.dict(sys.modules, {'RPi': None, 'RPi.GPIO': None}):
+        with patch.object(sys, 'argv', ['thingpin', '-c', config, 'run']):
+            # returns non-zero (unless running on RPi)
+            assert main() == 1
 
+@patch.object(thingpin.main, 'create_gpio')
 @patch.object(thingpin.main, 'Thingpin')
-def test_run_on_pi(MockThingpin):
-    config = pkg_resources.resource_filename('thingpin',
-                                             'thingpin-config.yml.sample')
+def test_run_on_pi(MockThingpin, mock_create_gpio):
+    config = thingpin.main.SAMPLE_CONFIG
     with patch.object(sys, 'argv', ['thingpin', '-c', config, 'run']):
         mock_thingpin = Mock()
         MockThingpin.return_value = mock_thingpin
         assert main() is None
         mock_thingpin.run.assert_called_once_with()
 
+@patch.object(thingpin.main, 'create_gpio')
 @patch.object(thingpin.main, 'Thingpin')
-def test_run_on_pi_ctrl_c(MockThingpin):
-    config = pkg_resources.resource_filename('thingpin',
-                                             'thingpin-config.yml.sample')
+def test_run_on_pi_ctrl_c(MockThingpin, mock_create_gpio):
+    config = thingpin.main.SAMPLE_CONFIG
     with patch.object(sys, 'argv', ['thingpin', '-c', config, 'run']):
         mock_thingpin = Mock()
         MockThingpin.return_value = mock_thingpin
@@ -40,11 +44,12 @@ def test_run_on_pi_ctrl_c(MockThingpin):
         mock_thingpin.run.assert_called_once_with()
         mock_thingpin.cleanup.assert_called_once_with()
 
+@patch.object(thingpin.main, 'create_gpio')
 @patch.object(thingpin.main, 'Thingpin')
 @patch.object(thingpin.main, 'Logger')
-def test_run_on_pi_as_daemon(MockThingpin, MockLogger, tmpdir):
-    config = pkg_resources.resource_filename('thingpin',
-                                             'thingpin-config.yml.sample')
+def test_run_on_pi_as_daemon(MockThingpin, MockLogger, mock_create_gpio,
+                             tmpdir):
+    config = thingpin.main.SAMPLE_CONFIG
     with patch.object(sys, 'argv',
                       [
                         'thingpin',
@@ -56,13 +61,66 @@ def test_run_on_pi_as_daemon(MockThingpin, MockLogger, tmpdir):
         assert main() is None
         # mock_thingpin.run.assert_called_once_with()
 
+def test_run_simulated(tmpdir):
+    config = tmpdir.join('thingpin-config.yml')
+    config.write('''
+notifiers:
+    adafruit:
+        username: u
+        api_key: k
+gpio:
+    backend: simulated
+pin_mode: BCM
+things:
+    door:
+        pin: 21
+        iot_states:
+            HIGH: {state: open}
+            LOW: {state: closed}
+''')
+    with patch.object(thingpin.main, 'Thingpin') as MockThingpin:
+        with patch.object(sys, 'argv',
+                          ['thingpin', '-c', str(config), 'run']):
+            assert main() is None
+    gpio = MockThingpin.call_args[1]['gpio']
+    assert isinstance(gpio, thingpin.gpio.SimulatedGPIO)
+
 def test_install_service():
-    config = pkg_resources.resource_filename('thingpin',
-                                             'thingpin-config.yml.sample')
+    config = thingpin.main.SAMPLE_CONFIG
     with patch.object(sys, 'argv',
         ['thingpin', '-c', config, 'install-service']):
         assert main() is None
 
+def test_reloader_runs_one_reload_at_a_time():
+    running = threading.Lock()
+    overlapped = []
+    calls = []
+    release = threading.Event()
+
+    def reload():
+        if not running.acquire(False):
+            overlapped.append(True)
+            return
+        calls.append(len(calls))
+        release.wait(5)
+        running.release()
+
+    request = thingpin.main.start_reloader(reload)
+    request()
+    deadline = time.time() + 5
+    while not calls and time.time() < deadline:
+        time.sleep(.01)
+    # back to back, like two SIGHUPs while the first reload stops pins
+    request()
+    request()
+    release.set()
+    deadline = time.time() + 5
+    while len(calls) < 2 and time.time() < deadline:
+        time.sleep(.01)
+    time.sleep(.1)
+    assert calls == [0, 1]
+    assert not overlapped
+
 def test_create_config(tmpdir):
     wd = os.getcwd()
     try:
@@ -84,3 +142,100 @@ def test_create_config_already_exists(tmpdir):
         os.chdir(wd)
 
 
+
+def test_journal(tmpdir, capsys):
+    from thingpin.journal import Journal
+    path = str(tmpdir.join('edges.journal'))
+    j = Journal(path)
+    j.record(21, 1, ns=1000000000)
+    j.record(21, 0, ns=1001000000)
+    j.close()
+
+    with patch.object(sys, 'argv', ['thingpin', 'journal', path]):
+        assert main() is None
+    assert capsys.readouterr().out == ('0.000000000 21 1\n'
+                                       '0.001000000 21 0\n')
+
+    with patch.object(sys, 'argv', ['thingpin', 'journal', '--summary',
+                                    path]):
+        assert main() is None
+    out = capsys.readouterr().out.splitlines()
+    assert out[1].split() == ['21', '2', '1', '0.001000', '0.001000',
+                              '0.000', '0.001']
+
+def test_reload_config(tmpdir):
+    config_file = tmpdir.join('thingpin-config.yml')
+    config_file.write('pin_mode: BCM\nthings: {door: {pin: 21}}\n')
+    service = Mock()
+    log = Mock()
+    thingpin.main.reload_config(str(config_file), {'pin_mode': 'BOARD'},
+                                service, log)
+    service.reload.assert_called_once_with({'door': {'pin': 21}})
+    log.info.assert_any_call(
+        'reload: restart to apply the changed pin_mode config')
+
+    config_file.write('profiles: {zone: {resistor: pull_up}}\n'
+                      'things:\n'
+                      '    zone{n}: {profile: zone, pins: 4-5}\n')
+    service.reset_mock()
+    log.reset_mock()
+    thingpin.main.reload_config(str(config_file), {}, service, log)
+    service.reload.assert_called_once_with({
+        'zone1': {'resistor': 'pull_up', 'pin': 4},
+        'zone2': {'resistor': 'pull_up', 'pin': 5}})
+    assert not log.info.call_args_list[1:]
+
+    config_file.write('things: [')
+    service.reset_mock()
+    thingpin.main.reload_config(str(config_file), {}, service, log)
+    assert not service.reload.called
+    assert log.exception.called
+
+def test_reloader_runs_one_reload_at_a_time():
+    running = threading.Lock()
+    overlapped = []
+    calls = []
+    release = threading.Event()
+
+    def reload():
+        if not running.acquire(False):
+            overlapped.append(True)
+            return
+        calls.append(len(calls))
+        release.wait(5)
+        running.release()
+
+    request = thingpin.main.start_reloader(reload)
+    request()
+    deadline = time.time() + 5
+    while not calls and time.time() < deadline:
+        time.sleep(.01)
+    # back to back, like two SIGHUPs while the first reload stops pins
+    request()
+    request()
+    release.set()
+    deadline = time.time() + 5
+    while len(calls) < 2 and time.time() < deadline:
+        time.sleep(.01)
+    time.sleep(.1)
+    assert calls == [0, 1]
+    assert not overlapped
+
+def test_create_config(tmpdir):
+    with tmpdir.as_cwd():
+        with patch.object(sys, 'argv', ['thingpin', 'create-config']):
+            assert main() is None
+            assert main() == 2
+        with open(thingpin.main.SAMPLE_CONFIG) as f:
+            assert tmpdir.join('thingpin-config.yml').read() == f.read()
+
+def test_notifier_libraries_imported_lazily():
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.check_output([sys.executable, '-c', """
+import sys
+import thingpin.main
+import thingpin.notifiers
+print(sorted(m for m in ['yaml', 'pkg_resources', 'thingamon',
+                         'Adafruit_IO'] if m in sys.modules))
+"""], cwd=src)
+    assert out.strip() == b'[]'
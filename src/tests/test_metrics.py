@@ -0,0 +1,92 @@
+try:
+    from unittest.mock import patch, Mock, call
+except ImportError:
+    from mock import patch, Mock, call
+
+import os
+import socket
+import tempfile
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+from thingpin.metrics import Metric, Histogram, Registry, serve_metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram(buckets=(.1, 1))
+    for value in [.05, .1, .5, 2]:
+        h.observe(value)
+    m = h.metric('latency', 'help', {'notifier': 'aws'})
+    assert m.type == 'histogram'
+    assert m.samples == [
+        ('_bucket', {'notifier': 'aws', 'le': '0.1'}, 2),
+        ('_bucket', {'notifier': 'aws', 'le': '1.0'}, 3),
+        ('_bucket', {'notifier': 'aws', 'le': '+Inf'}, 4),
+        ('_sum', {'notifier': 'aws'}, 2.65),
+        ('_count', {'notifier': 'aws'}, 4),
+    ]
+
+
+def test_registry_merges_metrics_with_same_name():
+    registry = Registry()
+    for name in ['aws', 'adafruit']:
+        registry.register(lambda name=name: [
+            Metric('depth', 'gauge', 'Queue depth',
+                   [('', {'notifier': name}, 1)])])
+    registry.register(lambda: [Metric('threads', 'gauge', 'Threads',
+                                      [('', {}, 3)])])
+
+    assert registry.exposition() == (
+        '# HELP depth Queue depth\n'
+        '# TYPE depth gauge\n'
+        'depth{notifier="aws"} 1\n'
+        'depth{notifier="adafruit"} 1\n'
+        '# HELP threads Threads\n'
+        '# TYPE threads gauge\n'
+        'threads 3\n')
+
+
+def test_label_values_escaped():
+    registry = Registry()
+    registry.register(lambda: [Metric('m', 'gauge', 'h',
+                                      [('', {'thing': 'a"b\\'}, 1.5)])])
+    assert 'm{thing="a\\"b\\\\"} 1.5\n' in registry.exposition()
+
+
+def test_serve_metrics_tcp():
+    registry = Registry()
+    registry.register(lambda: [Metric('up', 'gauge', 'Up', [('', {}, 1)])])
+    server = serve_metrics(registry, '127.0.0.1:0')
+    try:
+        port = server.server_address[1]
+        body = urlopen('http://127.0.0.1:{}/metrics'.format(port)).read()
+        assert body.decode('utf-8').endswith('up 1\n')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve_metrics_unix_socket():
+    registry = Registry()
+    registry.register(lambda: [Metric('up', 'gauge', 'Up', [('', {}, 1)])])
+    path = os.path.join(tempfile.mkdtemp(), 'metrics.sock')
+    server = serve_metrics(registry, path)
+    try:
+        s = socket.socket(socket.AF_UNIX)
+        s.connect(path)
+        s.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+        response = b''
+        while True:
+            data = s.recv(4096)
+            if not data:
+                break
+            response += data
+        s.close()
+        assert response.startswith(b'HTTP/1.0 200')
+        assert response.endswith(b'up 1\n')
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,564 @@
+try:
+    from unittest.mock import patch, Mock, call
+except ImportError:
+    from mock import patch, Mock, call
+
+import sys
+import json
+import time
+import threading
+import pytest
+
+import thingpin.aws
+import thingpin.notifiers
+import thingpin.adafruit
+from thingpin.notifiers import (create_notifier, create_notifiers,
+                                QueuedNotifier, FanoutNotifier)
+from thingpin.aws import AWSIoTNotifier
+from thingpin.adafruit import AdafruitNotifier
+from thingpin.statecache import StateCache
+from thingpin.thingpin import freeze
+
+
+def test_create_notifier_queued_by_default():
+    notifier = create_notifier('adafruit', {'username': 'u', 'api_key': 'k'})
+    assert isinstance(notifier, QueuedNotifier)
+    assert isinstance(notifier.notifier, AdafruitNotifier)
+
+
+def test_create_notifier_queue_options():
+    notifier = create_notifier('adafruit', {
+        'username': 'u', 'api_key': 'k',
+        'queue': {'size': 3, 'overflow': 'coalesce'}})
+    assert notifier.size == 3
+    assert notifier.overflow == 'coalesce'
+
+
+def test_create_notifier_no_queue():
+    notifier = create_notifier('adafruit', {
+        'username': 'u', 'api_key': 'k', 'queue': False})
+    assert isinstance(notifier, AdafruitNotifier)
+
+
+def test_create_notifier_unknown():
+    with pytest.raises(ValueError):
+        create_notifier('carrier-pigeon', {})
+
+
+def test_queue_invalid_overflow():
+    with pytest.raises(ValueError):
+        QueuedNotifier(Mock(), overflow='drop_newest')
+
+
+def test_queue_sends_in_order():
+    inner = Mock()
+    q = QueuedNotifier(inner)
+    q.initialize()
+    for i in range(5):
+        q.notify('door', i)
+    q.cleanup()
+
+    inner.initialize.assert_called_once_with(None)
+    inner.cleanup.assert_called_once_with()
+    assert inner.notify.mock_calls == [call('door', i, None) for i in range(5)]
+    assert q.stats == dict(enqueued=5, sent=5, dropped=0, coalesced=0,
+                           failed=0, batches=0, spooled=0,
+                           deduped=0, snapshots=0, snapshots_replaced=0)
+
+
+def test_queue_drop_oldest():
+    inner = Mock()
+    q = QueuedNotifier(inner, size=2)
+    # sender not started yet so everything stays queued
+    for i in range(5):
+        q.notify('door', i)
+    assert q.depth == 2
+
+    q.initialize()
+    q.cleanup()
+    assert inner.notify.mock_calls == [call('door', 3, None),
+                                       call('door', 4, None)]
+    assert q.stats == dict(enqueued=5, sent=2, dropped=3, coalesced=0,
+                           failed=0, batches=0, spooled=0,
+                           deduped=0, snapshots=0, snapshots_replaced=0)
+
+
+def test_queue_coalesce():
+    inner = Mock()
+    q = QueuedNotifier(inner, size=2, overflow='coalesce')
+    q.notify('door', 'open')
+    q.notify('window', 'open')
+    q.notify('door', 'closed')
+    q.notify('water', 'dry')
+    assert q.depth == 2
+
+    q.initialize()
+    q.cleanup()
+    # the refreshed door is newer than window, which is dropped
+    assert inner.notify.mock_calls == [call('door', 'closed', None),
+                                       call('water', 'dry', None)]
+    assert q.stats == dict(enqueued=4, sent=2, dropped=1, coalesced=1,
+                           failed=0, batches=0, spooled=0,
+                           deduped=0, snapshots=0, snapshots_replaced=0)
+
+
+def test_queue_failed_publish_does_not_stop_sender():
+    inner = Mock()
+    inner.notify.side_effect = [RuntimeError('boom'), None]
+    q = QueuedNotifier(inner)
+    q.notify('door', 'open')
+    q.notify('door', 'closed')
+    q.initialize()
+    q.cleanup()
+    assert len(inner.notify.mock_calls) == 2
+    assert q.stats['sent'] == 1
+    assert q.stats['failed'] == 1
+
+
+@patch.object(thingpin.aws, 'Client')
+def test_aws_publishes_cached_payloads(MockClient):
+    open_state = freeze({'state': 'open'})
+    things = {'door': {'pin': 21, 'iot_states': {
+        'HIGH': {'state': 'open'},
+        'LOW': {'state': 'closed'}}}}
+    notifier = AWSIoTNotifier(host='h', client_cert='c', private_key='k')
+    notifier.initialize(things)
+    client = MockClient.return_value
+
+    cached = notifier.things['door']
+    assert cached.topic == '$aws/things/door/shadow/update'
+    with patch.object(notifier, 'encode', wraps=notifier.encode) as encode:
+        notifier.notify('door', open_state)
+        notifier.notify('door', freeze({'state': 'closed'}))
+        # plain dicts, like outbox replays, are looked up frozen
+        notifier.notify('door', {'state': 'open'})
+        assert not encode.called
+        # states outside iot_states are encoded
+        notifier.notify('door', {'state': 'ajar', 'zones': [1, 2]})
+        assert encode.call_count == 1
+
+    notifier.notify('garage', {'state': 'open'})
+    assert notifier.things['garage'].topic == \
+        '$aws/things/garage/shadow/update'
+
+    assert [json.loads(c[1][1]) for c in client.publish.mock_calls] == [
+        {'state': {'reported': {'state': 'open'}}},
+        {'state': {'reported': {'state': 'closed'}}},
+        {'state': {'reported': {'state': 'open'}}},
+        {'state': {'reported': {'state': 'ajar', 'zones': [1, 2]}}},
+        {'state': {'reported': {'state': 'open'}}},
+    ]
+
+    notifier.notify('door', open_state, b'prepared')
+    assert client.publish.mock_calls[-1] == call(cached.topic, b'prepared')
+
+
+def test_queue_passes_payload():
+    inner = Mock()
+    q = QueuedNotifier(inner, overflow='coalesce')
+    q.notify('door', 'open', b'1')
+    q.notify('door', 'closed', b'0')
+    q.initialize()
+    q.cleanup()
+    assert inner.notify.mock_calls == [call('door', 'closed', b'0')]
+
+
+def test_adafruit_encode():
+    notifier = AdafruitNotifier(username='u', api_key='k')
+    assert notifier.encode({'state': 'open'}) == b'open'
+    assert notifier.encode({'state': 1}) == b'1'
+
+
+def test_create_notifiers_one():
+    notifier = create_notifiers({'adafruit': {'username': 'u',
+                                              'api_key': 'k'}})
+    assert isinstance(notifier.notifier, AdafruitNotifier)
+
+
+def test_create_notifiers_fanout():
+    notifier = create_notifiers({
+        'adafruit': {'username': 'u', 'api_key': 'k'},
+        'aws': {'host': 'h', 'client_cert': 'c', 'private_key': 'k',
+                'queue': False},
+    })
+    assert isinstance(notifier, FanoutNotifier)
+    assert [type(n.notifier) for n in notifier.notifiers] == [
+        AdafruitNotifier, AWSIoTNotifier]
+
+
+def test_fanout_publishes_to_all():
+    a = Mock()
+    a.encode.return_value = b'a'
+    b = Mock()
+    b.encode.return_value = b'b'
+    fanout = FanoutNotifier([a, b])
+    fanout.initialize({'door': {}})
+    payload = fanout.encode('open')
+    fanout.notify('door', 'open', payload)
+    fanout.notify('door', 'closed')
+    fanout.cleanup()
+
+    for inner, expected in [(a, b'a'), (b, b'b')]:
+        inner.initialize.assert_called_once_with({'door': {}})
+        assert inner.notify.mock_calls == [call('door', 'open', expected),
+                                           call('door', 'closed', None)]
+        inner.cleanup.assert_called_once_with()
+
+
+def test_fanout_isolates_failures():
+    down = Mock()
+    down.initialize.side_effect = RuntimeError('connection refused')
+    slow = Mock()
+    slow.initialize.side_effect = lambda things: threading.Event().wait(5)
+    up = Mock()
+    fanout = FanoutNotifier([down, slow, up], connect_timeout=.1)
+    fanout.initialize()
+    fanout.notify('door', 'open')
+    fanout.notifiers[2].cleanup()
+
+    up.notify.assert_called_once_with('door', 'open', None)
+    assert not down.notify.called
+    assert not slow.notify.called
+    assert fanout.notifiers[1].depth == 1
+
+
+def test_fanout_retries_initialize():
+    flaky = Mock()
+    flaky.initialize.side_effect = [RuntimeError('connection refused'),
+                                    RuntimeError('connection refused'),
+                                    None]
+    sent = threading.Event()
+    flaky.notify.side_effect = lambda *args: sent.set()
+    down = Mock()
+    down.initialize.side_effect = RuntimeError('connection refused')
+    fanout = FanoutNotifier([flaky, down], connect_timeout=.1,
+                            retry_min=.01, retry_max=.02)
+    fanout.initialize()
+    fanout.notify('door', 'open')
+    assert sent.wait(5)
+    assert flaky.initialize.call_count == 3
+    flaky.notify.assert_called_once_with('door', 'open', None)
+
+    fanout.cleanup()
+    flaky.cleanup.assert_called_once_with()
+    # never initialized, not cleaned up and no longer retried
+    assert not down.cleanup.called
+    time.sleep(.05)
+    calls = down.initialize.call_count
+    time.sleep(.1)
+    assert down.initialize.call_count == calls
+
+
+def test_create_notifiers_fanout_ignores_queue_false():
+    with patch.object(thingpin.notifiers.logging, 'getLogger') as getLogger:
+        create_notifiers({
+            'adafruit': {'username': 'u', 'api_key': 'k'},
+            'aws': {'host': 'h', 'client_cert': 'c', 'private_key': 'k',
+                    'queue': False},
+        })
+    assert 'aws: queue: false is ignored' in \
+        getLogger.return_value.warning.call_args[0][0]
+
+
+def test_create_notifier_batch_options():
+    notifier = create_notifier('adafruit', {
+        'username': 'u', 'api_key': 'k',
+        'batch': {'max_latency': 2.5, 'max_size': 10}})
+    assert notifier.batch_latency == 2.5
+    assert notifier.batch_size == 10
+
+    with pytest.raises(ValueError):
+        create_notifier('adafruit', {
+            'username': 'u', 'api_key': 'k', 'queue': False, 'batch': {}})
+
+
+def test_queue_batches_keep_last_value_per_thing():
+    inner = Mock()
+    q = QueuedNotifier(inner, batch_size=3, batch_latency=60)
+    for name, value in [('door', 'open'), ('window', 'open'),
+                        ('door', 'closed'), ('water', 'dry'),
+                        ('door', 'open')]:
+        q.notify(name, value)
+    q.initialize()
+    q.cleanup()
+
+    assert inner.notify_batch.mock_calls == [
+        call([('door', 'closed', None), ('window', 'open', None),
+              ('water', 'dry', None)]),
+        call([('door', 'open', None)]),
+    ]
+    assert q.stats == dict(enqueued=5, sent=4, dropped=0, coalesced=1,
+                           failed=0, batches=2, spooled=0,
+                           deduped=0, snapshots=0, snapshots_replaced=0)
+
+
+def test_queue_batch_window_ends_with_latency():
+    inner = Mock()
+    sent = threading.Event()
+    inner.notify_batch.side_effect = lambda items: sent.set()
+    q = QueuedNotifier(inner, batch_size=10, batch_latency=.05)
+    q.initialize()
+    q.notify('door', 'open')
+    assert sent.wait(5)
+    inner.notify_batch.assert_called_once_with([('door', 'open', None)])
+    q.cleanup()
+
+
+@patch.object(thingpin.aws, 'Client')
+def test_aws_batch_thing(MockClient):
+    notifier = AWSIoTNotifier(host='h', client_cert='c', private_key='k',
+                              batch_thing='house')
+    notifier.initialize()
+    notifier.notify_batch([('door', {'state': 'open'}, b'x'),
+                           ('water', {'state': 'dry'}, b'y')])
+    (topic, message), = [c[1] for c in
+                         MockClient.return_value.publish.mock_calls]
+    assert topic == '$aws/things/house/shadow/update'
+    assert json.loads(message.decode('utf-8')) == {'state': {'reported': {
+        'door': {'state': 'open'}, 'water': {'state': 'dry'}}}}
+
+
+@patch.object(thingpin.aws, 'Client')
+def test_aws_delta_encoding(MockClient):
+    notifier = AWSIoTNotifier(host='h', client_cert='c', private_key='k',
+                              encoding='delta')
+    notifier.initialize()
+    client = MockClient.return_value
+    client.publish.side_effect = [None, Exception('offline'), None, None,
+                                  None]
+
+    notifier.notify('door', {'state': 'open', 'zone': 1}, b'ignored')
+    with pytest.raises(Exception):
+        notifier.notify('door', {'state': 'closed', 'zone': 1})
+    # the failed change is sent again
+    notifier.notify('door', {'state': 'closed', 'zone': 1})
+    notifier.notify('door', {'state': 'closed'})
+    # whole states again after a reconnect
+    client.client.on_connect(client.client, None, {}, 0)
+    notifier.notify('door', {'zone': 2})
+    assert [c[1][1] for c in client.publish.mock_calls] == [
+        b'{"state":{"reported":{"state":"open","zone":1}}}',
+        b'{"state":{"reported":{"state":"closed"}}}',
+        b'{"state":{"reported":{"state":"closed"}}}',
+        b'{"state":{"reported":{"zone":null}}}',
+        b'{"state":{"reported":{"zone":2}}}',
+    ]
+
+
+@patch.object(thingpin.aws, 'Client')
+def test_aws_delta_batch_thing(MockClient):
+    notifier = AWSIoTNotifier(host='h', client_cert='c', private_key='k',
+                              batch_thing='house', encoding='delta')
+    notifier.initialize()
+    notifier.notify_batch([('door', {'state': 'open', 'zone': 1}, None),
+                           ('water', {'state': 'dry'}, None)])
+    notifier.notify_batch([('door', {'state': 'closed', 'zone': 1}, None)])
+    assert [json.loads(c[1][1]) for c in
+            MockClient.return_value.publish.mock_calls][-1] == {
+        'state': {'reported': {'door': {'state': 'closed'}}}}
+
+
+@patch.object(thingpin.aws, 'Client')
+def test_aws_binary_encoding(MockClient):
+    msgpack = pytest.importorskip('msgpack')
+    with pytest.raises(ValueError):
+        AWSIoTNotifier(host='h', client_cert='c', private_key='k',
+                       encoding='msgpack')
+
+    things = {'door': {'iot_states': {'HIGH': {'state': 'open'}}}}
+    notifier = AWSIoTNotifier(host='h', client_cert='c', private_key='k',
+                              encoding='msgpack', topic='thingpin/{}')
+    notifier.on_reported = Mock()
+    notifier.initialize(things)
+    notifier.notify('door', {'state': 'open'})
+    topic, payload = MockClient.return_value.publish.mock_calls[-1][1]
+    assert topic == 'thingpin/door'
+    assert payload == notifier.things['door'].payloads[
+        freeze({'state': 'open'})]
+    assert msgpack.unpackb(payload, raw=False) == {'state': 'open'}
+
+    # no shadows to read back
+    paho = MockClient.return_value.client
+    paho.on_connect(paho, None, {}, 0)
+    assert not paho.subscribe.called
+
+
+def test_adafruit_group_batch():
+    notifier = AdafruitNotifier(username='u', api_key='k', group='house')
+    notifier.client = Mock()
+    notifier.notify_batch([('door', {'state': 'open'}, b'open'),
+                           ('water', {'state': 1}, b'1')])
+    (topic, message), = [c[1] for c in
+                         notifier.client._client.publish.mock_calls]
+    assert topic == 'u/groups/house'
+    assert json.loads(message) == {'feeds': {'door': 'open', 'water': 1}}
+
+
+def test_queue_metrics():
+    inner = Mock()
+    inner.name = 'aws'
+    inner.metrics.return_value = []
+    q = QueuedNotifier(inner)
+    q.initialize()
+    q.notify('door', 'open')
+    q.notify('door', 'closed')
+    q.cleanup()
+
+    metrics = dict((m.name, m) for m in q.metrics())
+    assert metrics['thingpin_notifier_queue_depth'].samples == [
+        ('', {'notifier': 'aws'}, 0)]
+    assert ('', {'notifier': 'aws', 'result': 'sent'}, 2) in \
+        metrics['thingpin_notifier_messages_total'].samples
+    latency = metrics['thingpin_notifier_publish_seconds']
+    assert latency.samples[-1] == ('_count', {'notifier': 'aws'}, 2)
+
+
+def test_register_notifier():
+    with patch.dict(thingpin.notifiers.NOTIFIERS):
+        thingpin.notifiers.register_notifier(
+            'test', 'thingpin.notifiers', 'Notifier')
+        notifier = create_notifier('test', {'queue': False})
+        assert type(notifier) is thingpin.notifiers.Notifier
+    with pytest.raises(ValueError):
+        create_notifier('test', {})
+
+
+def test_notifier_classes_still_importable_from_notifiers():
+    from thingpin.notifiers import AWSIoTNotifier as cls
+    assert cls is AWSIoTNotifier
+
+    # the wrapper used before Python 3.7
+    module = sys.modules['thingpin.notifiers']
+    wrapper = thingpin.notifiers.NotifiersModule(module)
+    assert wrapper.AdafruitNotifier is AdafruitNotifier
+    assert wrapper.create_notifier is thingpin.notifiers.create_notifier
+    with patch.object(wrapper, 'clock', lambda: 5):
+        assert thingpin.notifiers.clock() == 5
+    assert thingpin.notifiers.clock() != 5
+    with pytest.raises(AttributeError):
+        wrapper.NoSuchNotifier
+
+
+def test_queue_dedup(tmpdir):
+    path = str(tmpdir.join('aws.json'))
+    inner = Mock()
+    q = QueuedNotifier(inner, dedup=StateCache(path))
+    assert inner.on_reported == q.dedup.reported
+    inner.on_reported('window', {'state': 'closed'})
+
+    for name, value in [('door', 'open'), ('door', 'open'),
+                        ('window', {'state': 'closed'}), ('door', 'closed'),
+                        ('door', 'open')]:
+        q.notify(name, value)
+    q.initialize()
+    q.cleanup()
+    assert inner.notify.mock_calls == [call('door', 'open', None),
+                                       call('door', 'closed', None),
+                                       call('door', 'open', None)]
+    assert q.stats['deduped'] == 2
+
+    # after a restart the last published state is not published again
+    inner = Mock()
+    q = QueuedNotifier(inner, dedup=StateCache(path))
+    q.notify('door', 'open')
+    q.initialize()
+    q.cleanup()
+    assert not inner.notify.called
+
+
+def test_queue_dedup_saves_on_interval(tmpdir):
+    path = str(tmpdir.join('aws.json'))
+    cache = StateCache(path, save_interval=3600)
+    inner = Mock()
+    q = QueuedNotifier(inner, dedup=cache)
+    with patch.object(cache, 'save', wraps=cache.save) as save:
+        q.initialize()
+        for i in range(5):
+            q.notify('door', i)
+        deadline = time.time() + 5
+        while q.stats['sent'] < 5:
+            assert time.time() < deadline
+            time.sleep(.01)
+        assert not save.called
+        assert q.idle_timeout() > 0
+        q.cleanup()
+    # saved once, at cleanup
+    assert save.call_count == 1
+    assert json.loads(open(path).read()) == {'door': 4}
+
+
+def test_create_notifier_dedup(tmpdir):
+    path = str(tmpdir.join('aws.json'))
+    notifier = create_notifier('adafruit', {'dedup': {'path': path}})
+    assert notifier.dedup.path == path
+    with pytest.raises(ValueError):
+        create_notifier('adafruit', {'queue': False, 'dedup': {'path': path}})
+
+
+@patch.object(thingpin.aws, 'Client')
+def test_aws_reports_shadows(MockClient):
+    paho = MockClient.return_value.client
+    on_connect = paho.on_connect
+    things = {'door': {'pin': 21}, 'window': {'pin': 20}}
+    notifier = AWSIoTNotifier(host='h', client_cert='c', private_key='k',
+                              shadow_timeout=30)
+    notifier.on_reported = Mock()
+
+    # the broker answers each shadow get from its network thread
+    answers = {
+        'door': ('accepted', b'{"state": {"reported": {"state": "open"}}, '
+                             b'"version": 3}'),
+        'window': ('rejected', b'{"code": 404}'),
+    }
+
+    def answer(topic, payload, qos):
+        name = topic.split('/')[2]
+        result, data = answers[name]
+        message = Mock(topic=topic + '/' + result, payload=data)
+        callback = notifier.on_shadow if result == 'accepted' else \
+            notifier.on_shadow_rejected
+        threading.Timer(.01, callback, (paho, None, message)).start()
+
+    paho.publish.side_effect = answer
+    MockClient.return_value.connect.side_effect = \
+        lambda: paho.on_connect(paho, None, {}, 0)
+
+    # connecting requests the shadows, initialize waits for the answers
+    start = time.time()
+    notifier.initialize(things)
+    assert time.time() - start < 10
+    on_connect.assert_called_once_with(paho, None, {}, 0)
+    paho.subscribe.assert_called_once_with([
+        ('$aws/things/+/shadow/get/accepted', 1),
+        ('$aws/things/+/shadow/get/rejected', 1)])
+    assert sorted(c[1][0] for c in paho.publish.mock_calls) == [
+        '$aws/things/door/shadow/get', '$aws/things/window/shadow/get']
+    notifier.on_reported.assert_called_once_with('door', {'state': 'open'})
+    assert not notifier.shadows_pending
+
+
+def test_queue_snapshot():
+    inner = Mock()
+    q = QueuedNotifier(inner, batch_size=10, batch_latency=0)
+    q.notify('door', 'open')
+    q.notify_snapshot('thingpin', {'things': {'door': 'ajar'}})
+    # only the latest snapshot is sent
+    q.notify_snapshot('thingpin', {'things': {'door': 'open'}})
+    q.initialize()
+    q.cleanup()
+
+    inner.notify_batch.assert_called_once_with([('door', 'open', None)])
+    inner.notify_snapshot.assert_called_once_with(
+        'thingpin', {'things': {'door': 'open'}})
+    stats = q.stats
+    assert (stats['sent'], stats['snapshots'], stats['snapshots_replaced'],
+            stats['dropped']) == (1, 1, 1, 0)
+
+
+@patch.object(thingpin.adafruit, 'MQTTClient')
+def test_adafruit_snapshot(MockClient):
+    notifier = AdafruitNotifier(username='u', api_key='k')
+    notifier.initialize()
+    notifier.notify_snapshot('thingpin', {'things': {'door': None}})
+    MockClient.return_value.publish.assert_called_once_with(
+        'thingpin', '{"things": {"door": null}}')
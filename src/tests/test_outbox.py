@@ -0,0 +1,172 @@
+try:
+    from unittest.mock import patch, Mock, call
+except ImportError:
+    from mock import patch, Mock, call
+
+import os
+import time
+import threading
+import pytest
+
+from thingpin.outbox import Outbox
+from thingpin.notifiers import QueuedNotifier
+
+
+def changes(outbox):
+    sent = []
+    outbox.replay(lambda name, value: sent.append((name, value)))
+    return sent
+
+
+def test_replay_in_order(tmpdir):
+    outbox = Outbox(str(tmpdir))
+    outbox.append('door', {'state': 'open'})
+    outbox.append('water', {'state': 'dry'})
+    outbox.append('door', {'state': 'closed'})
+    assert len(outbox) == 3
+    assert changes(outbox) == [('door', {'state': 'open'}),
+                               ('water', {'state': 'dry'}),
+                               ('door', {'state': 'closed'})]
+    assert len(outbox) == 0
+    assert changes(outbox) == []
+
+
+def test_survives_reopen(tmpdir):
+    outbox = Outbox(str(tmpdir), segment_bytes=40)
+    for i in range(10):
+        outbox.append('door', i)
+    outbox.close()
+    assert len(os.listdir(str(tmpdir))) > 1
+
+    outbox = Outbox(str(tmpdir))
+    assert len(outbox) == 10
+    assert changes(outbox) == [('door', i) for i in range(10)]
+
+
+def test_partial_record_ignored(tmpdir):
+    outbox = Outbox(str(tmpdir))
+    outbox.append('door', 'open')
+    outbox.append('door', 'closed')
+    outbox.close()
+    segment, = [os.path.join(str(tmpdir), n) for n in os.listdir(str(tmpdir))]
+    with open(segment, 'r+b') as f:
+        f.truncate(os.path.getsize(segment) - 3)
+
+    outbox = Outbox(str(tmpdir))
+    assert len(outbox) == 1
+    outbox.append('door', 'ajar')
+    assert changes(outbox) == [('door', 'open'), ('door', 'ajar')]
+
+
+def test_compacts_to_latest_per_thing(tmpdir):
+    outbox = Outbox(str(tmpdir), max_bytes=200)
+    for i in range(20):
+        outbox.append('door', i)
+        outbox.append('water', i)
+    assert outbox.bytes <= 200
+    assert outbox.stats['compactions'] > 0
+    assert outbox.stats['dropped'] == 0
+    assert changes(outbox)[-2:] == [('door', 19), ('water', 19)]
+
+
+class Crash(Exception):
+    pass
+
+
+def test_crash_during_rewrite_replays_once(tmpdir):
+    outbox = Outbox(str(tmpdir), segment_bytes=40)
+    for i in range(10):
+        outbox.append('door', i)
+    sent = []
+
+    def send(name, value):
+        if len(sent) == 4:
+            raise IOError('gone')
+        sent.append(value)
+
+    # the rewritten segment is in place, the old ones are not removed yet
+    with patch.object(os, 'remove', side_effect=Crash):
+        with pytest.raises(Crash):
+            outbox.replay(send)
+    assert sent == [0, 1, 2, 3]
+
+    outbox = Outbox(str(tmpdir))
+    assert len(outbox) == 6
+    assert changes(outbox) == [('door', i) for i in range(4, 10)]
+    outbox.append('door', 10)
+    outbox.close()
+    assert changes(Outbox(str(tmpdir))) == [('door', 10)]
+
+
+def test_crash_before_rewrite_keeps_segments(tmpdir):
+    outbox = Outbox(str(tmpdir), segment_bytes=40)
+    for i in range(5):
+        outbox.append('door', i)
+    with patch.object(os, 'rename', side_effect=Crash):
+        with pytest.raises(Crash):
+            outbox.compact()
+
+    outbox = Outbox(str(tmpdir))
+    assert changes(outbox) == [('door', i) for i in range(5)]
+    assert not [n for n in os.listdir(str(tmpdir)) if n.endswith('.tmp')]
+
+
+def test_full_drops(tmpdir):
+    outbox = Outbox(str(tmpdir), max_bytes=50)
+    for i in range(5):
+        outbox.append('thing{}'.format(i), i)
+    assert outbox.bytes <= 50
+    assert outbox.stats['dropped'] > 0
+
+
+def test_replay_keeps_unsent(tmpdir):
+    outbox = Outbox(str(tmpdir))
+    for i in range(5):
+        outbox.append('door', i)
+    send = Mock(side_effect=[None, None, IOError('gone')])
+    assert outbox.replay(send) == 2
+    assert len(outbox) == 3
+    assert changes(outbox) == [('door', i) for i in range(2, 5)]
+
+
+def test_queue_spools_while_disconnected(tmpdir):
+    inner = Mock()
+    inner.connected = False
+    published = threading.Event()
+    inner.notify.side_effect = lambda *args: published.set()
+    outbox = Outbox(str(tmpdir))
+    q = QueuedNotifier(inner, outbox=outbox, retry_min=.01, retry_max=.02)
+    q.initialize()
+    for i in range(3):
+        q.notify('door', i)
+
+    deadline = time.time() + 5
+    while q.stats['spooled'] < 3:
+        assert time.time() < deadline, 'changes not spooled'
+        threading.Event().wait(.01)
+    assert not inner.notify.called
+
+    inner.connected = True
+    q.notify('door', 3)
+    assert published.wait(5)
+    q.cleanup()
+
+    # replayed and published changes differ only in the payload argument
+    assert [c[1][:2] for c in inner.notify.mock_calls] == [
+        ('door', i) for i in range(4)]
+    assert len(outbox) == 0
+    assert q.stats['sent'] == 4
+
+
+def test_queue_spools_failed_publish(tmpdir):
+    inner = Mock()
+    inner.notify.side_effect = IOError('broker gone')
+    outbox = Outbox(str(tmpdir))
+    q = QueuedNotifier(inner, outbox=outbox, retry_min=60)
+    q.notify('door', 'open', b'open')
+    q.initialize()
+    q.cleanup()
+
+    assert q.stats['spooled'] == 1
+    assert q.stats['failed'] == 0
+    assert Outbox(str(tmpdir)).stats['records'] == 1
@@ -0,0 +1,100 @@
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import pytest
+
+from thingpin import payloads
+from thingpin.payloads import (create_encoding, encoding_for_code,
+                               merge_patch, Delta, PayloadCache)
+from thingpin.thingpin import freeze
+
+
+def test_json_encoding():
+    encoding = create_encoding()
+    data = encoding.dumps(freeze({'state': 'open', 'zones': [1, 2]}))
+    assert data == b'{"state":"open","zones":[1,2]}'
+    assert encoding.loads(data) == {'state': 'open', 'zones': [1, 2]}
+    assert not encoding.binary
+
+
+@pytest.mark.parametrize('name,module', [('msgpack', 'msgpack'),
+                                         ('cbor', 'cbor2')])
+def test_binary_encodings(name, module):
+    pytest.importorskip(module)
+    encoding = create_encoding(name)
+    value = freeze({'state': 'open', 'zones': [1, 2], 'rate': 1.5})
+    data = encoding.dumps(value)
+    assert encoding.binary
+    assert len(data) < len(create_encoding().dumps(value))
+    assert encoding.loads(data) == {'state': 'open', 'zones': [1, 2],
+                                    'rate': 1.5}
+    assert type(encoding_for_code(encoding.code)) is type(encoding)
+
+
+def test_create_encoding_errors():
+    with pytest.raises(ValueError):
+        create_encoding('xml')
+    with patch.object(payloads.importlib, 'import_module',
+                      side_effect=ImportError):
+        with pytest.raises(ValueError) as e:
+            create_encoding('msgpack')
+    assert 'msgpack package' in str(e.value)
+    with pytest.raises(ValueError):
+        encoding_for_code(99)
+
+
+def test_merge_patch():
+    assert merge_patch({'state': 'open', 'zone': 1},
+                       {'state': 'closed', 'zone': 1}) == {'state': 'closed'}
+    assert merge_patch({'a': {'b': 1, 'c': 2}, 'd': 3},
+                       {'a': {'b': 1, 'c': 3}}) == {'a': {'c': 3}, 'd': None}
+    assert merge_patch('open', 'closed') == 'closed'
+    assert merge_patch({'a': 1}, [1]) == [1]
+
+
+def test_delta():
+    delta = Delta()
+    encode = Mock(side_effect=lambda v: create_encoding().dumps(v))
+    opened = freeze({'state': 'open', 'zone': 1})
+    closed = freeze({'state': 'closed', 'zone': 1})
+
+    # whole state until one was published
+    assert delta.payload('door', opened, encode) == \
+        b'{"state":"open","zone":1}'
+    delta.published('door', opened)
+    assert delta.payload('door', closed, encode) == b'{"state":"closed"}'
+    assert delta.payload('door', opened, encode) == \
+        b'{"state":"open","zone":1}'
+    delta.published('door', closed)
+
+    # each transition is encoded once, only closed to open is new
+    encode.reset_mock()
+    for state in [opened, closed] * 3:
+        delta.payload('door', state, encode)
+        delta.published('door', state)
+    assert encode.call_count == 1
+
+    assert delta.patch('door', {'state': 'open', 'zone': 1}) == {
+        'state': 'open'}
+    delta.reset()
+    assert delta.patch('door', closed) == closed
+
+
+def test_payload_cache():
+    cache = PayloadCache(size=2)
+    encode = Mock(return_value=b'x')
+    cache.get(('a',), encode)
+    cache.get(('a',), encode)
+    assert encode.call_count == 1
+
+    # unhashable values are not cached
+    cache.get({'a': 1}, encode)
+    cache.get({'a': 1}, encode)
+    assert encode.call_count == 3
+    assert len(cache) == 1
+
+    cache.get('b', encode)
+    cache.get('c', encode)
+    assert len(cache) == 1
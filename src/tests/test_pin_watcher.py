@@ -3,6 +3,7 @@ import unittest
 import sys
 import os
 import datetime
+import struct
 import time
 from freezegun import freeze_time
 
@@ -16,7 +17,11 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 import RPi
 import thingpin
-from thingpin.pin import Watcher
+import thingpin.pin
+from thingpin.pin import Watcher, Scanner, EdgeWatcher
+from thingpin.gpio import BankGPIO, GPLEV0
+
+thingpin.pin.use_gpio(RPi.GPIO)
 
 HIGH = 1
 LOW = 0
@@ -90,6 +95,14 @@ use_cases = [
 def use_case(request):
     return request.param
 
+
+@pytest.fixture(autouse=True)
+def wall_clock():
+    """Drive the monotonic pin clock from the (frozen) wall clock"""
+    with patch.object(thingpin.pin, 'clock_ns',
+                      lambda: int(round(time.time() * 1e9))):
+        yield
+
 freezer = None
 def incr_time(seconds=0):
     """Mock time by freezing it at the last frozen time + seconds"""
@@ -105,6 +118,16 @@ def incr_time(seconds=0):
 def assert_almost_equal(actual, expected, fraction=1e-3, msg=None):
     assert abs(actual - expected) < fraction * expected
 
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='clock_gettime() is only used on Linux')
+def test_clock_gettime_ns():
+    """The Python 2.7 monotonic clock"""
+    clock = thingpin.pin.clock_gettime_ns()
+    first = clock()
+    second = clock()
+    assert isinstance(first, int) or type(first).__name__ == 'long'
+    assert 0 < first <= second < first + 10 ** 9
+
 @patch('time.sleep', return_value=None)
 @patch.object(thingpin.pin.GPIO, 'input')
 def test_loop(mock_input, mock_time, use_case):
@@ -133,3 +156,340 @@ def test_loop(mock_input, mock_time, use_case):
     assert observer.update_pin.mock_calls == [
         call(19, u) for u in use_case['expected_updates']
     ]
+
+@patch.object(thingpin.pin.GPIO, 'remove_event_detect')
+@patch.object(thingpin.pin.GPIO, 'add_event_detect')
+@patch.object(thingpin.pin.GPIO, 'input')
+def test_edge_loop(mock_input, mock_detect, mock_remove, use_case):
+    """Test each use case against an EdgeWatcher"""
+    pin = 19
+
+    def input_generator(readings):
+        for r in readings:
+            incr_time(r[0])
+            # each reading follows an edge
+            w.on_edge(pin)
+            yield r[1]
+    mock_input.side_effect = input_generator(use_case['readings'])
+
+    timeouts = [None for r in use_case['readings']]
+
+    observer = Mock()
+    w = EdgeWatcher(observer,
+                    pin,
+                    debounce_delay=use_case['debounce'],
+                    timeout=timeouts)
+    w.start()
+    w.join(5)
+
+    assert mock_detect.mock_calls == [
+        call(pin, RPi.GPIO.BOTH, callback=w.on_edge)]
+    mock_remove.assert_called_once_with(pin)
+    assert mock_input.mock_calls == [call(pin) for i in range(len(timeouts))]
+    assert observer.update_pin.mock_calls == [
+        call(19, u) for u in use_case['expected_updates']
+    ]
+
+
+@patch.object(thingpin.pin.GPIO, 'input')
+def test_edge_wait_ends_with_debounce_delay(mock_input):
+    """While a reading is pending the edge wait times out with the delay"""
+    incr_time()
+    mock_input.side_effect = [LOW, HIGH, HIGH]
+
+    observer = Mock()
+    w = EdgeWatcher(observer, 19, debounce_delay=.25, timeout=[None, 5, 5])
+    w.edge = Mock()
+    w.start()
+    w.join(5)
+
+    assert w.edge.wait.mock_calls == [call(None), call(.25), call(.25)]
+
+
+@patch.object(thingpin.pin.GPIO, 'input')
+def test_edge_between_read_and_wait(mock_input):
+    """An edge that comes while the pin is read ends the next wait"""
+    def read(pin):
+        if mock_input.call_count == 1:
+            # the pin changes right after this read, before the wait
+            w.on_edge(pin)
+            return LOW
+        return HIGH
+    mock_input.side_effect = read
+
+    observer = Mock()
+    # the first wait has no timeout, only the latched edge ends it
+    w = EdgeWatcher(observer, 19, timeout=[None, 0])
+    w.start()
+    w.join(5)
+
+    assert not w.is_alive()
+    assert observer.update_pin.mock_calls == [call(19, LOW), call(19, HIGH)]
+
+
+def test_edge_watcher_stop_wakes_wait():
+    w = EdgeWatcher(Mock(), 19)
+    w.start()
+    time.sleep(.05)
+    w.stop()
+    w.join(5)
+    assert not w.is_alive()
+
+
+@patch('time.sleep', return_value=None)
+@patch.object(thingpin.pin.GPIO, 'input')
+def test_scanner(mock_input, mock_time):
+    """Scanner reads every pin each loop and debounces each separately"""
+    levels = {
+        19: [LOW, LOW, HIGH, HIGH],
+        20: [HIGH, LOW, LOW, LOW],
+    }
+    readings = dict((pin, iter(values)) for pin, values in levels.items())
+    mock_input.side_effect = lambda pin: next(readings[pin])
+
+    observer19 = Mock()
+    observer20 = Mock()
+    s = Scanner(sleep=[0] * 4)
+    s.add(observer19, 19)
+    s.add(observer20, 20)
+    s.start()
+    s.join()
+
+    assert mock_input.mock_calls == [call(19), call(20)] * 4
+    assert mock_time.mock_calls == [call(0)] * 4
+    assert observer19.update_pin.mock_calls == [call(19, LOW), call(19, HIGH)]
+    assert observer20.update_pin.mock_calls == [call(20, HIGH), call(20, LOW)]
+
+
+class Stop(Exception):
+    pass
+
+
+@patch.object(thingpin.pin.GPIO, 'input')
+def test_adaptive_sleep(mock_input):
+    """Quiet pins back off to max_sleep, changes reset to sleep"""
+    incr_time()
+    levels = [LOW] * 6 + [HIGH] * 3
+    mock_input.side_effect = levels
+
+    waits = []
+
+    def wait(seconds):
+        waits.append(seconds)
+        if len(waits) == len(levels):
+            raise Stop()
+        incr_time(seconds)
+
+    observer = Mock()
+    w = Watcher(observer, 19, sleep=.01, max_sleep=.08)
+    w.wait = wait
+    with pytest.raises(Stop):
+        w.run_adaptive()
+
+    assert waits == pytest.approx(
+        [.01, .02, .04, .08, .08, .08, .01, .02, .04])
+    assert observer.update_pin.mock_calls == [call(19, LOW), call(19, HIGH)]
+
+
+@patch.object(thingpin.pin.GPIO, 'input')
+def test_adaptive_sleep_during_debounce(mock_input):
+    """Pins are polled every sleep while a reading waits out debounce"""
+    incr_time()
+    levels = [LOW] + [HIGH] * 5
+    mock_input.side_effect = levels
+
+    waits = []
+
+    def wait(seconds):
+        waits.append(seconds)
+        if len(waits) == len(levels):
+            raise Stop()
+        incr_time(seconds)
+
+    observer = Mock()
+    w = Watcher(observer, 19, sleep=.01, max_sleep=1, debounce_delay=.025)
+    w.wait = wait
+    with pytest.raises(Stop):
+        w.run_adaptive()
+
+    assert waits == pytest.approx([.01, .01, .01, .01, .02, .04])
+    assert observer.update_pin.mock_calls == [call(19, LOW), call(19, HIGH)]
+
+
+@patch.object(thingpin.pin.GPIO, 'input')
+def test_adaptive_scanner_polls_due_pins(mock_input):
+    """Each pin of a Scanner has its own interval"""
+    incr_time()
+    reads = []
+
+    def read(pin):
+        reads.append(pin)
+        return LOW
+    mock_input.side_effect = read
+
+    waits = []
+
+    def wait(seconds):
+        waits.append(seconds)
+        if len(waits) == 4:
+            raise Stop()
+        incr_time(seconds)
+
+    s = Scanner(sleep=.01, max_sleep=.02)
+    s.add(Mock(), 19)
+    s.add(Mock(), 20, max_sleep=.01)
+    s.wait = wait
+    with pytest.raises(Stop):
+        s.run_adaptive()
+
+    assert reads == [19, 20, 19, 20, 20, 19, 20]
+    assert waits == pytest.approx([.01, .01, .01, .01])
+
+
+def test_debouncer_counts_changes_and_rejections():
+    d = thingpin.pin.Debouncer(delay=.05)
+    accepted = [d.update(reading, int(now * 1e9)) for reading, now in [
+        (LOW, 10), (HIGH, 10.01), (LOW, 10.02), (HIGH, 10.03),
+        (HIGH, 10.09)]]
+    assert accepted == [True, False, False, False, True]
+    assert d.changes == 4
+    assert d.rejected == 2
+
+
+def test_debouncer_first_reading_soon_after_boot():
+    """The monotonic clock starts near zero at boot"""
+    d = thingpin.pin.Debouncer(delay=10)
+    assert d.update(HIGH, 1000)
+    assert d.reading == HIGH
+
+
+def test_debouncer_update_batch():
+    d = thingpin.pin.Debouncer(delay=.05)
+    ms = 1000000
+    assert d.update_batch([(LOW, 0), (HIGH, 10 * ms), (LOW, 20 * ms),
+                           (HIGH, 30 * ms), (HIGH, 90 * ms)]) == [LOW, HIGH]
+    assert d.update_batch([]) == []
+    assert d.remaining(90 * ms) is None
+    assert d.update_batch([(LOW, 100 * ms), (HIGH, 110 * ms)]) == [LOW]
+    assert d.remaining(120 * ms) == 40 * ms
+
+
+@pytest.mark.parametrize('step', [-3600, 3600, -86400 * 365 * 30])
+@patch('time.sleep', return_value=None)
+@patch.object(thingpin.pin.GPIO, 'input')
+def test_debounce_ignores_wall_clock_steps(mock_input, mock_time, step):
+    """NTP stepping the wall clock does not change debouncing"""
+    incr_time()
+    levels = [LOW, HIGH, HIGH, HIGH, HIGH]
+    mono = [0]
+
+    def read(pin):
+        # readings .2s apart, the wall clock steps before the second one
+        mono[0] += 200000000
+        if len(levels) == 4:
+            incr_time(step)
+        return levels.pop(0)
+    mock_input.side_effect = read
+
+    observer = Mock()
+    w = Watcher(observer, 19, sleep=[.2] * 5, debounce_delay=.5)
+    with patch.object(thingpin.pin, 'clock_ns', lambda: mono[0]):
+        w.start()
+        w.join()
+        assert w.sample_rates()[19] == pytest.approx(5 / 1.0)
+
+    assert observer.update_pin.mock_calls == [call(19, LOW), call(19, HIGH)]
+
+
+@patch.object(thingpin.pin.GPIO, 'input', return_value=LOW)
+def test_adaptive_sleep_ignores_wall_clock_steps(mock_input):
+    """A wall clock step back does not stall adaptive polling"""
+    incr_time()
+    mono = [0]
+    waits = []
+
+    def wait(seconds):
+        waits.append(seconds)
+        if len(waits) == 4:
+            raise Stop()
+        incr_time(-3600)
+        mono[0] += int(seconds * 1e9)
+
+    w = Watcher(Mock(), 19, sleep=.01, max_sleep=.04)
+    w.wait = wait
+    with patch.object(thingpin.pin, 'clock_ns', lambda: mono[0]):
+        with pytest.raises(Stop):
+            w.run_adaptive()
+
+    assert waits == pytest.approx([.01, .02, .04, .04])
+
+
+@patch('time.sleep', return_value=None)
+@patch.object(thingpin.pin.GPIO, 'input', return_value=LOW)
+def test_scanner_remove_and_stop(mock_input, mock_time):
+    """Pins can be removed and the Scanner stopped while it runs"""
+    s = Scanner(sleep=[0] * 10)
+    s.add(Mock(), 19)
+    removed = s.add(Mock(), 20)
+
+    loops = []
+
+    def wait(seconds):
+        loops.append(seconds)
+        if len(loops) == 1:
+            s.remove(removed)
+        elif len(loops) == 3:
+            s.stop()
+    s.wait = wait
+    s.start()
+    s.join()
+
+    assert mock_input.mock_calls == [call(19), call(20), call(19), call(19)]
+
+
+def test_scanner_bank_reads(tmpdir):
+    """With a bank backend only changed and pending pins are debounced"""
+    registers = tmpdir.join('gpiomem')
+    registers.write(b'\0' * 64, mode='wb')
+
+    def set_levels(levels):
+        with open(str(registers), 'r+b') as f:
+            f.seek(GPLEV0)
+            f.write(struct.pack('<II', levels & 0xffffffff, levels >> 32))
+
+    s = Scanner(sleep=.01)
+    observer19 = Mock()
+    observer40 = Mock()
+    i19 = s.add(observer19, 19, debounce_delay=.1)
+    i40 = s.add(observer40, 40)
+    thingpin.pin.use_gpio(BankGPIO(str(registers)))
+    try:
+        def scan(t, levels):
+            set_levels(levels)
+            with patch.object(thingpin.pin, 'clock_ns',
+                              lambda: int(t * 1e9)):
+                s.scan()
+
+        scan(10, 1 << 19)
+        assert observer19.update_pin.mock_calls == [call(19, HIGH)]
+        assert observer40.update_pin.mock_calls == [call(40, LOW)]
+        assert s.pending == []
+
+        # nothing changed, nothing debounced
+        scan(10.01, 1 << 19)
+        assert (i19.debouncer.changes, i40.debouncer.changes) == (1, 1)
+
+        # a change within the debounce delay stays pending
+        scan(10.05, 0)
+        assert s.pending == [i19]
+        assert i19.debouncer.rejected == 1
+        scan(10.2, 0)
+        assert observer19.update_pin.mock_calls[-1] == call(19, LOW)
+        assert s.pending == []
+
+        scan(10.21, 1 << 40)
+        assert observer40.update_pin.mock_calls[-1] == call(40, HIGH)
+        s.sample_rates()
+        assert (i19.samples, i40.samples) == (5, 5)
+    finally:
+        thingpin.pin.use_gpio(RPi.GPIO)
@@ -0,0 +1,46 @@
+import json
+
+from thingpin.statecache import StateCache
+from thingpin.thingpin import freeze
+
+
+def test_state_cache_persists(tmpdir):
+    path = str(tmpdir.join('state', 'aws.json'))
+    cache = StateCache(path)
+    assert not cache.matches('door', {'state': 'open'})
+
+    cache.published('door', freeze({'state': 'open', 'tags': ['front']}))
+    cache.save()
+    assert json.loads(open(path).read()) == {
+        'door': {'state': 'open', 'tags': ['front']}}
+
+    cache = StateCache(path)
+    assert cache.matches('door', freeze({'state': 'open', 'tags': ['front']}))
+    assert not cache.matches('door', {'state': 'closed'})
+
+
+def test_state_cache_reported_only_until_published(tmpdir):
+    cache = StateCache(str(tmpdir.join('aws.json')))
+    cache.reported('door', {'state': 'open'})
+    assert cache.matches('door', {'state': 'open'})
+
+    cache.published('door', {'state': 'closed'})
+    # an older shadow answered after publishing does not win
+    cache.reported('door', {'state': 'open'})
+    assert cache.matches('door', {'state': 'closed'})
+
+
+def test_state_cache_ignores_invalid_file(tmpdir):
+    path = tmpdir.join('aws.json')
+    path.write('{"door": ')
+    assert len(StateCache(str(path))) == 0
+
+
+def test_state_cache_save_due(tmpdir):
+    cache = StateCache(str(tmpdir.join('aws.json')), save_interval=0)
+    assert cache.save_timeout() is None
+    assert not cache.save_due()
+    cache.published('door', 'open')
+    assert cache.save_due()
+    cache.save()
+    assert not cache.dirty
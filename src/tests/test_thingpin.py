@@ -0,0 +1,350 @@
+try:
+    from unittest.mock import patch, Mock, call
+except ImportError:
+    from mock import patch, Mock, call
+
+import os
+import sys
+import json
+import time
+import threading
+import pytest
+
+# pick up our RPi stub
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import RPi
+import thingpin.pin
+import thingpin.thingpin
+from thingpin.thingpin import Pin, freeze, expand_things, parse_pins
+from thingpin.pin import Debouncer
+from thingpin.notifiers import Notifier
+from thingpin.totals import Totals
+
+HIGH = 1
+LOW = 0
+
+CONFIG = {
+    'pin': 21,
+    'iot_states': {
+        'HIGH': {'state': 'open', 'tags': ['front']},
+        'LOW': {'state': 'closed'},
+    },
+}
+
+
+@pytest.fixture
+def pin():
+    with patch.object(thingpin.thingpin, 'setup_input_pin'):
+        with patch.object(thingpin.thingpin, 'Watcher'):
+            notifier = Mock()
+            notifier.encode.side_effect = Notifier().encode
+            yield Pin(notifier, 'door', CONFIG)
+
+
+def test_pin_states_compiled(pin):
+    assert pin.get_state(HIGH) == freeze(CONFIG['iot_states']['HIGH'])
+    assert pin.get_state(LOW) == CONFIG['iot_states']['LOW']
+    assert json.loads(pin.states[1].payload.decode('utf-8')) == \
+        CONFIG['iot_states']['HIGH']
+    assert pin.notifier.encode.call_count == 2
+
+
+def test_pin_update_sends_payload(pin):
+    pin.update_pin(21, LOW)
+    pin.notifier.notify.assert_called_once_with(
+        'door', {'state': 'closed'}, b'{"state": "closed"}')
+    assert pin.notifier.encode.call_count == 2
+
+
+def test_pin_states_are_read_only(pin):
+    with pytest.raises(TypeError):
+        pin.get_state(HIGH)['state'] = 'ajar'
+    assert pin.get_state(HIGH)['tags'] == ('front',)
+    assert CONFIG['iot_states']['HIGH']['tags'] == ['front']
+
+
+def test_freeze():
+    frozen = freeze({'a': [1, {'b': 2}]})
+    assert frozen == {'a': (1, {'b': 2})}
+    assert hash(frozen) == hash(freeze({'a': [1, {'b': 2}]}))
+    with pytest.raises(TypeError):
+        frozen['a'][1].update(c=3)
+
+
+def test_pin_counts_notifies(pin):
+    pin.update_pin(21, LOW)
+    pin.update_pin(21, HIGH)
+    assert pin.notifies == 2
+
+
+THINGS = {
+    'door': dict(CONFIG, pin=21),
+    'window': dict(CONFIG, pin=20),
+    'garage': dict(CONFIG, pin=19),
+}
+
+
+@patch.object(thingpin.thingpin, 'set_pin_mode')
+@patch.object(thingpin.thingpin, 'setup_input_pin')
+@patch.object(thingpin.thingpin, 'Watcher')
+def test_reload(MockWatcher, mock_setup, mock_set_pin_mode):
+    MockWatcher.side_effect = lambda **kwargs: Mock(inputs=[
+        thingpin.thingpin.Input(kwargs['pin'], None, Debouncer(), None)])
+    notifier = Mock()
+    notifier.encode.side_effect = Notifier().encode
+    t = thingpin.thingpin.Thingpin(notifier, 'BCM', dict(THINGS))
+    t.start()
+    before = dict(t.pins)
+    notifier.reset_mock()
+
+    closed = {'state': 'shut'}
+    things = {
+        # iot_states and debounce_delay change in place
+        'door': dict(CONFIG, pin=21, debounce_delay=.05,
+                     iot_states=dict(CONFIG['iot_states'], LOW=closed)),
+        # other changes restart the pin
+        'window': dict(CONFIG, pin=18),
+        # new
+        'shed': dict(CONFIG, pin=17),
+        # garage is gone
+    }
+    t.reload(things)
+
+    assert sorted(t.pins) == ['door', 'shed', 'window']
+    assert t.pins['door'] is before['door']
+    assert t.pins['door'].get_state(LOW) == closed
+    assert t.pins['door'].input.debouncer.delay == 50000000
+    assert t.pins['window'] is not before['window']
+    before['window'].watcher.stop.assert_called_once_with()
+    before['garage'].watcher.stop.assert_called_once_with()
+    assert not before['door'].watcher.stop.called
+    t.pins['shed'].watcher.start.assert_called_once_with()
+    t.pins['window'].watcher.start.assert_called_once_with()
+    assert t.thing_config == things
+    # the notifier stays connected
+    assert not notifier.initialize.called
+    assert not notifier.cleanup.called
+
+    # only the new iot_states of door were compiled, the restarted and new
+    # pins share the table the running pins compiled
+    assert notifier.encode.call_count == 2
+    assert t.pins['shed'].states is t.pins['window'].states
+    assert len(t.compiled) == 2
+    # tables no pin uses any more are dropped
+    t.reload({'door': things['door']})
+    assert list(t.compiled.values()) == [t.pins['door'].states]
+
+
+class EdgeGPIO(object):
+    """Like RPi.GPIO, rejects detecting edges of a pin twice at once"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.detecting = set()
+        self.errors = []
+
+    def add_event_detect(self, pin, edge, callback=None):
+        with self.lock:
+            if pin in self.detecting:
+                self.errors.append(pin)
+                raise RuntimeError('Conflicting edge detection already '
+                                   'enabled for this GPIO channel')
+            self.detecting.add(pin)
+
+    def remove_event_detect(self, pin):
+        with self.lock:
+            self.detecting.discard(pin)
+
+
+@patch.object(thingpin.thingpin, 'set_pin_mode')
+@patch.object(thingpin.thingpin, 'setup_input_pin')
+def test_reload_edge_pin(mock_setup, mock_set_pin_mode):
+    gpio = EdgeGPIO()
+    notifier = Mock()
+    notifier.encode.side_effect = Notifier().encode
+    things = {'door': dict(CONFIG, mode='edge')}
+    t = thingpin.thingpin.Thingpin(notifier, 'BCM', things)
+    with patch.object(thingpin.pin.GPIO, 'add_event_detect',
+                      gpio.add_event_detect), \
+            patch.object(thingpin.pin.GPIO, 'remove_event_detect',
+                         gpio.remove_event_detect), \
+            patch.object(thingpin.pin.GPIO, 'input', return_value=LOW):
+        t.start()
+        for timeout in [5, 6]:
+            before = t.pins['door']
+            t.reload({'door': dict(CONFIG, mode='edge',
+                                   edge_timeout=timeout)})
+            assert t.pins['door'] is not before
+            assert not before.watcher.is_alive()
+            time.sleep(.1)
+            assert t.pins['door'].watcher.is_alive()
+        t.reload({})
+        assert not t.pins
+    assert gpio.errors == []
+    assert not gpio.detecting
+
+
+@patch.object(thingpin.thingpin, 'set_pin_mode')
+@patch.object(thingpin.thingpin, 'setup_input_pin')
+@patch.object(thingpin.thingpin, 'Watcher')
+def test_heartbeat_snapshot(MockWatcher, mock_setup, mock_set_pin_mode):
+    MockWatcher.side_effect = lambda **kwargs: Mock(inputs=[
+        thingpin.thingpin.Input(kwargs['pin'], None, Debouncer(), None)])
+    notifier = Mock()
+    notifier.encode.side_effect = Notifier().encode
+    t = thingpin.thingpin.Thingpin(notifier, 'BCM', dict(THINGS),
+                                   heartbeat={'interval': 3600})
+    t.start()
+    t.pins['door'].input.debouncer.update(HIGH, 0)
+    t.pins['window'].input.debouncer.update(LOW, 0)
+    t.pins['garage'].watcher.is_alive.return_value = False
+
+    t.heartbeat.beat()
+    name, snapshot = notifier.notify_snapshot.call_args[0]
+    assert name == 'thingpin'
+    # readings come from the watchers, GPIO is not read
+    assert snapshot['things'] == {
+        'door': freeze(CONFIG['iot_states']['HIGH']),
+        'window': {'state': 'closed'},
+        'garage': None}
+    assert snapshot['health']['stopped'] == ['garage']
+    assert snapshot['health']['uptime'] >= 0
+    assert not notifier.notify.called
+
+    t.heartbeat.stop()
+    t.heartbeat.join(1)
+    assert not t.heartbeat.is_alive()
+
+
+PROFILES = {'zone': {'resistor': 'pull_up',
+                     'iot_states': CONFIG['iot_states']}}
+
+
+def test_expand_things():
+    things = expand_things({
+        'zone{n}': {'profile': 'zone', 'pins': '4-6, 9'},
+        'panel-{pin}': {'profile': 'zone', 'pins': [17, 18], 'first': 0,
+                        'debounce_delay': .05},
+        'door': dict(CONFIG, pin=21),
+    }, PROFILES)
+    assert sorted(things) == ['door', 'panel-17', 'panel-18', 'zone1',
+                              'zone2', 'zone3', 'zone4']
+    assert things['zone4'] == dict(PROFILES['zone'], pin=9)
+    assert things['panel-18'] == dict(PROFILES['zone'], pin=18,
+                                      debounce_delay=.05)
+    # expanded things share the profile config, nothing is copied deeply
+    assert things['zone1']['iot_states'] is things['zone4']['iot_states']
+    assert things['door'] is not CONFIG
+
+
+@pytest.mark.parametrize('things', [
+    {'zone': {'profile': 'zone', 'pins': '4-5'}},
+    {'zone{n}': {'profile': 'alarm', 'pins': '4-5'}},
+    {'zone{n}': {'profile': 'zone', 'pins': '4-5'},
+     'door': dict(CONFIG, pin=5)},
+    {'zone{n}': {'profile': 'zone', 'pins': '5-4'}},
+])
+def test_expand_things_invalid(things):
+    with pytest.raises(ValueError):
+        expand_things(things, PROFILES)
+
+
+def test_parse_pins():
+    assert parse_pins(4) == [4]
+    assert parse_pins('4-6,9') == [4, 5, 6, 9]
+    assert parse_pins([4, '6-7']) == [4, 6, 7]
+
+
+@patch.object(thingpin.thingpin, 'setup_input_pin')
+@patch.object(thingpin.thingpin, 'Watcher')
+def test_expanded_pins_share_compiled_states(MockWatcher, mock_setup):
+    notifier = Mock()
+    notifier.encode.side_effect = Notifier().encode
+    compiled = {}
+    things = expand_things({'zone{n}': {'profile': 'zone', 'pins': '1-64'}},
+                           PROFILES)
+    pins = [Pin(notifier, name, config, compiled=compiled)
+            for name, config in things.items()]
+    assert len(set(id(p.states) for p in pins)) == 1
+    assert notifier.encode.call_count == 2
+
+
+COUNTER = {'pin': 22, 'type': 'counter', 'interval': 10, 'state': 'rate'}
+
+
+@patch.object(thingpin.thingpin, 'setup_input_pin')
+@patch.object(thingpin.pin, 'GPIO')
+def test_counter_pin(mock_gpio, mock_setup, tmpdir):
+    path = str(tmpdir.join('counters.json'))
+    notifier = Mock()
+    with patch.object(thingpin.thingpin, 'clock_ns', lambda: 100 * 10**9):
+        pin = thingpin.thingpin.Thingpin(
+            notifier, 'BCM', {}, totals=Totals(path)).create_pin(
+                'flow', COUNTER)
+        pin.start_counting()
+    mock_gpio.add_event_detect.assert_called_once_with(
+        22, mock_gpio.RISING, callback=pin.counter.pulse)
+
+    # edges are counted without notifying
+    for i in range(250):
+        pin.counter.pulse(22)
+    assert not notifier.notify.called
+
+    with patch.object(thingpin.thingpin, 'clock_ns', lambda: 110 * 10**9):
+        pin.publish()
+    notifier.notify.assert_called_once_with(
+        'flow', {'count': 250, 'rate': 25.0, 'total': 250, 'state': 25.0})
+    assert pin.current_state()['total'] == 250
+
+    # the total survives a restart
+    pin = thingpin.thingpin.CounterPin(notifier, 'flow', COUNTER,
+                                       totals=Totals(path))
+    pin.start_counting()
+    pin.counter.pulse(22)
+    pin.stop()
+    mock_gpio.remove_event_detect.assert_called_with(22)
+    assert notifier.notify.call_args[0][1]['total'] == 251
+    assert Totals(path).get('flow') == 251
+
+
+def test_totals_concurrent_saves(tmpdir):
+    path = str(tmpdir.join('totals.json'))
+    totals = Totals(path)
+    errors = []
+
+    def count(name):
+        try:
+            for _ in range(50):
+                totals.add(name, 1)
+                totals.save()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=count, args=('flow{}'.format(i),))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert Totals(path).totals == dict(('flow{}'.format(i), 50)
+                                       for i in range(4))
+
+
+@patch('time.sleep', return_value=None)
+@patch.object(thingpin.pin, 'GPIO')
+def test_pulse_counter_retries_event_detect(mock_gpio, mock_sleep):
+    mock_gpio.add_event_detect.side_effect = [RuntimeError, None]
+    counter = thingpin.pin.PulseCounter(22, edge='both', bouncetime=1)
+    counter.start()
+    assert mock_gpio.add_event_detect.mock_calls == [
+        call(22, mock_gpio.BOTH, callback=counter.pulse, bouncetime=1)] * 2
+    with pytest.raises(ValueError):
+        thingpin.pin.PulseCounter(22, edge='sideways')
+
+
+def test_create_pin_invalid_type():
+    t = thingpin.thingpin.Thingpin(Mock(), 'BCM', {})
+    with pytest.raises(ValueError):
+        t.create_pin('door', dict(CONFIG, type='dimmer'))
@@ -0,0 +1,103 @@
+import os
+import json
+import logging
+from Adafruit_IO import MQTTClient
+from .notifiers import Notifier
+
+
+class AdafruitNotifier(Notifier):
+    name = 'adafruit'
+
+    # TODO: consider supporting this directly in thingamon and not using
+    # the adafruit package. both have the same paho mqtt connection logic.
+    # adafruit does not lock the connected state variable, thingamon does
+    # not sure which is right yet
+    def __init__(self, username=None, api_key=None, host='io.adafruit.com',
+                 port=1883, group=None, exit_on_disconnect=True):
+        """
+        Create an Adafruit MQTT notifier
+
+        Args:
+            host (str): host name of Adafruit MQTT broker
+            port (int): port of Adafruit MQTT broker
+            username (str): Adafruit IO username
+            api_key (str): Adafruit IO API key
+            group (str): key of an Adafruit IO group. Batches of changes are
+                published to the group as one message, one feed per thing.
+                When None each change in a batch is its own message.
+            exit_on_disconnect (bool): if True exit the process when the
+                connection is lost so that the service manager restarts it.
+                If False the MQTT client reconnects by itself, use this with
+                an outbox to publish the changes made while disconnected.
+        """
+        self.log = logging.getLogger('thingpin')
+        self.username = username
+        self.api_key = api_key
+        self.host = host
+        self.port = port
+        self.group = group
+        self.exit_on_disconnect = exit_on_disconnect
+        self.client = None
+
+    def initialize(self, things=None):
+        self.client = MQTTClient(self.username, self.api_key,
+                                 service_host=self.host,
+                                 service_port=self.port)
+
+        def on_disconnect(client):
+            if client.disconnect_reason != 0:
+                self.disconnects += 1
+                if self.exit_on_disconnect:
+                    self.log.info('client disconnected, exiting')
+                    os._exit(1)
+                self.log.info('client disconnected, reconnecting')
+
+        self.client.on_disconnect = on_disconnect
+
+        self.client.connect()
+        self.log.info('connected to Adafruit')
+        self.client.loop_background()
+
+    def cleanup(self):
+        self.client.disconnect()
+
+    @property
+    def connected(self):
+        return self.client is not None and self.client.is_connected()
+
+    def encode(self, value):
+        """Adafruit feeds hold a single value: the `state` of the state"""
+        return str(value['state']).encode('utf-8')
+
+    def notify(self, name, value, payload=None):
+        self.log.info('Adafruit IO: publish(%s=%s)', name, value)
+        if payload is None:
+            payload = self.encode(value)
+        self.client.publish(name, payload)
+
+    def notify_snapshot(self, name, snapshot):
+        """Publish the snapshot as JSON to feed `name`"""
+        self.log.info('Adafruit IO: publish(snapshot %s)', name)
+        self.client.publish(name, json.dumps(snapshot, sort_keys=True))
+
+    def notify_batch(self, items):
+        if self.group is None:
+            return super(AdafruitNotifier, self).notify_batch(items)
+
+        feeds = dict((name, value['state']) for name, value, _ in items)
+        self.log.info('Adafruit IO: publish(group %s=%s)', self.group, feeds)
+        self.publish_group(json.dumps({'feeds': feeds}))
+
+    def publish_group(self, payload):
+        """
+        Publish a message to the group topic of `group`.
+
+        MQTTClient can only publish to a feed, `group_id` of its publish()
+        names the group of that one feed. This is the only place the paho
+        client underneath it is used.
+
+        Args:
+            payload (str): JSON group message of the feeds to update
+        """
+        self.client._client.publish(
+            '{}/groups/{}'.format(self.username, self.group), payload)
@@ -0,0 +1,158 @@
+"""
+Run thingpin on an asyncio event loop instead of a thread per task.
+
+Requires Python 3.5 or later, imported only for `runtime: asyncio`.
+"""
+import signal
+import asyncio
+import logging
+import concurrent.futures
+
+from .pin import clock_ns
+from .notifiers import QueuedNotifier, FanoutNotifier
+from .thingpin import CounterPin
+
+
+class AsyncRuntime(object):
+    def __init__(self, service, executor_size=2, reload=None):
+        """
+        Run a Thingpin on one event loop.
+
+        Polled pins are sampled by a single task that drives the Thingpin
+        Scanner, sleeping on the loop between scans and debounce timers.
+        Each notifier queue is published by a task that hands the blocking
+        MQTT calls to a small thread pool, the heartbeat and the publishing
+        of counter things are tasks, and SIGINT and SIGTERM stop everything
+        in order: sampling stops, queued messages are published and the
+        service is cleaned up.
+
+        Pins with `mode: edge` keep their EdgeWatcher thread, which blocks
+        until an edge, and the MQTT libraries keep their network thread.
+
+        Args:
+            service (Thingpin): service to run, not started
+            executor_size (int): threads for blocking calls
+            reload (callable): called on the loop on SIGHUP, must not
+                block, see `thingpin.main.start_reloader()`
+        """
+        self.log = logging.getLogger('thingpin')
+        self.service = service
+        self.reload = reload
+        self.executor = concurrent.futures.ThreadPoolExecutor(executor_size)
+        self.loop = None
+        self.stopping = None
+        self.wakes = []
+
+        # all polled pins are sampled by the Scanner, from a task
+        if service.scanner_config is None:
+            service.scanner_config = {}
+        # publishing must never block the loop, so always queue
+        if not isinstance(service.notifier, (QueuedNotifier,
+                                             FanoutNotifier)):
+            service.notifier = QueuedNotifier(service.notifier)
+        self.queues = getattr(service.notifier, 'notifiers',
+                              [service.notifier])
+        for queue in self.queues:
+            queue.threaded = False
+
+    def run(self):
+        """Run until SIGINT, SIGTERM or `stop()`"""
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.main())
+        finally:
+            self.loop.close()
+            self.executor.shutdown()
+
+    def stop(self):
+        """Stop the runtime, from the loop thread"""
+        if not self.stopping.is_set():
+            self.log.info('stopping')
+            self.stopping.set()
+
+    async def main(self):
+        loop = self.loop
+        self.stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+        if self.reload is not None and hasattr(signal, 'SIGHUP'):
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+
+        await loop.run_in_executor(self.executor, self.service.initialize)
+        self.log.info('run (asyncio)')
+        publishers = [loop.create_task(self.publish(q)) for q in self.queues]
+        tasks = [loop.create_task(self.sample())]
+        for pin in self.service.pins.values():
+            if isinstance(pin, CounterPin):
+                pin.start_counting()
+                tasks.append(loop.create_task(self.count(pin)))
+            else:
+                # only pins with their own thread, polled pins are scanned
+                pin.run()
+        if self.service.heartbeat is not None:
+            tasks.append(loop.create_task(self.heartbeat()))
+
+        await self.stopping.wait()
+
+        self.service.scanner.stop()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # publishers finish what is queued, then exit
+        for wake in self.wakes:
+            wake.set()
+        await asyncio.gather(*publishers, return_exceptions=True)
+        for queue in self.queues:
+            queue.on_pending = None
+        await loop.run_in_executor(self.executor, self.service.cleanup)
+
+    async def sample(self):
+        """Drive the Scanner, like its thread would"""
+        scanner = self.service.scanner
+        scanner.started = clock_ns()
+        if scanner.adaptive:
+            scanner.reset_intervals()
+            while not scanner.stopped:
+                await asyncio.sleep(scanner.scan_due())
+        else:
+            while not scanner.stopped:
+                scanner.scan()
+                await asyncio.sleep(scanner.sleep)
+
+    async def heartbeat(self):
+        heartbeat = self.service.heartbeat
+        while True:
+            await asyncio.sleep(heartbeat.interval)
+            heartbeat.beat()
+
+    async def count(self, pin):
+        while True:
+            await asyncio.sleep(pin.interval)
+            # saving the totals fsyncs, which must not stall sampling
+            await self.loop.run_in_executor(self.executor, pin.publish)
+
+    async def publish(self, queue):
+        """Publish a notifier queue whenever messages are queued"""
+        loop = self.loop
+        wake = asyncio.Event()
+        self.wakes.append(wake)
+        queue.on_pending = lambda: loop.call_soon_threadsafe(wake.set)
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(wake.wait(), queue.idle_timeout())
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+            if not queue.running:
+                # still connecting, keep the messages queued like the
+                # sender thread would, initialize() wakes the task
+                continue
+            try:
+                await loop.run_in_executor(self.executor, queue.send_pending)
+            except Exception:
+                self.log.exception('{} publish failed'.format(queue.name))
+
+
+def run(service, executor_size=2, reload=None):
+    """Run `service` on an event loop until stopped, see AsyncRuntime"""
+    AsyncRuntime(service, executor_size, reload).run()
@@ -0,0 +1,252 @@
+import os
+import json
+import logging
+import threading
+import collections
+from thingamon import Client, Thing
+from .notifiers import Notifier
+from .payloads import create_encoding, Delta
+from .thingpin import freeze, FrozenDict
+
+SHADOW_GET = '$aws/things/{}/shadow/get'
+SHADOW_GET_ACCEPTED = '$aws/things/{}/shadow/get/accepted'
+SHADOW_GET_REJECTED = '$aws/things/{}/shadow/get/rejected'
+
+
+class AWSIoTNotifier(Notifier):
+    name = 'aws'
+
+    def __init__(self, host=None, client_cert=None, private_key=None,
+                 aws_iot_message_unit_cost=5e-6, estimated_change_freq=0.0,
+                 batch_thing=None, encoding='json', topic=None,
+                 shadow_timeout=5, debug=False):
+        """
+        Create an AWS IoT MQTT notifier
+
+        Args:
+            host (str): host name of AWS IoT endpoint
+            client_cert (str): name of client certificate file
+            private_key (str): name of private key for client certificate
+            aws_iot_message_unit_cost (float): cost of an AWS IoT message
+                used to estimate monthly cost of operating this thingpin
+            estimated_change_freq (float): estimate of how often each
+                pin will change. Only used for guessing AWS costs at startup.
+            batch_thing (str): name of a Thing whose shadow receives
+                batches of changes as one update, with the state of each
+                thing reported under its name. When None each change in a
+                batch is published to its own Thing.
+            encoding (str): payload encoding, see `thingpin.payloads`.
+                With `delta` only what changed is published, and whole
+                states again after each reconnect. Shadows only accept
+                JSON, binary encodings need a `topic`.
+            topic (str): topic to publish states to instead of the
+                shadow update of each thing, `{}` is replaced by the
+                thing name
+            shadow_timeout (float): with `on_reported` set, longest time
+                in seconds `initialize()` waits for the shadows
+            debug (bool): if True log all MQTT traffic.
+        """
+        self.log = logging.getLogger('thingpin')
+
+        self.host = host
+        self.client_cert = os.path.expanduser(client_cert)
+        self.private_key = os.path.expanduser(private_key)
+        self.debug = debug
+        self.batch_thing = batch_thing
+        self.encoding = create_encoding(encoding)
+        if self.encoding.binary and topic is None:
+            raise ValueError('AWS IoT shadows only accept JSON, set a topic '
+                             'to publish {} to'.format(encoding))
+        self.topic = topic
+        self.delta = Delta() if self.encoding.delta else None
+        self.shadow_timeout = shadow_timeout
+        # things whose shadow get is not answered yet
+        self.shadows_pending = set()
+        self.shadows_received = threading.Event()
+        self.client = None
+        self.things = {}
+
+        self.log.info('AWS monthly cost guesstimate ${:,.8f}'.format(
+            estimated_change_freq *
+            60 * 60 * 24 * 30 *
+            aws_iot_message_unit_cost
+        ))
+        self.log.info('(don''t take the guesstimate too seriously!)')
+
+    def initialize(self, things=None):
+        # MQTT client
+        self.client = Client(self.host,
+                             client_cert_filename=self.client_cert,
+                             private_key_filename=self.private_key,
+                             log_mqtt=self.debug)
+        # count lost connections, keeping the thingamon handler
+        paho = self.client.client
+        on_disconnect = paho.on_disconnect
+
+        def count_disconnect(client, userdata, rc, *args):
+            if rc != 0:
+                self.disconnects += 1
+            on_disconnect(client, userdata, rc)
+
+        paho.on_disconnect = count_disconnect
+
+        # read back the shadows on every connect for on_reported
+        on_connect = paho.on_connect
+
+        def get_shadows(client, userdata, *args):
+            on_connect(client, userdata, *args)
+            # subscribers may have missed patches while disconnected
+            if self.delta is not None:
+                self.delta.reset()
+            if self.reads_shadows:
+                self.get_shadows()
+
+        paho.on_connect = get_shadows
+
+        for name, config in (things or {}).items():
+            self.things[name] = self.cache_thing(
+                name, config.get('iot_states', {}).values())
+
+        self.client.connect()
+        self.log.info('connected to AWS IoT')
+        # publishing before the shadows are read would republish states
+        # the broker already has
+        if self.reads_shadows and \
+                not self.shadows_received.wait(self.shadow_timeout):
+            self.log.warning('no shadow of {} within {} seconds'.format(
+                ', '.join(sorted(self.shadows_pending)),
+                self.shadow_timeout))
+
+    def cleanup(self):
+        self.client.disconnect()
+
+    @property
+    def reads_shadows(self):
+        """Whether shadows are read back for `on_reported` on connect"""
+        return self.on_reported is not None and self.topic is None
+
+    def get_shadows(self):
+        """Request the shadow of each thing, answered to `on_shadow()`"""
+        paho = self.client.client
+        names = [self.batch_thing] if self.batch_thing else list(self.things)
+        self.shadows_pending = set(names)
+        if not names:
+            self.shadows_received.set()
+        accepted = SHADOW_GET_ACCEPTED.format('+')
+        rejected = SHADOW_GET_REJECTED.format('+')
+        paho.message_callback_add(accepted, self.on_shadow)
+        paho.message_callback_add(rejected, self.on_shadow_rejected)
+        paho.subscribe([(accepted, 1), (rejected, 1)])
+        for name in names:
+            paho.publish(SHADOW_GET.format(name), '', qos=1)
+
+    def shadow_answered(self, name):
+        self.shadows_pending.discard(name)
+        if not self.shadows_pending:
+            self.shadows_received.set()
+
+    def on_shadow_rejected(self, client, userdata, message):
+        """Answer for a thing without a shadow yet"""
+        self.shadow_answered(message.topic.split('/')[2])
+
+    def on_shadow(self, client, userdata, message):
+        """Pass the reported state of a shadow to `on_reported`"""
+        name = message.topic.split('/')[2]
+        try:
+            self.report_shadow(name, message)
+        finally:
+            self.shadow_answered(name)
+
+    def report_shadow(self, name, message):
+        try:
+            reported = json.loads(message.payload.decode('utf-8'))[
+                'state'].get('reported')
+        except (ValueError, KeyError, AttributeError):
+            self.log.exception('invalid shadow of {}'.format(name))
+            return
+        if reported is None:
+            return
+        if name == self.batch_thing:
+            for thing, value in reported.items():
+                self.on_reported(thing, value)
+        else:
+            self.on_reported(name, reported)
+
+    @property
+    def connected(self):
+        return self.client is not None and self.client.connected
+
+    def cache_thing(self, name, states):
+        """
+        Prepare everything needed to publish states of a thing.
+
+        Args:
+            name (str): thing name
+            states (list of dict): states to pre-serialize
+
+        Returns:
+            CachedThing: Thing with its topic and a dict of message by
+                frozen state
+        """
+        thing = Thing(name, self.client)
+        topic = thing.topic if self.topic is None else self.topic.format(name)
+        payloads = {}
+        for state in states:
+            state = freeze(state)
+            payloads[state] = self.encode(state)
+        return CachedThing(thing, topic, payloads)
+
+    def thing(self, name):
+        """CachedThing of `name`, created on first use"""
+        cached = self.things.get(name)
+        if cached is None:
+            cached = self.things[name] = self.cache_thing(name, [])
+        return cached
+
+    def encode(self, value):
+        """Serialize state as a shadow update, or as is with a `topic`"""
+        if self.topic is None:
+            value = {'state': {'reported': value}}
+        return self.encoding.dumps(value)
+
+    def notify(self, name, value, payload=None):
+        self.log.info('AWS IoT: publish(%s=%s)', name, value)
+        cached = self.thing(name)
+        if self.delta is not None:
+            payload = self.delta.payload(name, value, self.encode)
+        elif payload is None:
+            # plain dicts, like states replayed from the outbox or
+            # received by the hub, are looked up by their frozen copy
+            if not isinstance(value, FrozenDict):
+                value = freeze(value)
+            try:
+                payload = cached.payloads.get(value)
+            except TypeError:
+                # holds values freeze() leaves unhashable
+                pass
+            if payload is None:
+                payload = self.encode(value)
+        self.client.publish(cached.topic, payload)
+        if self.delta is not None:
+            self.delta.published(name, value)
+
+    def notify_batch(self, items):
+        if self.batch_thing is None:
+            return super(AWSIoTNotifier, self).notify_batch(items)
+
+        states = dict((name, value) for name, value, _ in items)
+        self.log.info('AWS IoT: publish(%s=%s)', self.batch_thing, states)
+        if self.delta is None:
+            self.notify(self.batch_thing, states)
+            return
+
+        # a batch has only some things, so patch each thing on its own
+        patches = dict((name, self.delta.patch(name, value))
+                       for name, value in states.items())
+        self.client.publish(self.thing(self.batch_thing).topic,
+                            self.encode(patches))
+        for name, value in states.items():
+            self.delta.published(name, value)
+
+
+CachedThing = collections.namedtuple('CachedThing', 'thing topic payloads')
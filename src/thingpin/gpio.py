@@ -0,0 +1,392 @@
+import os
+import time
+import mmap
+import bisect
+import random
+import struct
+import threading
+
+from .journal import is_journal, read_journal
+from .pin import clock
+
+
+def create_gpio(config=None):
+    """
+    Create the GPIO backend for the `gpio` config section.
+
+    Args:
+        config (dict): `backend` is one of:
+            - `rpi`: RPi.GPIO, the default
+            - `simulated`: SimulatedGPIO, the other keys are passed to it
+            - `replay`: ReplayGPIO, the other keys are passed to it
+            - `gpiomem`: BankGPIO, the other keys are passed to it
+
+    Returns:
+        object: the RPi.GPIO module or an object with the same interface
+
+    Raises:
+        ImportError: if `rpi` is selected and RPi.GPIO cannot be imported
+    """
+    config = dict(config or {})
+    backend = config.pop('backend', 'rpi')
+    if backend == 'rpi':
+        try:
+            from RPi import GPIO
+        except RuntimeError as e:
+            # RPi.GPIO raises RuntimeError when imported on other hardware
+            raise ImportError(str(e))
+        return GPIO
+    elif backend == 'simulated':
+        return SimulatedGPIO(**config)
+    elif backend == 'replay':
+        return ReplayGPIO(**config)
+    elif backend == 'gpiomem':
+        return BankGPIO(**config)
+    raise ValueError('unknown gpio backend {}'.format(backend))
+
+
+class BaseGPIO(object):
+    """
+    Subset of the RPi.GPIO interface used by thingpin.
+
+    Subclasses implement `level(pin, now)`.
+    """
+    HIGH = 1
+    LOW = 0
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+    IN = 1
+    BOARD = 10
+    BCM = 11
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    # how often wait_for_edge polls in seconds
+    edge_poll = .001
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pulls = {}
+        # pin: Event that stops its edge detection thread
+        self.detectors = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF):
+        self.pulls[pin] = pull_up_down
+
+    def cleanup(self):
+        pass
+
+    def input(self, pin):
+        with self.lock:
+            return self.level(pin, clock())
+
+    def wait_for_edge(self, pin, edge, timeout=None):
+        """
+        Wait until the pin changes.
+
+        Returns:
+            int: `pin`, or None on timeout, like RPi.GPIO
+        """
+        start = clock()
+        level = self.input(pin)
+        while timeout is None or clock() - start < timeout / 1000.0:
+            time.sleep(self.edge_poll)
+            new_level = self.input(pin)
+            if new_level != level:
+                if self.matches(edge, new_level):
+                    return pin
+                level = new_level
+        return None
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        """
+        Call `callback(pin)` from a thread on each edge, like RPi.GPIO.
+
+        Edges are found by polling every `edge_poll` seconds. `bouncetime`
+        is ignored.
+        """
+        if pin in self.detectors:
+            raise RuntimeError('Conflicting edge detection already enabled '
+                               'for this GPIO channel')
+        stopped = self.detectors[pin] = threading.Event()
+
+        def detect():
+            level = self.input(pin)
+            while not stopped.wait(self.edge_poll):
+                new_level = self.input(pin)
+                if new_level != level:
+                    level = new_level
+                    if callback is not None and self.matches(edge, level):
+                        callback(pin)
+
+        thread = threading.Thread(target=detect,
+                                  name='EdgeDetect-{}'.format(pin))
+        thread.daemon = True
+        thread.start()
+
+    def remove_event_detect(self, pin):
+        stopped = self.detectors.pop(pin, None)
+        if stopped is not None:
+            stopped.set()
+
+    def matches(self, edge, level):
+        """Whether a change to `level` is an `edge` edge"""
+        return edge == self.BOTH or (edge == self.RISING) == (
+            level == self.HIGH)
+
+    def initial_level(self, pin):
+        """Level of a pin that has not changed yet, set by its resistor"""
+        if self.pulls.get(pin) == self.PUD_UP:
+            return self.HIGH
+        return self.LOW
+
+
+class SimulatedGPIO(BaseGPIO):
+    def __init__(self, interval=1.0, pattern='random', bounce=0.0,
+                 noise=0.0, seed=None):
+        """
+        Synthetic input pins for running without a Raspberry Pi.
+
+        Each pin starts at the level its resistor pulls it to and then
+        changes level, on average every `interval` seconds. After each
+        change the pin bounces, reading random levels, for `bounce` seconds.
+        Any reading can also be flipped by noise.
+
+        Args:
+            interval (float): average seconds between changes of each pin.
+                0 means pins never change.
+            pattern (str): `random` for exponentially distributed times
+                between changes, `square` for changes exactly every
+                `interval` seconds, offset per pin
+            bounce (float): seconds of contact bounce after each change
+            noise (float): probability that a reading is flipped
+            seed (int): random seed, for repeatable runs
+        """
+        super(SimulatedGPIO, self).__init__()
+        if pattern not in ('random', 'square'):
+            raise ValueError('invalid pattern {}'.format(pattern))
+        self.interval = interval
+        self.pattern = pattern
+        self.bounce = bounce
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.pins = {}
+
+    def level(self, pin, now):
+        state = self.pins.get(pin)
+        if state is None:
+            state = self.pins[pin] = [self.initial_level(pin), now,
+                                      now + self.next_interval(pin)]
+        level, changed, next_change = state
+
+        if self.interval:
+            while now >= next_change:
+                level ^= 1
+                changed = next_change
+                next_change += self.next_interval()
+            state[:] = level, changed, next_change
+
+        if now - changed < self.bounce:
+            level = self.random.getrandbits(1)
+        if self.noise and self.random.random() < self.noise:
+            level ^= 1
+        return level
+
+    def next_interval(self, pin=None):
+        if not self.interval:
+            return float('inf')
+        if self.pattern == 'square':
+            if pin is not None:
+                # first change: spread pins over the interval
+                return self.interval * ((pin * 0.618034) % 1 or 1)
+            return self.interval
+        return self.random.expovariate(1.0 / self.interval)
+
+
+class ReplayGPIO(BaseGPIO):
+    def __init__(self, path, speed=1.0, loop=False):
+        """
+        Replay recorded pin edges.
+
+        The trace file has one edge per line: seconds since the start of
+        the recording, pin number and level, separated by whitespace. Lines
+        starting with # are ignored. Pins read their resistor level until
+        their first edge. A journal file recorded by thingpin can be
+        replayed too.
+
+        Args:
+            path (str): trace or journal file
+            speed (float): replay speed, 2 replays twice as fast
+            loop (bool): start over at the end of the trace
+        """
+        super(ReplayGPIO, self).__init__()
+        self.speed = speed
+        self.loop = loop
+        self.edges = {}
+        self.duration = 0
+        for t, pin, level in self.read(path):
+            times, levels = self.edges.setdefault(pin, ([], []))
+            times.append(t)
+            levels.append(level)
+            self.duration = max(self.duration, t)
+        for times, levels in self.edges.values():
+            order = sorted(range(len(times)), key=times.__getitem__)
+            times[:] = [times[i] for i in order]
+            levels[:] = [levels[i] for i in order]
+        self.start = clock()
+
+    def read(self, path):
+        """Read (seconds, pin, level) edges from a trace or journal file"""
+        if is_journal(path):
+            edges = read_journal(path)
+            for edge in edges:
+                yield (edge.ns - edges[0].ns) / 1e9, edge.pin, edge.level
+            return
+
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    t, pin, level = line.split()
+                    yield float(t), int(pin), int(level)
+
+    def setmode(self, mode):
+        # replay starts when thingpin starts setting up pins
+        self.start = clock()
+
+    def level(self, pin, now):
+        t = (now - self.start) * self.speed
+        if self.loop and self.duration:
+            t %= self.duration
+        if pin not in self.edges:
+            return self.initial_level(pin)
+        times, levels = self.edges[pin]
+        i = bisect.bisect_right(times, t)
+        if i == 0:
+            return self.initial_level(pin)
+        return levels[i - 1]
+
+
+# BCM283x GPIO pin level registers, offsets in the GPIO register block
+GPLEV0 = 0x34
+GPLEV1 = 0x38
+GPIO_BLOCK_SIZE = 4096
+LEVEL_WORD = struct.Struct('<I')
+
+
+class BankGPIO(BaseGPIO):
+    def __init__(self, path='/dev/gpiomem', pins=54, setup=None):
+        """
+        Read all pin levels at once from the memory mapped GPIO registers.
+
+        `read_bank()` returns the levels of all pins as one integer, bit N
+        for BCM pin N, read from the GPLEV0 (pins 0-31) and GPLEV1 (pins
+        32-53) registers. The Scanner reads it once per loop instead of
+        reading each pin, see `thingpin.pin.Scanner`. Pin numbers must be
+        BCM numbers.
+
+        /dev/gpiomem only gives access to the registers, so pin setup (pull
+        up and down resistors) and edge detection are done by RPi.GPIO if
+        it can be imported. Any file at least 60 bytes long can stand in for
+        /dev/gpiomem, with the register words little endian at their
+        offsets.
+
+        Args:
+            path (str): GPIO register device, or a file standing in for it
+            pins (int): 32 to only read GPLEV0, or 54 to read both registers
+            setup (object): backend for setup, cleanup and wait_for_edge,
+                RPi.GPIO if None and importable
+        """
+        super(BankGPIO, self).__init__()
+        if pins not in (32, 54):
+            raise ValueError('invalid gpiomem pins {}'.format(pins))
+        self.path = os.path.expanduser(path)
+        self.pins = pins
+        if setup is None and path == '/dev/gpiomem':
+            try:
+                from RPi import GPIO as setup
+            except (ImportError, RuntimeError):
+                setup = None
+        self.delegate = setup
+
+        fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_SYNC', 0))
+        try:
+            size = min(os.fstat(fd).st_size or GPIO_BLOCK_SIZE,
+                       GPIO_BLOCK_SIZE)
+            if size < GPLEV1 + LEVEL_WORD.size:
+                raise ValueError('{} is too small for the GPIO registers'
+                                 .format(self.path))
+            self.map = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+    def read_bank(self):
+        """
+        Levels of all pins.
+
+        Returns:
+            int: bit N set when BCM pin N is HIGH
+        """
+        levels = LEVEL_WORD.unpack_from(self.map, GPLEV0)[0]
+        if self.pins > 32:
+            levels |= LEVEL_WORD.unpack_from(self.map, GPLEV1)[0] << 32
+        return levels
+
+    def level(self, pin, now):
+        if pin >= self.pins:
+            raise ValueError('pin {} is not read'.format(pin))
+        return self.read_bank() >> pin & 1
+
+    def input(self, pin):
+        # a register read needs no lock
+        return self.level(pin, None)
+
+    def setmode(self, mode):
+        if mode != self.BCM:
+            raise ValueError('gpiomem backend needs pin_mode BCM')
+        if self.delegate is not None:
+            self.delegate.setmode(self.delegate.BCM)
+
+    def setup(self, pin, direction, pull_up_down=BaseGPIO.PUD_OFF):
+        super(BankGPIO, self).setup(pin, direction, pull_up_down)
+        if self.delegate is not None:
+            d = self.delegate
+            pull = {self.PUD_UP: d.PUD_UP, self.PUD_DOWN: d.PUD_DOWN}.get(
+                pull_up_down, d.PUD_OFF)
+            d.setup(pin, d.IN, pull_up_down=pull)
+
+    def wait_for_edge(self, pin, edge, timeout=None):
+        if self.delegate is None:
+            return super(BankGPIO, self).wait_for_edge(pin, edge, timeout)
+        d = self.delegate
+        edge = {self.RISING: d.RISING, self.FALLING: d.FALLING}.get(
+            edge, d.BOTH)
+        if timeout is None:
+            return d.wait_for_edge(pin, edge)
+        return d.wait_for_edge(pin, edge, timeout=timeout)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        if self.delegate is None:
+            return super(BankGPIO, self).add_event_detect(
+                pin, edge, callback, bouncetime)
+        d = self.delegate
+        edge = {self.RISING: d.RISING, self.FALLING: d.FALLING}.get(
+            edge, d.BOTH)
+        if bouncetime is None:
+            return d.add_event_detect(pin, edge, callback=callback)
+        return d.add_event_detect(pin, edge, callback=callback,
+                                  bouncetime=bouncetime)
+
+    def remove_event_detect(self, pin):
+        if self.delegate is None:
+            return super(BankGPIO, self).remove_event_detect(pin)
+        self.delegate.remove_event_detect(pin)
+
+    def cleanup(self):
+        if self.delegate is not None:
+            self.delegate.cleanup()
@@ -0,0 +1,385 @@
+"""
+Hub mode: thingpin nodes send thing states over the LAN to a hub, which
+publishes them to the broker over its own connection.
+
+Nodes use the `hub` notifier, the hub runs `thingpin hub`. The protocol is
+a stream (TCP) or datagrams (UDP) of frames: a 15 byte header of magic
+`TP`, version, kind (state or snapshot), the encoding of the value, the node
+session id, a sequence number and the body length, then a body of the node
+name and the thing name, each prefixed by its length byte, and the value.
+"""
+import socket
+import random
+import struct
+import logging
+import threading
+import collections
+
+from .notifiers import Notifier
+from .metrics import Metric
+from .payloads import JSONEncoding, create_encoding, encoding_for_code
+
+MAGIC = b'TP'
+VERSION = 1
+STATE = 0
+SNAPSHOT = 1
+# magic, version, kind, encoding, node session, sequence number, body length
+FRAME = struct.Struct('<2sBBBIIH')
+NAME_LENGTH = struct.Struct('B')
+DEFAULT_PORT = 7583
+# largest UDP datagram sent, below the IPv4 limit
+MAX_DATAGRAM = 65000
+
+Frame = collections.namedtuple('Frame', 'kind node session seq name value')
+
+
+def pack_frame(kind, node, session, seq, name, payload,
+               encoding=JSONEncoding.code):
+    """
+    Encode a frame.
+
+    Args:
+        kind (int): STATE or SNAPSHOT
+        node (str): name of the sending node
+        session (int): 32 bit id of the node process
+        seq (int): 32 bit sequence number, increasing per node session
+        name (str): thing name
+        payload (bytes): encoded value
+        encoding (int): code of the value encoding, see `thingpin.payloads`
+
+    Returns:
+        bytes
+    """
+    node = node.encode('utf-8')
+    name = name.encode('utf-8')
+    if len(node) > 255 or len(name) > 255:
+        raise ValueError('node and thing names are limited to 255 bytes')
+    body = b''.join([NAME_LENGTH.pack(len(node)), node,
+                     NAME_LENGTH.pack(len(name)), name, payload])
+    if len(body) > 65535:
+        raise ValueError('value of {} too large'.format(name))
+    return FRAME.pack(MAGIC, VERSION, kind, encoding, session & 0xffffffff,
+                      seq & 0xffffffff, len(body)) + body
+
+
+def unpack_frames(data, encodings=None):
+    """
+    Decode the frames at the start of `data`.
+
+    Args:
+        data (bytes): received data
+        encodings (dict of int: Encoding): encodings by code, added to as
+            frames with other encodings are decoded
+
+    Returns:
+        tuple: list of Frame, and the bytes of an incomplete frame at the end
+
+    Raises:
+        ValueError: if `data` is not a stream of hub frames, or a value
+            cannot be decoded
+    """
+    if encodings is None:
+        encodings = {}
+    frames = []
+    offset = 0
+    while len(data) - offset >= FRAME.size:
+        magic, version, kind, code, session, seq, length = \
+            FRAME.unpack_from(data, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a thingpin hub frame')
+        start = offset + FRAME.size
+        end = start + length
+        if len(data) < end:
+            break
+        names = []
+        for _ in range(2):
+            if start >= end:
+                raise ValueError('invalid hub frame')
+            size = NAME_LENGTH.unpack_from(data, start)[0]
+            if start + 1 + size > end:
+                raise ValueError('invalid hub frame')
+            try:
+                names.append(data[start + 1:start + 1 + size].decode(
+                    'utf-8'))
+            except UnicodeDecodeError:
+                raise ValueError('invalid hub frame')
+            start += 1 + size
+        encoding = encodings.get(code)
+        if encoding is None:
+            encoding = encodings[code] = encoding_for_code(code)
+        try:
+            value = encoding.loads(data[start:end])
+        except Exception:
+            raise ValueError('invalid {} value'.format(encoding.name))
+        frames.append(Frame(kind, names[0], session, seq, names[1], value))
+        offset = end
+    return frames, data[offset:]
+
+
+class Hub(object):
+    def __init__(self, notifier):
+        """
+        Publish the states sent by nodes.
+
+        Frames a node sends more than once, like UDP duplicates or frames
+        older than the last one for the same thing, are dropped by their
+        session and sequence number. Batching and deduplicating of values
+        is done by `notifier`, configured like on a node, so a single
+        broker connection is shared by all nodes. Snapshots of node `N`
+        published to `NAME` are published as `NAME-N`.
+
+        Args:
+            notifier (Notifier): notifier to publish with
+        """
+        self.log = logging.getLogger('thingpin')
+        self.notifier = notifier
+        self.lock = threading.Lock()
+        # (node, thing): (session, seq) of the last frame published
+        self.last = {}
+        self.nodes = set()
+        self.counters = dict.fromkeys(['frames', 'duplicates', 'invalid'],
+                                      0)
+
+    def receive(self, frames):
+        """Publish frames received from a node"""
+        for frame in frames:
+            key = (frame.node, frame.name)
+            with self.lock:
+                self.counters['frames'] += 1
+                self.nodes.add(frame.node)
+                last = self.last.get(key)
+                if last is not None and last[0] == frame.session and \
+                        frame.seq <= last[1]:
+                    self.counters['duplicates'] += 1
+                    continue
+                self.last[key] = (frame.session, frame.seq)
+
+            if frame.kind == SNAPSHOT:
+                self.notifier.notify_snapshot(
+                    '{}-{}'.format(frame.name, frame.node), frame.value)
+            else:
+                self.notifier.notify(frame.name, frame.value)
+
+    def invalid(self, peer):
+        with self.lock:
+            self.counters['invalid'] += 1
+        self.log.warning('hub: invalid data from {}'.format(peer))
+
+    @property
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, nodes=len(self.nodes))
+
+    def metrics(self):
+        stats = self.stats
+        return [
+            Metric('thingpin_hub_frames_total', 'counter',
+                   'Frames received from nodes, by what happened to them',
+                   [('', {'result': 'published'},
+                     stats['frames'] - stats['duplicates']),
+                    ('', {'result': 'duplicate'}, stats['duplicates'])]),
+            Metric('thingpin_hub_invalid_total', 'counter',
+                   'Connections or datagrams with invalid data',
+                   [('', {}, stats['invalid'])]),
+            Metric('thingpin_hub_nodes', 'gauge', 'Nodes seen since start',
+                   [('', {}, stats['nodes'])]),
+        ] + self.notifier.metrics()
+
+
+def serve_hub(hub, address, transports=('tcp', 'udp')):
+    """
+    Receive frames for a Hub from daemon threads.
+
+    Args:
+        hub (Hub): hub to pass frames to
+        address (str): `host:port` to listen on
+        transports (list of str): `tcp`, `udp` or both
+
+    Returns:
+        list of server: the running servers, `shutdown()` stops one
+    """
+    try:
+        import socketserver
+    except ImportError:
+        import SocketServer as socketserver
+
+    # decoders of the value encodings nodes use
+    encodings = {}
+
+    class TCPHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            pending = b''
+            while True:
+                data = self.request.recv(65536)
+                if not data:
+                    return
+                try:
+                    frames, pending = unpack_frames(pending + data,
+                                                    encodings)
+                except ValueError:
+                    hub.invalid(self.client_address)
+                    return
+                hub.receive(frames)
+
+    class UDPHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            try:
+                frames, rest = unpack_frames(self.request[0], encodings)
+                if rest:
+                    raise ValueError('incomplete frame')
+            except ValueError:
+                hub.invalid(self.client_address)
+                return
+            hub.receive(frames)
+
+    class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    host, port = address.rsplit(':', 1)
+    servers = []
+    for transport in transports:
+        if transport == 'tcp':
+            server = TCPServer((host, int(port)), TCPHandler)
+        elif transport == 'udp':
+            server = socketserver.UDPServer((host, int(port)), UDPHandler)
+        else:
+            raise ValueError('invalid hub transport {}'.format(transport))
+        thread = threading.Thread(target=server.serve_forever,
+                                  name='Hub{}'.format(transport.upper()))
+        thread.daemon = True
+        thread.start()
+        logging.getLogger('thingpin').info('hub listening on {} {}'.format(
+            transport, '{}:{}'.format(*server.server_address[:2])))
+        servers.append(server)
+    return servers
+
+
+class HubNotifier(Notifier):
+    name = 'hub'
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, transport='tcp',
+                 node=None, timeout=5, encoding='json'):
+        """
+        Send thing states to a thingpin hub instead of a broker.
+
+        With TCP a lost connection is counted in `disconnects` and
+        reopened on the next publish, with UDP each publish is a datagram
+        the hub may never get. Use an `outbox` to keep changes while the
+        hub is unreachable over TCP.
+
+        Args:
+            host (str): hub host name or address
+            port (int): hub port
+            transport (str): `tcp` or `udp`
+            node (str): name of this node, the host name if None
+            timeout (float): TCP connect and send timeout in seconds
+            encoding (str): `json`, `msgpack` or `cbor`, see
+                `thingpin.payloads`. The hub needs the library of the
+                encoding too. Set `delta` on the notifier of the hub,
+                which publishes the whole state it gets from nodes.
+        """
+        if transport not in ('tcp', 'udp'):
+            raise ValueError('invalid hub transport {}'.format(transport))
+        self.encoding = create_encoding(encoding)
+        if self.encoding.delta:
+            raise ValueError('the hub notifier does not support {} '
+                             'encoding'.format(encoding))
+        self.log = logging.getLogger('thingpin')
+        self.host = host
+        self.port = port
+        self.transport = transport
+        self.node = node or socket.gethostname()
+        self.timeout = timeout
+        # sequence numbers start over with each session
+        self.session = random.SystemRandom().getrandbits(32)
+        self.seq = 0
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def initialize(self, things=None):
+        try:
+            self.connect()
+        except (socket.error, OSError):
+            self.log.exception('cannot reach hub {}:{}, retrying on '
+                               'publish'.format(self.host, self.port))
+
+    def connect(self):
+        if self.transport == 'udp':
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((self.host, self.port))
+        else:
+            self.sock = socket.create_connection((self.host, self.port),
+                                                 self.timeout)
+        self.log.info('connected to hub {}:{} over {}'.format(
+            self.host, self.port, self.transport))
+
+    def cleanup(self):
+        with self.lock:
+            self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def encode(self, value):
+        """The value of a frame"""
+        return self.encoding.dumps(value)
+
+    def notify(self, name, value, payload=None):
+        self.log.info('hub: publish(%s=%s)', name, value)
+        self.send([(STATE, name, value, payload)])
+
+    def notify_batch(self, items):
+        self.log.info('hub: publish(%d changes)', len(items))
+        self.send([(STATE, name, value, payload)
+                   for name, value, payload in items])
+
+    def notify_snapshot(self, name, snapshot):
+        self.log.info('hub: publish(snapshot %s)', name)
+        self.send([(SNAPSHOT, name, snapshot, None)])
+
+    def send(self, messages):
+        """Send (kind, name, value, payload) messages, as few writes"""
+        with self.lock:
+            frames = []
+            for kind, name, value, payload in messages:
+                self.seq += 1
+                if payload is None:
+                    payload = self.encode(value)
+                frames.append(pack_frame(kind, self.node, self.session,
+                                         self.seq, name, payload,
+                                         self.encoding.code))
+            if self.sock is None:
+                self.connect()
+            try:
+                if self.transport == 'udp':
+                    for datagram in pack_datagrams(frames):
+                        self.sock.send(datagram)
+                else:
+                    self.sock.sendall(b''.join(frames))
+            except (socket.error, OSError):
+                if self.transport == 'tcp':
+                    self.disconnects += 1
+                    self.close()
+                raise
+
+
+def pack_datagrams(frames, size=MAX_DATAGRAM):
+    """Join frames into as few datagrams of at most `size` bytes as fit"""
+    datagram = []
+    length = 0
+    for frame in frames:
+        if datagram and length + len(frame) > size:
+            yield b''.join(datagram)
+            datagram = []
+            length = 0
+        datagram.append(frame)
+        length += len(frame)
+    if datagram:
+        yield b''.join(datagram)
@@ -0,0 +1,233 @@
+import os
+import mmap
+import time
+import uuid
+import struct
+import threading
+import collections
+
+from .pin import clock_ns
+
+MAGIC = b'TPJ1'
+VERSION = 2
+# magic, version, record size, capacity, records written, wall clock
+# nanoseconds at monotonic 0, boot id
+HEADER = struct.Struct('<4sHHIQq16s')
+HEADER_SIZE = 64
+# monotonic nanoseconds, pin, level, padding
+RECORD = struct.Struct('<qHBx')
+BOOT_ID = '/proc/sys/kernel/random/boot_id'
+NO_BOOT_ID = b'\0' * 16
+# without boot ids, anchors further apart than this mean a reboot
+ANCHOR_TOLERANCE = 10 ** 9
+
+Edge = collections.namedtuple('Edge', 'ns pin level')
+
+
+class Journal(object):
+    """
+    Ring file of raw pin edges.
+
+    The file is a 64 byte header followed by `capacity` fixed width records
+    of monotonic nanosecond timestamp, pin and level. When the ring is full
+    the oldest edges are overwritten. The file is memory mapped, so
+    recording an edge is a couple of memory writes and the edges survive a
+    crash of the process. They reach the disk when the kernel writes the
+    pages back, or on `flush()`.
+
+    Monotonic time starts over on every boot, so the header also holds
+    the boot id and `anchor`, the wall clock time at monotonic 0. Opening
+    a journal written during an earlier boot rebases its edges to the
+    monotonic time of this boot using both anchors, so edge times keep
+    their order and gaps across reboots. Edges from before the reboot
+    can then have negative times. The anchor is only as good as the wall
+    clock, so it is taken again on `flush()` and `close()`, by which time
+    a Raspberry Pi without a real time clock has usually synced it.
+    """
+
+    def __init__(self, path, capacity=65536):
+        """
+        Open or create a journal.
+
+        Args:
+            path (str): journal file
+            capacity (int): number of edges kept when creating the file, an
+                existing journal keeps its capacity
+        """
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        self.boot = boot_id()
+        self.anchor = wall_anchor()
+
+        previous = None
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, 'rb') as f:
+                capacity, self.count, anchor, boot = read_header(
+                    f.read(HEADER_SIZE))
+            previous = (anchor, boot)
+        else:
+            with open(self.path, 'wb') as f:
+                f.truncate(HEADER_SIZE + capacity * RECORD.size)
+            self.count = 0
+
+        self.capacity = capacity
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(),
+                             HEADER_SIZE + capacity * RECORD.size)
+        if previous is not None and self.count and \
+                rebooted(previous[1], self.boot, previous[0], self.anchor):
+            self._rebase(previous[0] - self.anchor)
+        self._write_header()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def record(self, pin, level, ns=None):
+        """
+        Record an edge.
+
+        Args:
+            pin (int): pin number
+            level (int): pin level after the edge
+            ns (int): monotonic nanoseconds, now if None
+        """
+        if ns is None:
+            ns = clock_ns()
+        with self.lock:
+            RECORD.pack_into(self.map, HEADER_SIZE + (self.count %
+                             self.capacity) * RECORD.size, ns, pin, level)
+            self.count += 1
+            self._write_header()
+
+    def edges(self):
+        """Edges in the ring, oldest first"""
+        with self.lock:
+            return list(iter_edges(self.map, self.capacity, self.count))
+
+    def flush(self):
+        with self.lock:
+            self.anchor = wall_anchor()
+            self._write_header()
+        self.map.flush()
+
+    def close(self):
+        with self.lock:
+            self.anchor = wall_anchor()
+            self._write_header()
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+
+    def _rebase(self, delta):
+        """Add `delta` nanoseconds to the time of every edge"""
+        for n in range(max(self.count - self.capacity, 0), self.count):
+            offset = HEADER_SIZE + (n % self.capacity) * RECORD.size
+            ns, pin, level = RECORD.unpack_from(self.map, offset)
+            RECORD.pack_into(self.map, offset, ns + delta, pin, level)
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size,
+                         self.capacity, self.count, self.anchor,
+                         self.boot or NO_BOOT_ID)
+
+
+def boot_id():
+    """16 byte id of the running boot, None if the system has none"""
+    try:
+        with open(BOOT_ID) as f:
+            return uuid.UUID(f.read().strip()).bytes
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def wall_anchor():
+    """Wall clock nanoseconds at monotonic time 0"""
+    return int(time.time() * 1e9) - clock_ns()
+
+
+def rebooted(boot, current_boot, anchor, current_anchor):
+    """Whether a journal header is from an earlier boot"""
+    if boot is not None and current_boot is not None:
+        return boot != current_boot
+    return abs(anchor - current_anchor) > ANCHOR_TOLERANCE
+
+
+def read_header(data):
+    """
+    Check a journal header.
+
+    Returns:
+        tuple: capacity, number of records written, anchor and boot id (None
+            if not known)
+
+    Raises:
+        ValueError: if `data` is not a journal header
+    """
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a thingpin journal')
+    magic, version, record_size, capacity, count, anchor, boot = \
+        HEADER.unpack_from(data)
+    if version != VERSION or record_size != RECORD.size:
+        raise ValueError('unsupported thingpin journal version {}'.format(
+            version))
+    return capacity, count, anchor, None if boot == NO_BOOT_ID else boot
+
+
+def iter_edges(data, capacity, count):
+    first = max(count - capacity, 0)
+    for n in range(first, count):
+        yield Edge(*RECORD.unpack_from(
+            data, HEADER_SIZE + (n % capacity) * RECORD.size))
+
+
+def is_journal(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_journal(path):
+    """
+    Read the edges of a journal file without opening it for writing.
+
+    Returns:
+        list of Edge: oldest first
+    """
+    with open(os.path.expanduser(path), 'rb') as f:
+        data = f.read()
+    capacity, count = read_header(data)[:2]
+    return list(iter_edges(data, capacity, count))
+
+
+def summarize(edges, bounce=.005):
+    """
+    Summarize edges per pin.
+
+    Args:
+        edges (list of Edge): edges, oldest first
+        bounce (float): edges closer than this in seconds to the previous
+            edge of the pin are counted as bounces
+
+    Returns:
+        dict of int: dict: per pin `edges`, `first` and `last` (seconds
+            from the first edge in the journal), `bounces`, and the
+            `min_gap` and `median_gap` between edges in seconds
+    """
+    if not edges:
+        return {}
+    start = edges[0].ns
+    times = collections.defaultdict(list)
+    for edge in edges:
+        times[edge.pin].append((edge.ns - start) / 1e9)
+
+    summary = {}
+    for pin, t in sorted(times.items()):
+        gaps = sorted(b - a for a, b in zip(t, t[1:]))
+        summary[pin] = {
+            'edges': len(t),
+            'first': t[0],
+            'last': t[-1],
+            'bounces': sum(1 for g in gaps if g < bounce),
+            'min_gap': gaps[0] if gaps else None,
+            'median_gap': gaps[len(gaps) // 2] if gaps else None,
+        }
+    return summary
@@ -1,22 +1,169 @@
+import sys
+import atexit
 import logging
 import logging.handlers
-import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .pin import clock_ns
 
 
-def Logger(name='thingpin', level=logging.INFO, log_file=None):
+def Logger(name='thingpin', level=logging.INFO, log_file=None, queued=False,
+           queue_size=10000, flush_interval=1.0):
+    """
+    Configure the thingpin logger.
+
+    With `queued` logging calls only put the record on a queue. A
+    LogWriter thread formats and writes the records, flushing once per
+    batch and at least every `flush_interval` seconds, so file I/O and
+    rollover never run on the threads sampling pins or publishing.
+
+    Args:
+        name (str): logger name
+        level (int): logging level
+        log_file (str): file to log to, rotated at 10MB. None logs to
+            standard out.
+        queued (bool): write records from a background thread
+        queue_size (int): most records waiting to be written, records
+            logged while the queue is full are dropped
+        flush_interval (float): longest time in seconds written records
+            wait to be flushed, except errors which are flushed right away
+    """
     logger = logging.getLogger(name)
     logger.setLevel(level)
     logger.propagate = False
 
     if log_file is not None:
-        handler = logging.handlers.RotatingFileHandler(
+        handler = RotatingFileHandler(
             log_file, maxBytes=10 * 1024 * 1024, backupCount=50)
         handler.setFormatter(logging.Formatter(
             '%(asctime)s %(name)s %(process)d %(levelname)s %(message)s'))
     else:
-        handler = logging.StreamHandler(stream=sys.stdout)
+        handler = StreamHandler(stream=sys.stdout)
         handler.setFormatter(logging.Formatter(
             '%(asctime)s %(name)s %(levelname)s %(message)s'))
 
+    if queued:
+        records = queue.Queue(queue_size)
+        writer = LogWriter(records, handler, flush_interval=flush_interval)
+        writer.start()
+        atexit.register(writer.stop)
+        handler = QueueHandler(records)
+
     logger.addHandler(handler)
     return logger
+
+
+class BatchFlushMixin(object):
+    """Handler that skips the flush after each record while `batching`"""
+    batching = False
+
+    def flush(self):
+        if not self.batching:
+            super(BatchFlushMixin, self).flush()
+
+
+class StreamHandler(BatchFlushMixin, logging.StreamHandler):
+    pass
+
+
+class RotatingFileHandler(BatchFlushMixin,
+                          logging.handlers.RotatingFileHandler):
+    pass
+
+
+class QueueHandler(logging.Handler):
+    """
+    Put records on a queue without formatting them or blocking.
+
+    Records are formatted later by the LogWriter, so arguments of logging
+    calls must not be changed after the call.
+    """
+
+    def __init__(self, records):
+        super(QueueHandler, self).__init__()
+        self.records = records
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter(threading.Thread):
+    def __init__(self, records, handler, flush_interval=1.0,
+                 batch_size=100):
+        """
+        Daemon thread that writes queued log records.
+
+        Args:
+            records (Queue): queue of log records, None stops the thread
+            handler (Handler): handler that formats and writes the records
+            flush_interval (float): longest time in seconds a written record
+                waits to be flushed
+            batch_size (int): most records written per batch
+        """
+        super(LogWriter, self).__init__(name='LogWriter')
+        self.daemon = True
+        self.records = records
+        self.handler = handler
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+    def run(self):
+        dirty = False
+        # monotonic, a wall clock step back at boot must not delay flushes
+        interval = int(self.flush_interval * 1e9)
+        flushed = clock_ns()
+        while True:
+            timeout = None
+            if dirty:
+                timeout = max(flushed + interval - clock_ns(), 0) / 1e9
+            try:
+                batch = [self.records.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while batch and batch[-1] is not None and \
+                    len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = bool(batch) and batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                self.write(batch)
+                dirty = True
+
+            if dirty and (stop or clock_ns() - flushed >= interval or
+                          any(r.levelno >= logging.ERROR for r in batch)):
+                self.handler.flush()
+                dirty = False
+                flushed = clock_ns()
+            if stop:
+                return
+
+    def write(self, batch):
+        self.handler.batching = True
+        try:
+            for record in batch:
+                self.handler.handle(record)
+        finally:
+            self.handler.batching = False
+
+    def stop(self, timeout=5):
+        """Write the queued records and stop"""
+        if self.is_alive():
+            try:
+                self.records.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            self.join(timeout)
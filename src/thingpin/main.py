@@ -5,13 +5,22 @@ Usage: thingpin -h
        thingpin [options] run
        thingpin create-config
        thingpin [options] install-service
+       thingpin [options] hub
+       thingpin journal [--summary] FILE
 
 Monitor GPIO pins and update AWS IoT via MQTT.
 
 Arguments:
-    run              run the thingpin monitor
+    run              run the thingpin monitor. On SIGHUP the things in the
+                     config file are reloaded without a restart
     create-config    generate sample YAML thingpin-config.yml and exit
     install-service  install daemon to run automatically on boot
+    hub              receive thing states from thingpin nodes that use the
+                     hub notifier and publish them with the configured
+                     notifiers, see the hub config
+    journal          print the edges recorded in journal FILE, one
+                     "seconds pin level" line per edge, which can be
+                     replayed with the replay gpio backend
 
 Options:
     -h --help               show usage and exit
@@ -20,34 +29,42 @@ Options:
     -l --log=LOG            log file to use. By default /var/log/thingpin.log
                             is used when running as a daemon and standard
                             out is used otherwise.
+    -m --metrics=ADDR       serve Prometheus metrics over HTTP on ADDR,
+                            host:port or the path of a Unix socket
+    -s --summary            print per pin edge statistics instead of edges
+    -w --watch              reload the things in the config file when it
+                            changes
 """
 
 import os
 import sys
 import time
-import yaml
 import docopt
 import shutil
-import pkg_resources
+import logging
 import traceback
+import threading
 import signal
 
 
 from .logger import Logger
-from .notifiers import create_notifier
+from .notifiers import create_notifiers
+from .gpio import create_gpio
+from .thingpin import Thingpin, expand_things
+from .metrics import Registry, serve_metrics, thread_metrics
+from .journal import Journal, read_journal, summarize
+from .totals import Totals
 
-try:
-    from .thingpin import Thingpin
-except ImportError:
-    Thingpin = None
+# installed next to the package, see package_data in setup.py
+SAMPLE_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'thingpin-config.yml.sample')
 
 
 def main():
     args = docopt.docopt(__doc__)
 
     if args['create-config']:
-        sample = pkg_resources.resource_filename('thingpin',
-                                                 'thingpin-config.yml.sample')
+        sample = SAMPLE_CONFIG
         config_file = 'thingpin-config.yml'
         if os.path.exists(config_file):
             print('config file {} already exists, not overwriting'.format(
@@ -58,33 +75,73 @@ def main():
             print('created config file: {}'.format(config_file))
             return
 
+    if args['journal']:
+        return print_journal(args['FILE'], args['--summary'])
+
     config_file = os.path.expanduser(args['--config'])
-    with open(config_file) as f:
-        config = yaml.load(f)
+    config = load_config(config_file)
 
     if args['install-service']:
         print('** coming soon - watch this space **')
         return
 
-    log = get_logger(args)
+    log = get_logger(args, config.get('logging'))
+
+    if args['hub']:
+        return run_hub(config, args, log)
 
-    if Thingpin is None:
-        log.error('must run on Raspberry Pi')
+    try:
+        gpio = create_gpio(config.get('gpio'))
+    except ImportError:
+        log.error('must run on Raspberry Pi, or configure a simulated gpio '
+                  'backend')
         return 1
 
-    # TODO: support more than one
-    notifier_config = config['notifiers'].items()[0]
-    notifier = create_notifier(notifier_config[0], notifier_config[1])
+    notifier = create_notifiers(config['notifiers'])
+    journal = None
+    if config.get('journal'):
+        journal = Journal(**config['journal'])
+    totals = None
+    if config.get('counters'):
+        totals = Totals(**config['counters'])
     service = Thingpin(notifier,
                        pin_mode=config['pin_mode'],
-                       things=config['things'],
+                       things=expand_things(config['things'],
+                                            config.get('profiles')),
+                       scanner=config.get('scanner'),
+                       gpio=gpio,
+                       journal=journal,
+                       heartbeat=config.get('heartbeat'),
+                       totals=totals,
                        debug=config.get('debug', False))
 
+    if args.get('--metrics'):
+        registry = Registry()
+        registry.register(service.metrics)
+        registry.register(thread_metrics)
+        serve_metrics(registry, args['--metrics'])
+
+    # a reload can take seconds to stop pins, so signal handlers and the
+    # config watcher only request one
+    reload = start_reloader(
+        lambda: reload_config(config_file, config, service, log))
+
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda *args: reload())
+    if args.get('--watch'):
+        watch_file(config_file, reload)
+
     pidfile = args.get('--pidfile')
     if pidfile is not None:
         with open(os.path.expanduser(pidfile), "w") as f:
             f.write(str(os.getpid()))
 
+    if config.get('runtime') == 'asyncio':
+        # Python 3 only, so only imported when configured
+        from .aio import run as run_async
+        run_async(service, reload=reload)
+        return
+
     try:
         service.run()
     except KeyboardInterrupt:
@@ -93,11 +150,146 @@ def main():
         return
 
 
-def get_logger(args):
+def run_hub(config, args, log):
+    """Run as a hub until Ctrl-C, see `thingpin.hub.Hub`"""
+    from .hub import Hub, serve_hub, DEFAULT_PORT
+
+    hub_config = config.get('hub') or {}
+    notifier = create_notifiers(config['notifiers'])
+    notifier.initialize({})
+    hub = Hub(notifier)
+    servers = serve_hub(hub, hub_config.get(
+        'listen', '0.0.0.0:{}'.format(DEFAULT_PORT)),
+        hub_config.get('transports', ['tcp', 'udp']))
+
+    if args.get('--metrics'):
+        registry = Registry()
+        registry.register(hub.metrics)
+        registry.register(thread_metrics)
+        serve_metrics(registry, args['--metrics'])
+
+    pidfile = args.get('--pidfile')
+    if pidfile is not None:
+        with open(os.path.expanduser(pidfile), "w") as f:
+            f.write(str(os.getpid()))
+
+    try:
+        while True:
+            time.sleep(1000)
+    except KeyboardInterrupt:
+        log.info('exiting on Ctrl-C...')
+        for server in servers:
+            server.shutdown()
+        log.info('hub stats: {}'.format(hub.stats))
+        notifier.cleanup()
+
+
+def load_config(config_file):
+    # yaml takes a while to import, only pay for it when reading config
+    import yaml
+    with open(config_file) as f:
+        return yaml.safe_load(f)
+
+
+def reload_config(config_file, config, service, log):
+    """
+    Reload the things of a running service from its config file.
+
+    Other config sections, except the `profiles` things use, are only read
+    at startup, changes to them are logged.
+    """
+    log.info('reloading {}'.format(config_file))
+    try:
+        new_config = load_config(config_file)
+        things = expand_things(new_config['things'],
+                               new_config.get('profiles'))
+    except Exception:
+        log.exception('reload failed, keeping the running config')
+        return
+
+    for key in sorted(set(config) | set(new_config)):
+        if key not in ('things', 'profiles') and \
+                config.get(key) != new_config.get(key):
+            log.info('reload: restart to apply the changed {} config'.format(
+                key))
+    service.reload(things)
+
+
+def start_reloader(reload):
+    """
+    Run `reload()` on a daemon thread, one call at a time.
+
+    Returns a function that requests a reload and returns at once, so it
+    is safe to call from a signal handler. Requests made while a reload
+    runs are served by one more reload after it.
+    """
+    requested = threading.Event()
+
+    def run():
+        while True:
+            requested.wait()
+            requested.clear()
+            try:
+                reload()
+            except Exception:
+                logging.getLogger('thingpin').exception('reload failed')
+
+    thread = threading.Thread(target=run, name='Reloader')
+    thread.daemon = True
+    thread.start()
+    return requested.set
+
+
+def watch_file(path, callback, interval=1.0):
+    """Call `callback()` from a daemon thread each time `path` changes"""
+    def stat():
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def watch():
+        last = stat()
+        while True:
+            time.sleep(interval)
+            current = stat()
+            if current != last and current is not None:
+                callback()
+            last = current
+
+    thread = threading.Thread(target=watch, name='ConfigWatcher')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def print_journal(path, summary=False):
+    edges = read_journal(path)
+    if summary:
+        print('pin  edges  bounces  min gap (s)  median gap (s)  '
+              'first (s)  last (s)')
+        row = '{:3d}  {:5d}  {:7d}  {:>11}  {:>14}  {:9.3f}  {:8.3f}'
+        for pin, s in summarize(edges).items():
+            print(row.format(pin, s['edges'], s['bounces'],
+                             format_gap(s['min_gap']),
+                             format_gap(s['median_gap']), s['first'],
+                             s['last']))
+        return
+    for edge in edges:
+        print('{:.9f} {} {}'.format((edge.ns - edges[0].ns) / 1e9, edge.pin,
+                                    edge.level))
+
+
+def format_gap(gap):
+    return '-' if gap is None else '{:.6f}'.format(gap)
+
+
+def get_logger(args, config=None):
     log_file = args.get('--log')
     if log_file is None and args.get('--pidfile'):
         log_file = '/var/log/thingpin.log'
-    return Logger(log_file=log_file)
+    return Logger(log_file=log_file, **(config or {}))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+import os
+import bisect
+import logging
+import threading
+import collections
+
+# Each metric has samples of (name suffix, labels, value)
+Metric = collections.namedtuple('Metric', 'name type help samples')
+
+# seconds
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5,
+                   10)
+
+
+class Histogram(object):
+    """
+    Histogram with fixed buckets.
+
+    `observe()` takes no lock: each Histogram must only be updated by a
+    single thread. Readers may see a sample that is a moment out of date.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def metric(self, name, help, labels=None):
+        """Metric with the cumulative Prometheus histogram samples"""
+        labels = labels or {}
+        samples = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            le = '+Inf' if bound == float('inf') else repr(float(bound))
+            samples.append(('_bucket', dict(labels, le=le), total))
+        samples.append(('_sum', labels, self.sum))
+        samples.append(('_count', labels, total))
+        return Metric(name, 'histogram', help, samples)
+
+
+class Registry(object):
+    """
+    Collects metrics when they are scraped.
+
+    Instrumented code keeps plain counters on its own objects, each written
+    by one thread. Collectors registered here read them only on scrape, so
+    the sampling loop pays for an integer increment and nothing else.
+    """
+
+    def __init__(self):
+        self.collectors = []
+
+    def register(self, collector):
+        """
+        Add a collector.
+
+        Args:
+            collector (callable): returns an iterable of Metric
+        """
+        self.collectors.append(collector)
+
+    def collect(self):
+        """
+        Read all metrics.
+
+        Returns:
+            list of Metric: metrics with the same name, like those of
+                several notifiers, merged into one
+        """
+        merged = collections.OrderedDict()
+        for collector in self.collectors:
+            for metric in collector():
+                if metric.name in merged:
+                    merged[metric.name].samples.extend(metric.samples)
+                else:
+                    merged[metric.name] = metric._replace(
+                        samples=list(metric.samples))
+        return list(merged.values())
+
+    def exposition(self):
+        """All metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.collect():
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            for suffix, labels, value in metric.samples:
+                lines.append('{}{}{} {}'.format(
+                    metric.name, suffix, format_labels(labels),
+                    format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for k, v in sorted(labels.items())) + '}'
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def thread_metrics():
+    return [Metric('thingpin_threads', 'gauge', 'Number of threads',
+                   [('', {}, threading.active_count())])]
+
+
+def serve_metrics(registry, address):
+    """
+    Serve metrics over HTTP from a daemon thread.
+
+    Args:
+        registry (Registry): metrics to serve
+        address (str): `host:port` for TCP, or the path of a Unix socket
+
+    Returns:
+        server: the running server, `shutdown()` stops it
+    """
+    # the HTTP server modules are slow to import, only load them when used
+    try:
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from socketserver import ThreadingMixIn, UnixStreamServer
+    except ImportError:
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        from SocketServer import ThreadingMixIn, UnixStreamServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.getLogger('thingpin').debug('metrics: ' + format, *args)
+
+    if ':' in address:
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        host, port = address.rsplit(':', 1)
+        server = Server((host, int(port)), MetricsHandler)
+    else:
+        class Server(ThreadingMixIn, UnixStreamServer):
+            daemon_threads = True
+
+            def get_request(self):
+                # HTTP handlers expect a (host, port) client address
+                request, _ = UnixStreamServer.get_request(self)
+                return request, ('unix', 0)
+
+        if os.path.exists(address):
+            os.remove(address)
+        server = Server(address, MetricsHandler)
+
+    thread = threading.Thread(target=server.serve_forever,
+                              name='MetricsServer')
+    thread.daemon = True
+    thread.start()
+    logging.getLogger('thingpin').info('serving metrics on {}'.format(
+        address))
+    return server
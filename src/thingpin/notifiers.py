@@ -1,112 +1,733 @@
-import os
 import sys
+import json
+import types
 import logging
-from thingamon import Client, Thing
-from Adafruit_IO import MQTTClient
+import importlib
+import threading
+import collections
+from .outbox import Outbox
+from .statecache import StateCache
+from .pin import clock
+from .metrics import Metric, Histogram
+
+# notifier name: (module, class). Modules are imported when a notifier is
+# created, so only the MQTT libraries of configured notifiers are loaded.
+NOTIFIERS = {
+    'adafruit': ('thingpin.adafruit', 'AdafruitNotifier'),
+    'aws': ('thingpin.aws', 'AWSIoTNotifier'),
+    'hub': ('thingpin.hub', 'HubNotifier'),
+}
+
+
+def register_notifier(name, module, class_name):
+    """
+    Make a notifier available by name in the `notifiers` config.
+
+    Args:
+        name (str): notifier name used in the config
+        module (str): module of the notifier class, imported when a
+            notifier with this name is first created
+        class_name (str): Notifier subclass, created with the notifier
+            config as keyword arguments
+    """
+    NOTIFIERS[name] = (module, class_name)
+
+
+def notifier_class(name):
+    """Import and return the class of a registered notifier"""
+    try:
+        module, class_name = NOTIFIERS[name]
+    except KeyError:
+        raise ValueError('unknown notifier {}'.format(name))
+    return getattr(importlib.import_module(module), class_name)
+
+
+def __getattr__(name):
+    # notifier classes used to be defined here, see NotifiersModule
+    for module, class_name in NOTIFIERS.values():
+        if class_name == name:
+            return getattr(importlib.import_module(module), class_name)
+    raise AttributeError(name)
 
 
 def create_notifier(name, config):
-    if name == 'adafruit':
-        return AdafruitNotifier(**config)
-    elif name == 'aws':
-        return AWSIoTNotifier(**config)
+    """
+    Create a notifier from its config.
+
+    Unless the config has `queue: false` the notifier is wrapped in a
+    QueuedNotifier so that publishing never blocks pin sampling. The
+    optional `queue` config dict is passed to QueuedNotifier. The optional
+    `batch` config dict sets the QueuedNotifier batching window with keys
+    `max_latency` and `max_size`. The optional `outbox` config dict
+    creates an Outbox for the QueuedNotifier, its `retry_min` and
+    `retry_max` keys set the replay backoff. The optional `dedup` config
+    dict creates a StateCache for the QueuedNotifier.
+    """
+    config = dict(config)
+    queue = config.pop('queue', None)
+    batch = config.pop('batch', None)
+    outbox = config.pop('outbox', None)
+    dedup = config.pop('dedup', None)
+
+    if outbox is not None and name == 'adafruit':
+        config.setdefault('exit_on_disconnect', False)
+
+    notifier = notifier_class(name)(**config)
+
+    if queue is False:
+        if batch is not None or outbox is not None or dedup is not None:
+            raise ValueError('{} batch, outbox and dedup require a '
+                             'queue'.format(name))
+        return notifier
+
+    queue = dict(queue or {})
+    if batch is not None:
+        queue['batch_latency'] = batch.get('max_latency', 1.0)
+        queue['batch_size'] = batch.get('max_size', 50)
+    if outbox is not None:
+        outbox = dict(outbox)
+        for key in ['retry_min', 'retry_max']:
+            if key in outbox:
+                queue[key] = outbox.pop(key)
+        queue['outbox'] = Outbox(**outbox)
+    if dedup is not None:
+        queue['dedup'] = StateCache(**dedup)
+    return QueuedNotifier(notifier, **queue)
+
+
+def create_notifiers(config):
+    """
+    Create the notifier for the `notifiers` config section.
+
+    Args:
+        config (dict of str: dict): each key is a notifier name and each
+            value is the config for that notifier
+
+    Returns:
+        Notifier: the notifier when only one is configured, else a
+            FanoutNotifier that publishes to all of them
+    """
+    notifiers = [create_notifier(name, config[name])
+                 for name in sorted(config)]
+    if len(notifiers) == 1:
+        return notifiers[0]
+    for name in sorted(config):
+        if config[name].get('queue') is False:
+            logging.getLogger('thingpin').warning(
+                '{}: queue: false is ignored with more than one notifier, '
+                'each publishes from its own queue'.format(name))
+    return FanoutNotifier(notifiers)
 
 
 class Notifier(object):
-        pass
+    """
+    Publishes thing states.
+
+    Subclasses implement:
+        - `initialize(things=None)`: connect. `things` is the thing config
+          dict (name: config) so that notifiers can prepare per thing work.
+        - `notify(name, value, payload=None)`: publish state `value` of
+          thing `name`. `payload` is the result of `encode(value)` if the
+          caller has it already, which saves encoding on every publish.
+        - `cleanup()`: disconnect
+
+    `encode(value)` returns the message to publish for a state. The default
+    is the state as JSON, notifiers override it to match what they send.
+
+    `notify_batch(items)` publishes a batch of changes. The default calls
+    `notify()` for each, notifiers override it to publish one message.
 
+    `notify_snapshot(name, snapshot)` publishes a snapshot of all things as
+    one message. The default publishes it like the state of thing `name`.
 
-class AWSIoTNotifier(Notifier):
-    def __init__(self, host=None, client_cert=None, private_key=None,
-                 aws_iot_message_unit_cost=5e-6, estimated_change_freq=0.0,
-                 debug=False):
+    `connected` tells whether the notifier can publish right now.
+
+    `metrics()` returns the notifier metrics, labeled with its `name`.
+    Notifiers count lost connections in `disconnects`.
+
+    Notifiers that can read back the state the broker has for each thing
+    call `on_reported(name, value)` with it after connecting, if it is set.
+    """
+    name = 'notifier'
+    disconnects = 0
+    on_reported = None
+
+    @property
+    def connected(self):
+        """Whether the notifier can publish right now"""
+        return True
+
+    def encode(self, value):
+        """Encode a state to the message bytes to publish"""
+        return json.dumps(value).encode('utf-8')
+
+    def notify_batch(self, items):
         """
-        Create an AWS IoT MQTT notifier
+        Publish several changes.
 
         Args:
-            host (str): host name of AWS IoT endpoint
-            client_cert (str): name of client certificate file
-            private_key (str): name of private key for client certificate
-            aws_iot_message_unit_cost (float): cost of an AWS IoT message
-                used to estimate monthly cost of operating this thingpin
-            estimated_change_freq (float): estimate of how often each
-                pin will change. Only used for guessing AWS costs at startup.
-            debug (bool): if True log all MQTT traffic.
+            items (list of tuple): (name, value, payload) of each change,
+                at most one per thing
         """
-        self.log = logging.getLogger('thingpin')
+        for name, value, payload in items:
+            self.notify(name, value, payload)
 
-        self.host = host
-        self.client_cert = os.path.expanduser(client_cert)
-        self.private_key = os.path.expanduser(private_key)
-        self.debug = debug
-        self.client = None
-
-        self.log.info('AWS monthly cost guesstimate ${:,.8f}'.format(
-            estimated_change_freq *
-            60 * 60 * 24 * 30 *
-            aws_iot_message_unit_cost
-        ))
-        self.log.info('(don''t take the guesstimate too seriously!)')
-
-    def initialize(self):
-        # MQTT client
-        self.client = Client(self.host,
-                             client_cert_filename=self.client_cert,
-                             private_key_filename=self.private_key,
-                             log_mqtt=self.debug)
-        self.client.connect()
-        self.log.info('connected to AWS IoT')
+    def notify_snapshot(self, name, snapshot):
+        """
+        Publish a snapshot of all things as one message.
 
-    def cleanup(self):
-        self.client.disconnect()
+        Args:
+            name (str): thing or feed to publish to
+            snapshot (dict): see `Thingpin.snapshot()`
+        """
+        self.notify(name, snapshot)
 
-    def notify(self, name, value):
-        self.log.info('AWS IoT: publish({}={})'.format(name, value))
-        Thing(name, self.client).publish_state(value)
+    def metrics(self):
+        """
+        Metrics of the notifier, read without blocking it.
+
+        Returns:
+            list of Metric
+        """
+        return [Metric('thingpin_notifier_disconnects_total', 'counter',
+                       'Connections to the broker lost',
+                       [('', {'notifier': self.name}, self.disconnects)])]
 
 
-class AdafruitNotifier(Notifier):
-    # TODO: consider supporting this directly in thingamon and not using
-    # the adafruit package. both have the same paho mqtt connection logic.
-    # adafruit does not lock the connected state variable, thingamon does
-    # not sure which is right yet
-    def __init__(self, username=None, api_key=None, host='io.adafruit.com',
-                 port=1883):
+class QueuedNotifier(Notifier):
+    OVERFLOW_POLICIES = ('drop_oldest', 'coalesce')
+
+    def __init__(self, notifier, size=100, overflow='drop_oldest',
+                 batch_size=1, batch_latency=0, outbox=None, retry_min=1,
+                 retry_max=60, dedup=None):
         """
-        Create an Adafruit MQTT notifier
+        Publish through another notifier from a background sender thread.
+
+        `notify()` only adds the message to a bounded queue and returns
+        right away, so a slow network never delays pin sampling. A single
+        sender thread publishes queued messages in order.
+
+        With a `batch_size` over 1 the sender collects messages for up to
+        `batch_latency` seconds after the first one arrives, or until
+        `batch_size` messages are queued, and publishes them with a single
+        `notifier.notify_batch()` call. Only the latest value of each thing
+        in a batch is published.
+
+        With an `outbox` messages that cannot be published, because the
+        notifier is not connected or publishing fails, are saved to the
+        outbox instead, and so are new messages while the outbox is not
+        empty. The sender replays the outbox in order once the notifier is
+        connected, retrying with exponential backoff from `retry_min` to
+        `retry_max` seconds.
+
+        With `dedup` a message is not published when its value is the last
+        value published for the thing, as recorded in the StateCache. The
+        cache is also updated with states the notifier reports from the
+        broker, see `Notifier.on_reported`. The sender saves the cache at
+        most once per `StateCache.save_interval`, and at cleanup.
+
+        The sender is a thread started by `initialize()`. With `threaded`
+        set to False before that, an event loop calls `send_pending()` from
+        an executor instead, when `on_pending()` is called or after
+        `idle_timeout()`, once `initialize()` returned, see `thingpin.aio`.
+
+        Snapshots are published by the sender too, as their own message
+        between changes. Only the latest snapshot waits to be sent, and
+        snapshots are neither batched, saved to the outbox nor deduped: the
+        next one supersedes a snapshot that could not be published.
+
+        Counters are kept in `stats`:
+            - enqueued: messages passed to `notify()`
+            - sent: messages published by the wrapped notifier
+            - dropped: messages discarded because the queue was full, and
+              snapshots not published while offline with an outbox
+            - coalesced: messages replaced by a newer value for the same
+              thing before they were sent
+            - failed: messages the wrapped notifier raised an error for
+            - batches: batches published
+            - spooled: messages saved to the outbox
+            - deduped: messages not published because the thing already
+              had that value
+            - snapshots: snapshots published
+            - snapshots_replaced: snapshots replaced by a newer one before
+              they were sent
 
         Args:
-            host (str): host name of Adafruit MQTT broker
-            port (int): port of Adafruit MQTT broker
-            username (str): Adafruit IO username
-            api_key (str): Adafruit IO API key
+            notifier (Notifier): notifier to publish with
+            size (int): maximum number of queued messages
+            overflow (str): what to do with a new message:
+                - `drop_oldest`: when the queue is full discard the oldest
+                  queued message
+                - `coalesce`: if a message for the same thing is already
+                  queued replace it with the new one at the back of the
+                  queue, otherwise behave like `drop_oldest`
+            batch_size (int): most messages to publish as one batch
+            batch_latency (float): longest time in seconds a message waits
+                for a batch to fill
+            outbox (Outbox): durable store for messages that could not be
+                published
+            retry_min (float): first outbox replay retry delay in seconds
+            retry_max (float): longest outbox replay retry delay in seconds
+            dedup (StateCache): last published state of each thing
         """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError('invalid overflow policy {}'.format(overflow))
+        if size < 1:
+            raise ValueError('invalid queue size {}'.format(size))
+        if batch_size < 1 or batch_size > size:
+            raise ValueError('invalid batch size {}'.format(batch_size))
+
         self.log = logging.getLogger('thingpin')
-        self.username = username
-        self.api_key = api_key
-        self.host = host
-        self.port = port
-        self.client = None
+        self.notifier = notifier
+        self.size = size
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
+        self.condition = threading.Condition()
+        if overflow == 'coalesce':
+            self.pending = collections.OrderedDict()
+        else:
+            self.pending = collections.deque()
+        self.counters = dict.fromkeys(
+            ['enqueued', 'sent', 'dropped', 'coalesced', 'failed', 'batches',
+             'spooled', 'deduped', 'snapshots', 'snapshots_replaced'], 0)
+        self.running = False
+        self.sender = None
+        # latest (name, snapshot) waiting to be published
+        self.snapshot = None
+        self.threaded = True
+        # called without the lock after a message is queued
+        self.on_pending = None
+        # only updated by the sender thread
+        self.latency = Histogram()
+
+        self.outbox = outbox
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.retry_delay = retry_min
+        self.retry_at = 0
+
+        self.dedup = dedup
+        if dedup is not None:
+            notifier.on_reported = dedup.reported
+
+    @property
+    def stats(self):
+        """Snapshot of the queue counters"""
+        with self.condition:
+            return dict(self.counters)
+
+    @property
+    def depth(self):
+        """Number of messages waiting to be sent"""
+        with self.condition:
+            return len(self.pending)
+
+    @property
+    def name(self):
+        return self.notifier.name
+
+    def metrics(self):
+        labels = {'notifier': self.name}
+        stats = self.stats
+        metrics = [
+            Metric('thingpin_notifier_queue_depth', 'gauge',
+                   'Messages waiting to be published',
+                   [('', labels, self.depth)]),
+            Metric('thingpin_notifier_messages_total', 'counter',
+                   'Messages by what happened to them',
+                   [('', dict(labels, result=k), v)
+                    for k, v in sorted(stats.items()) if k != 'batches']),
+            self.latency.metric('thingpin_notifier_publish_seconds',
+                                'Time to publish a message or batch',
+                                labels),
+        ]
+        if self.outbox is not None:
+            metrics.append(Metric('thingpin_outbox_records', 'gauge',
+                                  'Changes waiting in the outbox',
+                                  [('', labels, len(self.outbox))]))
+        return metrics + self.notifier.metrics()
+
+    def initialize(self, things=None):
+        self.notifier.initialize(things)
+        self.running = True
+        if self.threaded:
+            self.sender = threading.Thread(target=self.send_loop,
+                                           name='NotifierSender')
+            self.sender.daemon = True
+            self.sender.start()
+        elif self.on_pending is not None:
+            # publish what was queued while connecting
+            self.on_pending()
+
+    def cleanup(self, timeout=5):
+        """Send what is queued (waiting at most `timeout` seconds) and stop"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.sender is not None:
+            self.sender.join(timeout)
+        elif not self.threaded:
+            while self.send_once():
+                pass
+        if self.dedup is not None and self.dedup.dirty:
+            self._save_dedup()
+        self.log.info('notifier queue stats: {}'.format(self.stats))
+        if self.outbox is not None:
+            self.log.info('outbox stats: {}'.format(self.outbox.stats))
+            self.outbox.close()
+        self.notifier.cleanup()
+
+    def encode(self, value):
+        return self.notifier.encode(value)
 
-    def initialize(self):
-        self.client = MQTTClient(self.username, self.api_key,
-                                 service_host=self.host,
-                                 service_port=self.port)
+    def notify(self, name, value, payload=None):
+        with self.condition:
+            self.counters['enqueued'] += 1
+            if self.overflow == 'coalesce' and name in self.pending:
+                # the newest value goes to the back, so that overflow
+                # evicts older messages first
+                del self.pending[name]
+                self.pending[name] = (value, payload)
+                self.counters['coalesced'] += 1
+                return
 
-        def on_disconnect(client):
-            if client.disconnect_reason != 0:
-                self.log.info('client disconnected, exiting')
-                os._exit(1)
+            if len(self.pending) >= self.size:
+                self._pop()
+                self.counters['dropped'] += 1
+            if self.overflow == 'coalesce':
+                self.pending[name] = (value, payload)
+            else:
+                self.pending.append((name, (value, payload)))
+            self.condition.notify()
+        if self.on_pending is not None:
+            self.on_pending()
 
-        self.client.on_disconnect = on_disconnect
+    def notify_snapshot(self, name, snapshot):
+        with self.condition:
+            if self.snapshot is not None:
+                self.counters['snapshots_replaced'] += 1
+            self.snapshot = (name, snapshot)
+            self.condition.notify()
+        if self.on_pending is not None:
+            self.on_pending()
 
-        self.client.connect()
-        self.log.info('connected to Adafruit')
-        self.client.loop_background()
+    def _pop(self):
+        if self.overflow == 'coalesce':
+            return self.pending.popitem(last=False)
+        return self.pending.popleft()
+
+    def send_loop(self):
+        """Publish queued messages until stopped and the queue is empty"""
+        while self.send_once(wait=True):
+            pass
+
+    def send_pending(self):
+        """Publish everything queued and service the outbox, not waiting"""
+        while self.send_once() and (self.depth or self.snapshot is not None):
+            pass
+
+    def send_once(self, wait=False):
+        """
+        Publish the next message, batch or snapshot.
+
+        Args:
+            wait (bool): wait for a message while running, or until the
+                outbox or the state cache needs servicing
+
+        Returns:
+            bool: False once stopped and nothing is left to publish
+        """
+        with self.condition:
+            while wait and self.running and not self.pending and \
+                    self.snapshot is None:
+                timeout = self.idle_timeout()
+                if timeout == 0:
+                    break
+                self.condition.wait(timeout)
+            if not self.running and not self.pending and \
+                    self.snapshot is None:
+                return False
+            snapshot, self.snapshot = self.snapshot, None
+            if not self.pending:
+                items = None
+            elif self.batch_size > 1:
+                items = [(name, value, payload) for name, (value, payload)
+                         in self._take_batch().items()]
+            else:
+                name, (value, payload) = self._pop()
+                items = [(name, value, payload)]
+
+        if self.outbox is not None:
+            self._service_outbox()
+        if items:
+            self._send(items)
+        if snapshot is not None:
+            self._send_snapshot(*snapshot)
+        if self.dedup is not None and self.dedup.save_due():
+            self._save_dedup()
+        return True
+
+    def _take_batch(self):
+        """Wait for the batch window and take the batch, holding the lock"""
+        deadline = clock() + self.batch_latency
+        while self.running and len(self.pending) < self.batch_size:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                break
+            self.condition.wait(remaining)
+
+        batch = collections.OrderedDict()
+        while self.pending and len(batch) < self.batch_size:
+            name, item = self._pop()
+            if name in batch:
+                self.counters['coalesced'] += 1
+            batch[name] = item
+        return batch
+
+    def _send(self, items):
+        """Publish items, spooling them to the outbox if that fails"""
+        if self.outbox is not None and (len(self.outbox) or
+                                        not self.notifier.connected):
+            self._spool(items)
+            return
+
+        if self.dedup is not None:
+            sending = [item for item in items
+                       if not self.dedup.matches(item[0], item[1])]
+            if len(sending) < len(items):
+                with self.condition:
+                    self.counters['deduped'] += len(items) - len(sending)
+            if not sending:
+                return
+            items = sending
+
+        try:
+            start = clock()
+            if self.batch_size > 1:
+                self.notifier.notify_batch(items)
+            else:
+                self.notifier.notify(*items[0])
+            self.latency.observe(clock() - start)
+            counter = 'sent'
+            if self.dedup is not None:
+                self._published(items)
+        except Exception:
+            self.log.exception('publish {} failed'.format(
+                ', '.join('{}={}'.format(n, v) for n, v, _ in items)))
+            if self.outbox is not None:
+                self._spool(items)
+                return
+            counter = 'failed'
+
+        with self.condition:
+            self.counters[counter] += len(items)
+            if self.batch_size > 1:
+                self.counters['batches'] += 1
+
+    def _send_snapshot(self, name, snapshot):
+        if self.outbox is not None and not self.notifier.connected:
+            counter = 'dropped'
+        else:
+            try:
+                start = clock()
+                self.notifier.notify_snapshot(name, snapshot)
+                self.latency.observe(clock() - start)
+                counter = 'snapshots'
+            except Exception:
+                self.log.exception('publish snapshot {} failed'.format(name))
+                counter = 'failed'
+        with self.condition:
+            self.counters[counter] += 1
+
+    def _spool(self, items):
+        for name, value, _ in items:
+            self.outbox.append(name, value)
+        with self.condition:
+            self.counters['spooled'] += len(items)
+
+    def idle_timeout(self):
+        """How long the sender can wait before the outbox or cache need it"""
+        timeouts = []
+        if self.outbox is not None:
+            if len(self.outbox):
+                timeouts.append(max(self.retry_at - clock(), 0))
+            if self.outbox.dirty:
+                timeouts.append(self.outbox.fsync_interval)
+        if self.dedup is not None and self.dedup.dirty:
+            timeouts.append(self.dedup.save_timeout())
+        return min(timeouts) if timeouts else None
+
+    def _service_outbox(self):
+        """Replay the outbox when a retry is due, and fsync it when due"""
+        if len(self.outbox) and clock() >= self.retry_at:
+            if self.notifier.connected:
+                sent = self.outbox.replay(self._replay_send)
+                self.log.info('replayed {} changes from outbox, {} '
+                              'left'.format(sent, len(self.outbox)))
+            if len(self.outbox):
+                self.retry_delay = min(self.retry_delay * 2, self.retry_max)
+            else:
+                self.retry_delay = self.retry_min
+            self.retry_at = clock() + self.retry_delay
+        elif self.outbox.sync_due():
+            self.outbox.sync()
+
+    def _replay_send(self, name, value):
+        self.notifier.notify(name, value)
+        with self.condition:
+            self.counters['sent'] += 1
+        if self.dedup is not None:
+            self._published([(name, value, None)])
+
+    def _published(self, items):
+        for name, value, _ in items:
+            self.dedup.published(name, value)
+
+    def _save_dedup(self):
+        try:
+            self.dedup.save()
+        except (IOError, OSError):
+            self.log.exception('saving state cache failed')
+
+
+class FanoutNotifier(Notifier):
+    def __init__(self, notifiers, connect_timeout=30, retry_min=1,
+                 retry_max=60):
+        """
+        Publish to several notifiers at once.
+
+        Each notifier publishes from its own QueuedNotifier sender thread
+        (notifiers that are not queued are wrapped) so publishing takes as
+        long as the slowest notifier rather than the sum of all of them, and
+        a notifier that is down or slow does not hold up the others.
+
+        Each notifier is initialized from its own thread. When that fails
+        it is retried with exponential backoff from `retry_min` to
+        `retry_max` seconds until it succeeds or `cleanup()` is called.
+        Until then its queue holds the latest messages, dropping the
+        oldest when full.
+
+        Args:
+            notifiers (list of Notifier): notifiers to publish to
+            connect_timeout (float): how long `initialize()` waits in seconds
+                for the notifiers to connect. Notifiers still connecting
+                after that keep trying in the background and queue messages
+                until connected.
+            retry_min (float): first initialize retry delay in seconds
+            retry_max (float): longest initialize retry delay in seconds
+        """
+        self.log = logging.getLogger('thingpin')
+        self.notifiers = [n if isinstance(n, QueuedNotifier)
+                          else QueuedNotifier(n) for n in notifiers]
+        self.connect_timeout = connect_timeout
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.stopping = threading.Event()
+
+    def initialize(self, things=None):
+        def initialize(notifier):
+            name = type(notifier.notifier).__name__
+            delay = self.retry_min
+            while not self.stopping.is_set():
+                try:
+                    notifier.initialize(things)
+                    return
+                except Exception:
+                    self.log.exception('{} initialize failed, retrying in '
+                                       '{} seconds'.format(name, delay))
+                self.stopping.wait(delay)
+                delay = min(delay * 2, self.retry_max)
+
+        threads = []
+        for notifier in self.notifiers:
+            thread = threading.Thread(
+                target=initialize, args=(notifier,),
+                name='{}Connect'.format(type(notifier.notifier).__name__))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join(self.connect_timeout)
+            if thread.is_alive():
+                self.log.info('{} still connecting, continuing'.format(
+                    thread.name))
 
     def cleanup(self):
-        self.client.disconnect()
+        self.stopping.set()
+        for notifier in self.notifiers:
+            if not notifier.running:
+                self.log.error('{} never initialized, dropped {} queued '
+                               'messages'.format(
+                                   type(notifier.notifier).__name__,
+                                   notifier.depth))
+                continue
+            try:
+                notifier.cleanup()
+            except Exception:
+                self.log.exception('{} cleanup failed'.format(
+                    type(notifier.notifier).__name__))
+
+    def encode(self, value):
+        """Encode for each notifier, `notify()` hands each its own payload"""
+        return tuple(n.encode(value) for n in self.notifiers)
+
+    def notify(self, name, value, payload=None):
+        for i, notifier in enumerate(self.notifiers):
+            try:
+                notifier.notify(name, value,
+                                None if payload is None else payload[i])
+            except Exception:
+                self.log.exception('{} publish({}={}) failed'.format(
+                    type(notifier.notifier).__name__, name, value))
+
+    def notify_snapshot(self, name, snapshot):
+        for notifier in self.notifiers:
+            notifier.notify_snapshot(name, snapshot)
+
+    def metrics(self):
+        metrics = []
+        for notifier in self.notifiers:
+            metrics.extend(notifier.metrics())
+        return metrics
+
+
+class NotifiersModule(types.ModuleType):
+    def __init__(self, module):
+        """
+        This module, also giving the notifier classes that used to be
+        defined here.
+
+        Module `__getattr__()` (PEP 562) needs Python 3.7, so on older
+        versions the module is replaced by this wrapper in `sys.modules`.
+        Attributes are read from and set on the wrapped module, so its
+        functions see patched globals. Names it does not have are passed
+        to its `__getattr__()`.
+
+        Args:
+            module (module): the module to wrap
+        """
+        super(NotifiersModule, self).__init__(module.__name__,
+                                              module.__doc__)
+        object.__setattr__(self, '_module', module)
+
+    def __getattribute__(self, name):
+        module = object.__getattribute__(self, '_module')
+        try:
+            return getattr(module, name)
+        except AttributeError:
+            return module.__getattr__(name)
+
+    def __setattr__(self, name, value):
+        setattr(object.__getattribute__(self, '_module'), name, value)
+
+    def __delattr__(self, name):
+        delattr(object.__getattribute__(self, '_module'), name)
+
+    def __dir__(self):
+        return dir(object.__getattribute__(self, '_module'))
+
 
-    def notify(self, name, value):
-        self.log.info('Adafruit IO: publish({}={})'.format(name, value))
-        self.client.publish(name, value['state'])
+if sys.version_info < (3, 7):
+    sys.modules[__name__] = NotifiersModule(sys.modules[__name__])
@@ -0,0 +1,294 @@
+import os
+import json
+import struct
+import logging
+import threading
+import collections
+from .pin import clock
+
+HEADER = struct.Struct('<I')
+SEGMENT_PREFIX = 'outbox-'
+SEGMENT_SUFFIX = '.seg'
+# a rewritten segment replaces all segments numbered below it
+BASE_SUFFIX = '.base'
+
+
+class Outbox(object):
+    """
+    Durable on disk queue of thing changes that could not be published.
+
+    Changes are appended to segment files in a directory. Each record is a
+    little endian uint32 length followed by the JSON `[name, value]` of the
+    change. A record cut short by a crash is ignored when the outbox is
+    opened.
+
+    Replaying and compacting rewrite the outbox as one `.base` segment
+    numbered above all others, which replaces the older segments once it
+    is renamed into place. The older segments are removed after that, and
+    if a crash leaves them behind they are removed when the outbox is
+    opened, so no change is replayed twice.
+
+    Writes are fsynced at most once per `fsync_interval` seconds, and on
+    `sync()`, `replay()` and `close()`. When the outbox grows past
+    `max_bytes` it is compacted to the latest change of each thing, and
+    changes that still do not fit are dropped.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024, segment_bytes=64 * 1024,
+                 fsync_interval=1.0):
+        """
+        Open or create an outbox.
+
+        Args:
+            path (str): directory for the segment files, created if needed
+            max_bytes (int): most disk space to use
+            segment_bytes (int): size at which a new segment file is started
+            fsync_interval (float): longest time in seconds appended changes
+                wait to be fsynced
+        """
+        self.log = logging.getLogger('thingpin')
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(['appended', 'replayed', 'dropped',
+                                       'compactions'], 0)
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self.segments = []
+        self.records = 0
+        self.bytes = 0
+        self._recover()
+        for segment in self._segment_files():
+            count, size = self._scan(segment)
+            self.segments.append(segment)
+            self.records += count
+            self.bytes += size
+
+        self.file = None
+        self.dirty = False
+        self.synced = clock()
+
+    def __len__(self):
+        return self.records
+
+    @property
+    def stats(self):
+        """Snapshot of the outbox counters with its size"""
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update(records=self.records, bytes=self.bytes)
+            return stats
+
+    def append(self, name, value):
+        """Append a change, compacting or dropping to stay in max_bytes"""
+        record = self._encode(name, value)
+        with self.lock:
+            if self.bytes + len(record) > self.max_bytes:
+                self._compact()
+                if self.bytes + len(record) > self.max_bytes:
+                    self.counters['dropped'] += 1
+                    self.log.error('outbox full, dropped {}={}'.format(
+                        name, value))
+                    return
+
+            if (self.file is None or
+                    self.file.tell() + len(record) > self.segment_bytes):
+                self._start_segment()
+            self.file.write(record)
+            self.file.flush()
+            self.records += 1
+            self.bytes += len(record)
+            self.counters['appended'] += 1
+            self.dirty = True
+            if clock() - self.synced >= self.fsync_interval:
+                self._sync()
+
+    def sync(self):
+        """fsync appended changes"""
+        with self.lock:
+            self._sync()
+
+    def sync_due(self):
+        """Whether appended changes have waited fsync_interval for fsync"""
+        return (self.dirty and
+                clock() - self.synced >= self.fsync_interval)
+
+    def replay(self, send):
+        """
+        Send the changes in the outbox in order, oldest first.
+
+        Sending stops at the first change `send` raises an error for. The
+        changes sent are removed from the outbox and the rest are kept.
+
+        Args:
+            send (callable): called as `send(name, value)` for each change
+
+        Returns:
+            int: number of changes sent
+        """
+        with self.lock:
+            self._sync()
+            records = self._read_all()
+            sent = 0
+            try:
+                for name, value in records:
+                    send(name, value)
+                    sent += 1
+            except Exception:
+                self.log.exception('outbox replay stopped after {} of '
+                                   '{}'.format(sent, len(records)))
+            self.counters['replayed'] += sent
+            if sent:
+                self._rewrite(records[sent:])
+            return sent
+
+    def compact(self):
+        """Keep only the latest change of each thing"""
+        with self.lock:
+            self._compact()
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _compact(self):
+        latest = collections.OrderedDict()
+        for name, value in self._read_all():
+            latest.pop(name, None)
+            latest[name] = value
+        self._rewrite(list(latest.items()))
+        self.counters['compactions'] += 1
+        self.log.info('outbox compacted to {} changes'.format(self.records))
+
+    def _sync(self):
+        if self.dirty and self.file is not None:
+            os.fsync(self.file.fileno())
+        self.dirty = False
+        self.synced = clock()
+
+    def _encode(self, name, value):
+        data = json.dumps([name, value]).encode('utf-8')
+        return HEADER.pack(len(data)) + data
+
+    def _segment_files(self):
+        names = [n for n in os.listdir(self.path)
+                 if n.startswith(SEGMENT_PREFIX) and
+                 n.endswith((SEGMENT_SUFFIX, BASE_SUFFIX))]
+        return [os.path.join(self.path, n)
+                for n in sorted(names, key=self._number)]
+
+    def _recover(self):
+        """Remove what a crash during `_rewrite()` left behind"""
+        for name in os.listdir(self.path):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith('.tmp'):
+                os.remove(os.path.join(self.path, name))
+        segments = self._segment_files()
+        bases = [i for i, s in enumerate(segments)
+                 if s.endswith(BASE_SUFFIX)]
+        if bases:
+            superseded = segments[:bases[-1]]
+            if superseded:
+                self.log.info('outbox: removing {} segments replaced by '
+                              'a rewrite'.format(len(superseded)))
+            for segment in superseded:
+                os.remove(segment)
+
+    @staticmethod
+    def _number(path):
+        name = os.path.basename(path)
+        return int(name[len(SEGMENT_PREFIX):].split('.')[0])
+
+    def _segment_path(self, number, suffix=SEGMENT_SUFFIX):
+        return os.path.join(self.path, '{}{:08d}{}'.format(
+            SEGMENT_PREFIX, number, suffix))
+
+    def _next_number(self):
+        if self.segments:
+            return self._number(self.segments[-1]) + 1
+        return 0
+
+    def _sync_directory(self):
+        """fsync the directory, making renames and removals durable"""
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _start_segment(self):
+        self._sync()
+        if self.file is not None:
+            self.file.close()
+        segment = self._segment_path(self._next_number())
+        self.file = open(segment, 'ab')
+        self.segments.append(segment)
+
+    def _read(self, segment):
+        """Records in a segment, and the size of its complete records"""
+        records = []
+        with open(segment, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            size, = HEADER.unpack_from(data, offset)
+            end = offset + HEADER.size + size
+            if end > len(data):
+                break
+            try:
+                name, value = json.loads(
+                    data[offset + HEADER.size:end].decode('utf-8'))
+            except ValueError:
+                break
+            records.append((name, value))
+            offset = end
+        return records, offset
+
+    def _scan(self, segment):
+        """Count records of a segment, truncating a partial last record"""
+        records, size = self._read(segment)
+        if size < os.path.getsize(segment):
+            self.log.info('outbox: truncating partial record in {}'.format(
+                segment))
+            with open(segment, 'r+b') as f:
+                f.truncate(size)
+        return len(records), size
+
+    def _read_all(self):
+        records = []
+        for segment in self.segments:
+            records.extend(self._read(segment)[0])
+        return records
+
+    def _rewrite(self, records):
+        """Replace all segments with a base segment holding `records`"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        old = self.segments
+        segment = self._segment_path(self._next_number(), BASE_SUFFIX)
+        # written even when empty, it marks the old segments as replaced
+        tmp = segment + '.tmp'
+        data = b''.join(self._encode(name, value) for name, value in records)
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, segment)
+        self._sync_directory()
+
+        for path in old:
+            os.remove(path)
+        self.segments = [segment]
+        self.records = len(records)
+        self.bytes = len(data)
+        self.dirty = False
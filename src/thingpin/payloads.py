@@ -0,0 +1,225 @@
+"""
+Payload encodings of notifiers.
+
+Notifiers that take an `encoding` option serialize states with one of
+`ENCODINGS`:
+    - `json`: compact JSON, the default
+    - `msgpack`: MessagePack, requires the `msgpack` package
+    - `cbor`: CBOR, requires the `cbor2` package
+    - `delta`: JSON of only what changed since the last state published
+      for the thing, as a JSON merge patch (RFC 7396)
+
+The MessagePack and CBOR libraries are only imported when used.
+"""
+import json
+import importlib
+
+
+class Encoding(object):
+    """
+    Serialization of notifier payloads.
+
+    `code` identifies the encoding in hub frames. `binary` encodings can
+    only be published where the broker does not expect JSON. With `delta`
+    notifiers publish merge patches, see Delta.
+    """
+    name = None
+    code = None
+    binary = False
+    delta = False
+
+    def dumps(self, value):
+        """Encode a value to bytes"""
+        raise NotImplementedError
+
+    def loads(self, data):
+        """Decode bytes from `dumps()`"""
+        raise NotImplementedError
+
+
+class JSONEncoding(Encoding):
+    name = 'json'
+    code = 0
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':'),
+                          sort_keys=True).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data.decode('utf-8'))
+
+
+class DeltaEncoding(JSONEncoding):
+    name = 'delta'
+    delta = True
+
+
+class MsgpackEncoding(Encoding):
+    name = 'msgpack'
+    code = 1
+    binary = True
+
+    def __init__(self):
+        self.msgpack = import_library('msgpack', self.name)
+
+    def dumps(self, value):
+        return self.msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return self.msgpack.unpackb(data, raw=False)
+
+
+class CBOREncoding(Encoding):
+    name = 'cbor'
+    code = 2
+    binary = True
+
+    def __init__(self):
+        self.cbor2 = import_library('cbor2', self.name)
+
+    def dumps(self, value):
+        return self.cbor2.dumps(value)
+
+    def loads(self, data):
+        return self.cbor2.loads(data)
+
+
+ENCODINGS = dict((e.name, e) for e in [JSONEncoding, DeltaEncoding,
+                                       MsgpackEncoding, CBOREncoding])
+
+
+def import_library(module, encoding):
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise ValueError('{} encoding requires the {} package'.format(
+            encoding, module))
+
+
+def create_encoding(name='json'):
+    """
+    Create an encoding by name.
+
+    Raises:
+        ValueError: if the encoding is unknown or its library is missing
+    """
+    try:
+        cls = ENCODINGS[name]
+    except KeyError:
+        raise ValueError('unknown encoding {}'.format(name))
+    return cls()
+
+
+def encoding_for_code(code):
+    """Create the encoding with hub frame code `code`"""
+    for cls in ENCODINGS.values():
+        if cls.code == code and not cls.delta:
+            return cls()
+    raise ValueError('unknown encoding code {}'.format(code))
+
+
+class PayloadCache(object):
+    """
+    Encoded payloads by the value they encode.
+
+    Values that cannot be hashed, like plain dicts, are encoded every time.
+    Frozen states, see `thingpin.freeze()`, are encoded once. The cache is
+    emptied when it holds `size` payloads.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.payloads = {}
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def get(self, key, encode):
+        """
+        Cached payload for `key`, calling `encode()` on a miss.
+
+        Args:
+            key: value, or tuple of values, the payload is made from
+            encode (callable): returns the payload bytes
+        """
+        try:
+            return self.payloads[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return encode()
+        payload = encode()
+        if len(self.payloads) >= self.size:
+            self.payloads.clear()
+        self.payloads[key] = payload
+        return payload
+
+
+def merge_patch(old, new):
+    """
+    JSON merge patch that turns `old` into `new`.
+
+    Dicts are compared key by key, keys missing from `new` are set to None,
+    any other value is replaced as a whole.
+    """
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif old[key] != value:
+            patch[key] = merge_patch(old[key], value)
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+class Delta(object):
+    def __init__(self, cache_size=256):
+        """
+        Changes of each thing against the last state published for it.
+
+        Patches are only computed against states recorded with
+        `published()`, after the notifier published them, so a failed
+        publish never leaves the receiver missing a change. The first
+        state of a thing, and a state equal to the last one, are sent whole.
+        Encoded patches between frozen states are cached, so a pin
+        toggling between its `iot_states` encodes each transition once.
+
+        Args:
+            cache_size (int): most encoded payloads to keep
+        """
+        self.last = {}
+        self.cache = PayloadCache(cache_size)
+
+    def patch(self, name, value):
+        """What to send for state `value` of thing `name`"""
+        last = self.last.get(name)
+        if last is None or last == value:
+            return value
+        return merge_patch(last, value)
+
+    def payload(self, name, value, encode):
+        """
+        Encoded patch for state `value` of thing `name`.
+
+        Args:
+            name (str): thing name
+            value: new state
+            encode (callable): encodes a patch to bytes
+        """
+        last = self.last.get(name)
+        if last is None or last == value:
+            return self.cache.get((value,), lambda: encode(value))
+        return self.cache.get((last, value),
+                              lambda: encode(merge_patch(last, value)))
+
+    def published(self, name, value):
+        """Record that `value` was published for thing `name`"""
+        self.last[name] = value
+
+    def reset(self):
+        """Send whole states again, like to a receiver that lost them"""
+        self.last.clear()
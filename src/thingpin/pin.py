@@ -1,12 +1,95 @@
+import os
+import sys
+import math
 import time
-from threading import Thread
-import RPi
-from RPi import GPIO
-from collections import Iterable
+from threading import Thread, Event
 import itertools
 
-HIGH = GPIO.HIGH
-LOW = GPIO.LOW
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
+
+try:
+    from RPi import GPIO
+except (ImportError, RuntimeError):
+    # not on a Raspberry Pi, `use_gpio()` must select a backend
+    GPIO = None
+
+# same values as RPi.GPIO and thingpin.gpio backends
+HIGH = 1
+LOW = 0
+
+# clock_gettime() clock id on Linux
+CLOCK_MONOTONIC = 1
+
+
+def clock_gettime_ns():
+    """
+    Monotonic clock in nanoseconds from `clock_gettime()` with ctypes.
+
+    For Python 2.7, which has no `time.monotonic()`.
+
+    Returns:
+        callable: the clock, or None if not on Linux or libc has no
+            `clock_gettime()`
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        # in librt before glibc 2.17
+        lib = ctypes.CDLL(ctypes.util.find_library('rt') or
+                          ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = lib.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    def clock_ns():
+        t = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return t.tv_sec * 1000000000 + t.tv_nsec
+    return clock_ns
+
+
+# Pin timing uses a monotonic clock in integer nanoseconds, so that NTP
+# stepping the wall clock (at boot on a Pi without RTC) does not affect it
+if hasattr(time, 'monotonic_ns'):
+    clock_ns = time.monotonic_ns
+elif hasattr(time, 'monotonic'):
+    def clock_ns():
+        return int(time.monotonic() * 1e9)
+else:
+    clock_ns = clock_gettime_ns()
+    if clock_ns is None:
+        # only off Linux, where thingpin does not run for real
+        def clock_ns():
+            return int(time.time() * 1e9)
+
+
+def clock():
+    """Monotonic clock in seconds, see `clock_ns()`"""
+    return clock_ns() / 1e9
+
+
+def use_gpio(gpio):
+    """
+    Select the GPIO backend used by all pins.
+
+    Args:
+        gpio (object): the RPi.GPIO module or an object with the same
+            interface, see `thingpin.gpio.create_gpio()`
+    """
+    global GPIO
+    GPIO = gpio
 
 
 def set_pin_mode(mode):
@@ -52,8 +135,365 @@ def pin_cleanup():
     GPIO.cleanup()
 
 
-class Watcher(Thread):
-    def __init__(self, observer, pin, sleep, debounce_delay=0, daemon=True):
+class Debouncer(object):
+    """
+    Debounce state machine for the readings of a single pin.
+
+    Times are monotonic integer nanoseconds, see `clock_ns()`. A new reading
+    is accepted when the previous change of the raw reading is at least
+    `delay` old, so the first reading after a quiet period is reported
+    right away and bounces after it are rejected.
+    """
+    __slots__ = ('delay', 'reading', 'last_reading', 'changed', 'changes',
+                 'rejected')
+
+    def __init__(self, delay=0):
+        """
+        Args:
+            delay (float): how long in seconds the raw reading has to hold
+                steady before a new reading is accepted
+        """
+        self.delay = int(round((delay or 0) * 1e9))
+        self.reading = None
+        self.last_reading = None
+        # time of the last raw change, None before the first reading
+        self.changed = None
+        # raw changes seen, and readings rejected while waiting out the
+        # delay, for metrics
+        self.changes = 0
+        self.rejected = 0
+
+    def update(self, reading, now):
+        """
+        Process a pin reading.
+
+        Args:
+            reading (int): GPIO reading
+            now (int): time of the reading in monotonic nanoseconds
+
+        Returns:
+            bool: True if `reading` was accepted as the new pin state
+        """
+        changed = self.changed
+        if reading != self.last_reading:
+            self.last_reading = reading
+            self.changed = now
+            self.changes += 1
+        if reading == self.reading:
+            return False
+        if changed is None or now - changed >= self.delay:
+            self.reading = reading
+            return True
+        self.rejected += 1
+        return False
+
+    def update_batch(self, readings):
+        """
+        Process readings buffered by a GPIO backend, oldest first.
+
+        Args:
+            readings (iterable of tuple): (reading, now) pairs, see
+                `update()`
+
+        Returns:
+            list of int: the readings accepted, in order
+        """
+        update = self.update
+        return [reading for reading, now in readings if update(reading, now)]
+
+    def remaining(self, now):
+        """
+        How long until a pending reading can be accepted.
+
+        Args:
+            now (int): current time in monotonic nanoseconds
+
+        Returns:
+            int: nanoseconds until the most recent reading has held steady
+                for the debounce delay, or None if no reading is pending
+        """
+        if self.last_reading == self.reading:
+            return None
+        return max(self.delay - (now - self.changed), 0)
+
+
+class Input(object):
+    """A pin being scanned, with its debounce and sampling state"""
+    __slots__ = ('pin', 'observer', 'debouncer', 'max_sleep', 'interval',
+                 'due', 'samples', 'first_scan')
+
+    def __init__(self, pin, observer, debouncer, max_sleep):
+        self.pin = pin
+        self.observer = observer
+        self.debouncer = debouncer
+        self.max_sleep = max_sleep
+        # nanoseconds
+        self.interval = 0
+        self.due = 0
+        self.samples = 0
+        # bank reads: Scanner.scans when added, see `Scanner.scan_bank()`
+        self.first_scan = 0
+
+
+class Scanner(Thread):
+    def __init__(self, sleep, daemon=True, name='PinScanner', max_sleep=None,
+                 backoff=2, journal=None):
+        """
+        Create daemon thread that polls any number of pins in a single loop.
+
+        Each polling loop reads every pin that was added with `add()`,
+        debounces each reading and reports pin changes to the observer
+        of the pin. The number of threads stays the same no matter how many
+        pins are watched.
+
+        When the GPIO backend can read all pin levels at once (it has
+        `read_bank()`, see `thingpin.gpio.BankGPIO`) each loop reads them
+        with one call and only debounces the pins whose level changed since
+        the last loop, found by XOR with the previous levels, and the pins
+        with a reading still waiting out its debounce delay. The cost of a
+        quiet loop does not grow with the number of pins.
+
+        With a `max_sleep` longer than `sleep` polling is adaptive: each pin
+        is polled every `sleep` seconds right after it changes and while a
+        new reading waits out its debounce delay. While the pin stays quiet
+        its polling interval grows by `backoff` times per poll up to
+        `max_sleep`, which bounds how late a change can be noticed.
+
+        Args:
+            sleep (float): how long to sleep in seconds in each polling loop.
+                For testing this can also be an Iterable of floats in which
+                case the Thread exits when the Iterable is complete.
+            daemon (bool): whether to run as daemon. Mostly for testing.
+            name (str): thread name
+            max_sleep (float): longest polling interval of a quiet pin in
+                seconds, None to always poll every `sleep` seconds
+            backoff (float): how much the interval of a quiet pin grows per
+                poll
+            journal (Journal): if not None every raw change of a reading,
+                before debouncing, is recorded to it
+        """
+        super(Scanner, self).__init__(name=name)
+        self.daemon = daemon
+
+        if isinstance(sleep, Iterable):
+            self.sleep_iter = sleep
+            self.sleep = None
+        else:
+            self.sleep_iter = itertools.repeat(sleep)
+            self.sleep = sleep
+
+        self.max_sleep = max_sleep
+        self.backoff = backoff
+        self.journal = journal
+        # replaced, never changed in place, so pins can be added and removed
+        # while the thread runs
+        self.inputs = []
+        self.started = None
+        self.stopped = False
+        # bank reads: loops done, levels of the last loop, inputs by pin
+        # bit, and the inputs to debounce even if their level is unchanged
+        self.scans = 0
+        self.levels = 0
+        self.bank_inputs = None
+        self.by_bit = {}
+        self.mask = 0
+        self.pending = []
+
+    def add(self, observer, pin, debounce_delay=0, max_sleep=None):
+        """
+        Add a pin to the scan.
+
+        Pins added while the thread runs are polled from the next loop on.
+        Adding a pin with a `max_sleep` does not make a running Scanner
+        adaptive.
+
+        Args:
+            observer (object): object to receive notifications. When a pin
+                change is detected the `observer.update_pin(pin, reading)`
+                method is called.
+            pin (int): pin to watch
+            debounce_delay (float): how long a new pin reading has to hold
+                steady before it is accepted (and passed to `update_pin()`)
+            max_sleep (float): longest polling interval for this pin,
+                overrides the Scanner `max_sleep`
+
+        Returns:
+            Input: the scanned pin, with its debouncer and sample count
+        """
+        i = Input(pin, observer, Debouncer(debounce_delay),
+                  max_sleep or self.max_sleep)
+        if self.sleep is not None:
+            i.interval = int(self.sleep * 1e9)
+        i.first_scan = self.scans
+        self.inputs = self.inputs + [i]
+        return i
+
+    def remove(self, input):
+        """
+        Stop scanning a pin.
+
+        Args:
+            input (Input): pin returned by `add()`
+        """
+        self.inputs = [i for i in self.inputs if i is not input]
+
+    def stop(self):
+        """Make the thread exit after its current loop"""
+        self.stopped = True
+
+    @property
+    def adaptive(self):
+        return self.sleep is not None and any(
+            i.max_sleep is not None and i.max_sleep > self.sleep
+            for i in self.inputs)
+
+    def sample_rates(self):
+        """
+        Effective sample rate of each pin.
+
+        Returns:
+            dict of int: float: samples per second of each pin since the
+                thread started
+        """
+        if self.scans:
+            # bank reads sample every pin in every loop
+            for i in self.inputs:
+                i.samples = self.scans - i.first_scan
+        if self.started is None:
+            elapsed = 0
+        else:
+            elapsed = (clock_ns() - self.started) / 1e9
+        return dict((i.pin, i.samples / elapsed if elapsed else 0.0)
+                    for i in self.inputs)
+
+    def run(self):
+        self.started = clock_ns()
+        if self.adaptive:
+            return self.run_adaptive()
+
+        for sleep in self.sleep_iter:
+            if self.stopped:
+                return
+            self.scan()
+            self.wait(sleep)
+
+    def scan(self):
+        """Poll every pin once"""
+        if hasattr(GPIO, 'read_bank'):
+            return self.scan_bank()
+        journal = self.journal
+        inputs = self.inputs
+        readings = [GPIO.input(i.pin) for i in inputs]
+        now = clock_ns()
+        for i, reading in zip(inputs, readings):
+            i.samples += 1
+            if journal is not None and reading != i.debouncer.last_reading:
+                journal.record(i.pin, reading, now)
+            if i.debouncer.update(reading, now):
+                i.observer.update_pin(i.pin, reading)
+
+    def scan_bank(self):
+        """Poll every pin with one read of all pin levels"""
+        inputs = self.inputs
+        if inputs is not self.bank_inputs:
+            self.index_bank(inputs)
+        levels = GPIO.read_bank()
+        now = clock_ns()
+        self.scans += 1
+        changed = (levels ^ self.levels) & self.mask
+        self.levels = levels
+
+        todo = self.pending
+        if changed:
+            todo = list(todo)
+            while changed:
+                bit = changed & -changed
+                for i in self.by_bit[bit]:
+                    if i not in todo:
+                        todo.append(i)
+                changed ^= bit
+        if not todo:
+            return
+
+        journal = self.journal
+        pending = []
+        for i in todo:
+            reading = HIGH if levels >> i.pin & 1 else LOW
+            debouncer = i.debouncer
+            if journal is not None and reading != debouncer.last_reading:
+                journal.record(i.pin, reading, now)
+            if debouncer.update(reading, now):
+                i.observer.update_pin(i.pin, reading)
+            if debouncer.last_reading != debouncer.reading:
+                pending.append(i)
+        self.pending = pending
+
+    def index_bank(self, inputs):
+        """Map pin level bits to inputs after pins are added or removed"""
+        by_bit = {}
+        for i in inputs:
+            by_bit.setdefault(1 << i.pin, []).append(i)
+        self.by_bit = by_bit
+        self.mask = sum(by_bit)
+        # new pins need their first reading, removed pins are dropped
+        self.pending = [i for i in inputs if i in self.pending or
+                        i.debouncer.last_reading is None]
+        self.bank_inputs = inputs
+
+    def run_adaptive(self):
+        self.reset_intervals()
+        while not self.stopped:
+            self.wait(self.scan_due())
+
+    def reset_intervals(self):
+        """Make every pin due now, polled every `sleep` seconds"""
+        sleep = int(self.sleep * 1e9)
+        for i in self.inputs:
+            i.interval = sleep
+            i.due = 0
+
+    def scan_due(self):
+        """
+        Poll the pins that are due, for adaptive polling.
+
+        Returns:
+            float: seconds until the next pin is due
+        """
+        inputs = self.inputs
+        if not inputs:
+            return self.sleep
+        journal = self.journal
+        sleep = int(self.sleep * 1e9)
+        # poll pins due within half a sleep now, rather than waking up again
+        # for them right after this loop
+        now = clock_ns() + sleep // 2
+        due = [i for i in inputs if i.due <= now]
+        readings = [GPIO.input(i.pin) for i in due]
+        now = clock_ns()
+        for i, reading in zip(due, readings):
+            i.samples += 1
+            debouncer = i.debouncer
+            active = reading != debouncer.last_reading
+            if active and journal is not None:
+                journal.record(i.pin, reading, now)
+            if debouncer.update(reading, now):
+                i.observer.update_pin(i.pin, reading)
+            if active or debouncer.last_reading != debouncer.reading:
+                i.interval = sleep
+            else:
+                i.interval = min(int(i.interval * self.backoff),
+                                 int((i.max_sleep or self.sleep) * 1e9))
+            i.due = now + i.interval
+        return max(min(i.due for i in inputs) - clock_ns(), 0) / 1e9
+
+    def wait(self, sleep):
+        """Wait between polling loops"""
+        time.sleep(sleep)
+
+
+class Watcher(Scanner):
+    def __init__(self, observer, pin, sleep, debounce_delay=0, daemon=True,
+                 max_sleep=None, backoff=2, journal=None):
         """
         Create daemon thread that reports pin changes to an observer callback.
 
@@ -68,31 +508,148 @@ class Watcher(Thread):
             debounce_delay (float): how long a new pin reading has to hold
                 steady before it is accepted (and passed to `update_pin()`)
             daemon (bool): whether to run as daemon. Mostly for testing.
+            max_sleep (float): longest polling interval while the pin is
+                quiet, see `Scanner`
+            backoff (float): how much the polling interval grows per poll
+                while the pin is quiet
+            journal (Journal): records raw changes of the pin, see `Scanner`
         """
-        super(Watcher, self).__init__(name='PinWatcher-{}'.format(pin))
-        self.daemon = daemon
+        super(Watcher, self).__init__(sleep, daemon=daemon,
+                                      name='PinWatcher-{}'.format(pin),
+                                      max_sleep=max_sleep, backoff=backoff,
+                                      journal=journal)
         self.observer = observer
         self.pin = pin
+        self.add(observer, pin, debounce_delay)
 
-        if isinstance(sleep, Iterable):
-            self.sleep_iter = sleep
-        else:
-            self.sleep_iter = itertools.repeat(sleep)
+    @property
+    def reading(self):
+        """Most recently accepted reading, None until the first one"""
+        return self.inputs[0].debouncer.reading
 
-        self.debounce_delay = debounce_delay
-        self.reading = None
-        self.last_reading = None
-        self.debounce_time = 0
+
+class EdgeWatcher(Watcher):
+    def __init__(self, observer, pin, timeout=None, debounce_delay=0,
+                 daemon=True, journal=None):
+        """
+        Create daemon thread that waits for pin edges instead of polling.
+
+        The pin's edges are detected with `GPIO.add_event_detect()` for as
+        long as the thread runs. Its callback sets `edge`, the thread waits
+        for it, reads the pin and debounces the reading just like
+        `Watcher`. An edge that comes while the thread is reading stays set,
+        so the next wait returns at once instead of missing it. While a
+        reading is waiting out its debounce delay the wait times out when
+        the delay has passed so that the reading is accepted without
+        needing another edge. `stop()` wakes the thread, which releases the
+        edge detection of its pin on exit.
+
+        Args:
+            observer (object): object to receive notifications. When a pin
+                change is detected the `observer.update_pin(pin, reading)`
+                method is called.
+            pin (int): pin to watch
+            timeout (float): longest time to wait for an edge in seconds.
+                None means wait until an edge. For testing this can also be
+                an Iterable of floats in which case the Thread exits when
+                the Iterable is complete.
+            debounce_delay (float): how long a new pin reading has to hold
+                steady before it is accepted (and passed to `update_pin()`)
+            daemon (bool): whether to run as daemon. Mostly for testing.
+            journal (Journal): records raw changes of the pin, see `Scanner`
+        """
+        super(EdgeWatcher, self).__init__(observer, pin, timeout,
+                                          debounce_delay=debounce_delay,
+                                          daemon=daemon, journal=journal)
+        self.edge = Event()
+
+    def on_edge(self, pin):
+        """GPIO callback, from the backend's thread"""
+        self.edge.set()
 
     def run(self):
-        for sleep in self.sleep_iter:
-            new_reading = GPIO.input(self.pin)
-            now = time.time()
-            dt = now - self.debounce_time
-            if new_reading != self.last_reading:
-                self.debounce_time = now
-            if dt >= self.debounce_delay and new_reading != self.reading:
-                self.observer.update_pin(self.pin, new_reading)
-                self.reading = new_reading
-            self.last_reading = new_reading
-            time.sleep(sleep)
+        add_event_detect(self.pin, GPIO.BOTH, self.on_edge)
+        try:
+            super(EdgeWatcher, self).run()
+        finally:
+            GPIO.remove_event_detect(self.pin)
+
+    def stop(self):
+        super(EdgeWatcher, self).stop()
+        self.edge.set()
+
+    def wait(self, timeout):
+        """Wait for an edge, the end of a debounce delay or `timeout`"""
+        remaining = self.inputs[0].debouncer.remaining(clock_ns())
+        if remaining is not None:
+            remaining /= 1e9
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        self.edge.wait(timeout)
+        # edges from here on are seen by the next wait
+        self.edge.clear()
+
+
+def add_event_detect(pin, edge, callback, bouncetime=None, retries=10):
+    """
+    Call `callback(pin)` on `edge` edges of `pin`.
+
+    Args:
+        pin (int): pin to detect edges of
+        edge (int): GPIO.RISING, GPIO.FALLING or GPIO.BOTH
+        callback (callable): called from the GPIO backend thread
+        bouncetime (int): milliseconds after an edge in which RPi.GPIO
+            ignores further edges, None for no debouncing
+        retries (int): how often to retry, `GPIO.add_event_detect()`
+            sometimes raises RuntimeError right after setup
+    """
+    kwargs = {}
+    if bouncetime:
+        kwargs['bouncetime'] = bouncetime
+    for attempt in range(retries + 1):
+        try:
+            GPIO.add_event_detect(pin, edge, callback=callback, **kwargs)
+            return
+        except RuntimeError:
+            if attempt == retries:
+                raise
+            time.sleep(.1)
+
+
+class PulseCounter(object):
+    EDGES = ('rising', 'falling', 'both')
+
+    def __init__(self, pin, edge='rising', bouncetime=None, retries=10):
+        """
+        Count pin edges with GPIO edge detection.
+
+        Edges are counted by the GPIO backend callback thread, one integer
+        increment per edge, so pulses at kHz rates are counted without
+        polling and without passing each one to an observer. `count` is
+        only written by that thread, readers take differences of it.
+
+        Args:
+            pin (int): pin to count edges of
+            edge (str): `rising`, `falling` or `both`
+            bouncetime (int): milliseconds after an edge in which RPi.GPIO
+                ignores further edges, None for no debouncing
+            retries (int): how often to retry `add_event_detect()`, which
+                sometimes raises RuntimeError right after setup
+        """
+        if edge not in self.EDGES:
+            raise ValueError('invalid edge {}'.format(edge))
+        self.pin = pin
+        self.edge = edge
+        self.bouncetime = bouncetime
+        self.retries = retries
+        self.count = 0
+
+    def pulse(self, pin):
+        self.count += 1
+
+    def start(self):
+        add_event_detect(self.pin, getattr(GPIO, self.edge.upper()),
+                         self.pulse, self.bouncetime, self.retries)
+
+    def stop(self):
+        GPIO.remove_event_detect(self.pin)
@@ -0,0 +1,106 @@
+import os
+import json
+import logging
+import threading
+from .pin import clock
+
+
+class StateCache(object):
+    """
+    Last state published for each thing, kept in a JSON file.
+
+    A QueuedNotifier with a StateCache skips publishing a state that equals
+    the last one published for the thing, so restarts and reconnects do not
+    republish states the broker already has. States reported back by the
+    broker, such as the AWS IoT shadow, replace the cached state of things
+    not published since startup.
+
+    A state counts as published once the notifier returns from publishing
+    it. The MQTT clients publish with QoS 0, so there is no broker
+    acknowledgement to wait for.
+    """
+
+    def __init__(self, path, save_interval=1.0):
+        """
+        Load or create a state cache.
+
+        Args:
+            path (str): JSON file, see `save()`
+            save_interval (float): shortest time in seconds between saves
+                of published states, see `save_due()`
+        """
+        self.log = logging.getLogger('thingpin')
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        # things published by this process, whose cached state is newer
+        # than anything the broker reports
+        self.fresh = set()
+        self.states = {}
+        self.encoded = {}
+        self.save_interval = save_interval
+        # published states not saved yet
+        self.dirty = False
+        self.saved = clock()
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    states = json.load(f)
+            except ValueError:
+                self.log.exception('ignoring invalid state cache {}'.format(
+                    self.path))
+            else:
+                for name, value in states.items():
+                    self._set(name, value)
+
+    def __len__(self):
+        return len(self.states)
+
+    def matches(self, name, value):
+        """Whether `value` is the last state published for thing `name`"""
+        return self.encoded.get(name) == self._encode(value)
+
+    def published(self, name, value):
+        """Record that `value` was published for thing `name`"""
+        with self.lock:
+            self._set(name, value)
+            self.fresh.add(name)
+            self.dirty = True
+
+    def reported(self, name, value):
+        """Record the state the broker has for thing `name`"""
+        with self.lock:
+            if name not in self.fresh and value is not None:
+                self._set(name, value)
+
+    def save_timeout(self):
+        """Seconds until a save is due, None if nothing is to be saved"""
+        if not self.dirty:
+            return None
+        return max(self.saved + self.save_interval - clock(), 0)
+
+    def save_due(self):
+        """Whether published states have waited save_interval for a save"""
+        return self.save_timeout() == 0
+
+    def save(self):
+        """Write the cache, replacing the file atomically"""
+        with self.lock:
+            data = json.dumps(self.states, sort_keys=True)
+            self.dirty = False
+            self.saved = clock()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.rename(tmp, self.path)
+
+    def _set(self, name, value):
+        self.states[name] = value
+        self.encoded[name] = self._encode(value)
+
+    def _encode(self, value):
+        # compare as JSON so that frozen states match states read from file
+        return json.dumps(value, sort_keys=True)
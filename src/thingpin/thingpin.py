@@ -1,7 +1,10 @@
 import os
 import time
 import traceback
+import threading
+import collections
 from .pin import *
+from .metrics import Metric
 import logging
 
 
@@ -17,7 +20,9 @@ class Thingpin(object):
     Once started it does not return.
     """
 
-    def __init__(self, notifier, pin_mode=None, things=None, debug=True):
+    def __init__(self, notifier, pin_mode=None, things=None, scanner=None,
+                 gpio=None, journal=None, heartbeat=None, totals=None,
+                 debug=True):
         """
         Create and configure a Thingpin.
 
@@ -38,6 +43,23 @@ class Thingpin(object):
                       }
                     }}
 
+                Things with `type: counter` count pulses instead, see
+                `CounterPin`.
+
+            scanner (dict): if not None poll all pins in a single Scanner
+                thread instead of one Watcher thread per pin. Supported keys:
+                `sleep`, how long to sleep after each scan in seconds, and
+                `max_sleep` and `backoff` for adaptive polling, see
+                `Scanner`.
+            gpio (object): GPIO backend from `thingpin.gpio.create_gpio()`.
+                If None RPi.GPIO is used.
+            journal (Journal): if not None raw pin edges, before debouncing,
+                are recorded to it
+            heartbeat (dict): if not None publish a `snapshot()` of all
+                things every `interval` seconds (default 60) as one message
+                to thing or feed `name` (default `thingpin`)
+            totals (Totals): running totals of counter things, None to
+                start them from 0 on each start
             daemon (bool): if True run as a daemon and log to syslog, else
                 run as a foreground process and log to stdout
             debug (bool): if True log debugging info
@@ -46,8 +68,19 @@ class Thingpin(object):
         self.notifier = notifier
         self.pin_mode = pin_mode
         self.thing_config = things
+        self.scanner_config = scanner
+        self.gpio = gpio
+        self.journal = journal
+        self.heartbeat_config = heartbeat
+        self.totals = totals
         self.debug = debug
         self.pins = {}
+        self.scanner = None
+        self.heartbeat = None
+        # compiled iot_states shared by pins, see `Pin.compile_states()`
+        self.compiled = {}
+        self.started = clock_ns()
+        self.lock = threading.Lock()
 
         self.initialized = False
 
@@ -57,59 +90,705 @@ class Thingpin(object):
 
             self.log.info('initializing')
 
-            for k in ['pin_mode', 'thing_config', 'debug']:
+            for k in ['pin_mode', 'thing_config', 'scanner_config',
+                      'heartbeat_config', 'debug']:
                 self.log.info('{} = {}'.format(k, getattr(self, k)))
 
+            if self.gpio is not None:
+                use_gpio(self.gpio)
             set_pin_mode(self.pin_mode)
 
-            self.notifier.initialize()
+            self.notifier.initialize(self.thing_config)
+
+            if self.scanner_config is not None:
+                self.scanner = Scanner(
+                    sleep=self.scanner_config.get('sleep', .010),
+                    max_sleep=self.scanner_config.get('max_sleep'),
+                    backoff=self.scanner_config.get('backoff', 2),
+                    journal=self.journal)
 
             # Pins
             for name, config in self.thing_config.items():
-                self.pins[name] = Pin(self.notifier, name, config)
+                self.pins[name] = self.create_pin(name, config)
+
+            if self.heartbeat_config is not None:
+                self.heartbeat = Heartbeat(
+                    self, self.notifier,
+                    interval=self.heartbeat_config.get('interval', 60),
+                    name=self.heartbeat_config.get('name', 'thingpin'))
 
             self.initialized = True
             self.log.info('initialize complete')
 
+    def reload(self, things):
+        """
+        Apply a new `things` config to the running pins.
+
+        Things that are new are started and things that are gone are
+        stopped. A thing whose config only changed in `iot_states` or
+        `debounce_delay` is updated in place, other changes restart its pin.
+        Unchanged things keep running untouched and the notifier stays
+        connected.
+
+        Args:
+            things (dict of str: dict): new thing config, see `__init__()`
+        """
+        with self.lock:
+            if not self.initialized:
+                self.thing_config = things
+                return
+
+            # build a new dict so that metrics can read the old one
+            pins = dict(self.pins)
+            for name in set(pins) - set(things):
+                self.log.info('reload: stopping {}'.format(name))
+                self.stop_pin(pins.pop(name))
+
+            for name, config in things.items():
+                pin = pins.get(name)
+                if pin is not None:
+                    if pin.config == config:
+                        continue
+                    if pin.reconfigure(config, self.compiled):
+                        self.log.info('reload: updated {}'.format(name))
+                        continue
+                    self.log.info('reload: restarting {}'.format(name))
+                    # the new pin must not watch the pin while the old one
+                    # still does, RPi.GPIO rejects a second edge detection
+                    self.stop_pin(pin)
+                else:
+                    self.log.info('reload: starting {}'.format(name))
+                pins[name] = self.create_pin(name, config)
+                pins[name].run()
+
+            # keep the tables still in use, for pins of later reloads
+            used = set(id(pin.states) for pin in pins.values()
+                       if isinstance(pin, Pin))
+            for key, states in list(self.compiled.items()):
+                if id(states) not in used:
+                    del self.compiled[key]
+            self.pins = pins
+            self.thing_config = things
+
+    def stop_pin(self, pin, timeout=5):
+        """Stop a pin and wait for its thread to exit"""
+        pin.stop()
+        if not pin.join(timeout):
+            self.log.warning('{} did not stop within {} seconds'.format(
+                pin.name, timeout))
+
+    def create_pin(self, name, config):
+        """Create the Pin or CounterPin for a thing config"""
+        kind = config.get('type', 'state')
+        if kind == 'counter':
+            return CounterPin(self.notifier, name, config,
+                              totals=self.totals)
+        elif kind != 'state':
+            raise ValueError('thing {}: invalid type {}'.format(name, kind))
+        return Pin(self.notifier, name, config, scanner=self.scanner,
+                   journal=self.journal, compiled=self.compiled)
+
     def cleanup(self):
         """Release system resources and reset GPIO pins"""
+        self.log.info('sample rates: {}'.format(self.sample_rates()))
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+        for pin in self.pins.values():
+            if isinstance(pin, CounterPin):
+                # publishes and saves the pulses since the last publish
+                pin.stop()
         self.notifier.cleanup()
+        if self.journal is not None:
+            self.journal.close()
         pin_cleanup()
 
-    def run(self):
+    def sample_rates(self):
+        """
+        Effective sample rate of each thing.
+
+        Returns:
+            dict of str: float: samples per second of each thing's pin,
+                counter things are not sampled
+        """
+        scanned = self.scanner.sample_rates() if self.scanner else {}
+        rates = {}
+        for name, pin in self.pins.items():
+            if pin.input is None:
+                continue
+            if pin.watcher is not None:
+                rates[name] = pin.watcher.sample_rates()[pin.config['pin']]
+            else:
+                rates[name] = scanned[pin.config['pin']]
+        return rates
+
+    def snapshot(self):
+        """
+        State of all things and of the daemon, for the heartbeat.
+
+        States come from the last reading each watching thread accepted, the
+        pins are not read again.
+
+        Returns:
+            dict: `things`, the state of each thing, None before its first
+                reading or publish, and `health` with `uptime` in seconds,
+                `time` (Unix time), the number of `threads` and the things
+                whose watching thread is no longer running as `stopped`
+        """
+        pins = self.pins
+        things = {}
+        stopped = []
+        for name, pin in pins.items():
+            things[name] = pin.current_state()
+            thread = pin.thread
+            if self.initialized and thread is not None and \
+                    thread.ident is not None and not thread.is_alive():
+                stopped.append(name)
+        return {
+            'things': things,
+            'health': {
+                'uptime': round((clock_ns() - self.started) / 1e9, 3),
+                'time': int(time.time()),
+                'threads': threading.active_count(),
+                'stopped': sorted(stopped),
+            },
+        }
+
+    def metrics(self):
+        """
+        Metrics of the pins and the notifier, for a metrics Registry.
+
+        Returns:
+            list of Metric
+        """
+        rates = self.sample_rates()
+        samples, changes, rejected, notifies, rate = [], [], [], [], []
+        pulses = []
+        for name in sorted(self.pins):
+            pin = self.pins[name]
+            labels = {'thing': name, 'pin': pin.config['pin']}
+            notifies.append(('', labels, pin.notifies))
+            if pin.input is None:
+                pulses.append(('', labels, pin.counter.count))
+                continue
+            samples.append(('', labels, pin.input.samples))
+            changes.append(('', labels, pin.input.debouncer.changes))
+            rejected.append(('', labels, pin.input.debouncer.rejected))
+            rate.append(('', labels, rates[name]))
+        return [
+            Metric('thingpin_pin_samples_total', 'counter',
+                   'Pin readings taken', samples),
+            Metric('thingpin_pin_sample_rate', 'gauge',
+                   'Pin readings per second since start', rate),
+            Metric('thingpin_pin_raw_changes_total', 'counter',
+                   'Pin reading changes before debouncing', changes),
+            Metric('thingpin_pin_debounce_rejections_total', 'counter',
+                   'Readings rejected while waiting out the debounce delay',
+                   rejected),
+            Metric('thingpin_notifies_total', 'counter',
+                   'Thing state changes passed to the notifier', notifies),
+            Metric('thingpin_counter_pulses_total', 'counter',
+                   'Pulses counted by counter things since start', pulses),
+        ] + self.notifier.metrics()
+
+    def start(self):
+        """Initialize and start watching pins in background threads"""
         self.initialize()
         self.log.info('run')
 
         for pin in self.pins.values():
             pin.run()
 
+        if self.scanner is not None:
+            self.scanner.start()
+
+        if self.heartbeat is not None:
+            self.heartbeat.start()
+
+    def run(self):
+        self.start()
         while True:
             time.sleep(1000)
 
 
+class Heartbeat(threading.Thread):
+    def __init__(self, service, notifier, interval=60, name='thingpin'):
+        """
+        Daemon thread that publishes a snapshot of all things periodically.
+
+        Changes are only published when they happen, so without a heartbeat
+        a quiet sensor and a dead one look the same. Each snapshot is one
+        message per notifier, sent by the notifier queue like changes.
+
+        Args:
+            service (Thingpin): service to take `snapshot()` of
+            notifier (Notifier): notifier to publish with
+            interval (float): seconds between snapshots, the first is
+                published one interval after start
+            name (str): thing or feed the snapshots are published to
+        """
+        super(Heartbeat, self).__init__(name='Heartbeat')
+        self.daemon = True
+        self.service = service
+        self.notifier = notifier
+        self.interval = interval
+        self.topic = name
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.beat()
+
+    def beat(self):
+        """Publish a snapshot now"""
+        try:
+            self.notifier.notify_snapshot(self.topic, self.service.snapshot())
+        except Exception:
+            logging.getLogger('thingpin').exception('heartbeat failed')
+
+    def stop(self):
+        self.stopped.set()
+
+
 class Pin(object):
     """Connect a GPIO pin to a notifier, interpreting pin state per config"""
 
-    def __init__(self, notifier, name, config):
-        """Setup an input pin"""
+    def __init__(self, notifier, name, config, scanner=None, journal=None,
+                 compiled=None):
+        """
+        Setup an input pin.
+
+        Pins with `mode: edge` get their own EdgeWatcher thread. Otherwise
+        if `scanner` is given the pin is added to it, else the pin gets its
+        own Watcher thread. Raw edges of pins with their own thread are
+        recorded to `journal` if given. Pins created with the same
+        `compiled` dict share the compiled states of equal `iot_states`,
+        like those of a profile, see `expand_things()`.
+        """
         self.name = name
         self.config = config
+        self.scanner = scanner
         setup_input_pin(config['pin'], config.get('resistor'))
         self.notifier = notifier
-        self.watcher = Watcher(observer=self,
-                               pin=config['pin'],
-                               sleep=config.get('sleep', .010),
-                               debounce_delay=config.get('debounce_delay'))
+        self.states = self.compile_states(config['iot_states'], compiled)
+        # only updated by the thread watching the pin
+        self.notifies = 0
+        self.stopped = False
+
+        mode = config.get('mode', 'poll')
+        if mode == 'edge':
+            self.watcher = EdgeWatcher(
+                observer=self,
+                pin=config['pin'],
+                timeout=config.get('edge_timeout'),
+                debounce_delay=config.get('debounce_delay'),
+                journal=journal)
+        elif mode != 'poll':
+            raise ValueError('invalid mode {}'.format(mode))
+        elif scanner is not None:
+            self.input = scanner.add(
+                observer=self,
+                pin=config['pin'],
+                debounce_delay=config.get('debounce_delay'),
+                max_sleep=config.get('max_sleep'))
+            self.watcher = None
+        else:
+            self.watcher = Watcher(observer=self,
+                                   pin=config['pin'],
+                                   sleep=config.get('sleep', .010),
+                                   debounce_delay=config.get('debounce_delay'),
+                                   max_sleep=config.get('max_sleep'),
+                                   backoff=config.get('backoff', 2),
+                                   journal=journal)
+        if self.watcher is not None:
+            self.input = self.watcher.inputs[0]
+
+    def compile_states(self, iot_states, compiled=None):
+        """
+        Build the table of states to report, indexed by reading.
+
+        Each entry holds the frozen state and the message the notifier
+        publishes for it, so nothing is looked up or encoded per change.
+
+        Args:
+            iot_states (dict): config with the state for `HIGH` and `LOW`
+            compiled (dict): if not None tables already built, by frozen
+                `iot_states`, the table is taken from it or added to it
+
+        Returns:
+            tuple of State: LOW state at index 0, HIGH state at index 1
+        """
+        frozen = freeze(iot_states)
+        if compiled is not None and frozen in compiled:
+            return compiled[frozen]
+
+        states = []
+        for key in ['LOW', 'HIGH']:
+            state = frozen[key]
+            states.append(State(state, self.notifier.encode(state)))
+        states = tuple(states)
+        if compiled is not None:
+            compiled[frozen] = states
+        return states
+
+    # config that `reconfigure()` applies without restarting the pin
+    RECONFIGURABLE = ('iot_states', 'debounce_delay')
+
+    def reconfigure(self, config, compiled=None):
+        """
+        Apply a changed config to the running pin if possible.
+
+        Args:
+            config (dict): new thing config
+            compiled (dict): shared compiled states, see `compile_states()`
+
+        Returns:
+            bool: True if applied, False if only `RECONFIGURABLE` keys can
+                change in place and the pin must be restarted instead
+        """
+        def fixed(c):
+            return dict((k, v) for k, v in c.items()
+                        if k not in self.RECONFIGURABLE)
+        if fixed(config) != fixed(self.config):
+            return False
+
+        # plain assignments, the watching thread sees old or new values
+        self.states = self.compile_states(config['iot_states'], compiled)
+        self.input.debouncer.delay = int(round(
+            (config.get('debounce_delay') or 0) * 1e9))
+        self.config = config
+        return True
+
+    def stop(self):
+        """
+        Stop watching the pin.
+
+        Polled pins stop within one polling loop, a pin with `mode: edge`
+        stops right away. Readings the watching thread
+        reports after `stop()` are not published, `join()` waits for it.
+        """
+        self.stopped = True
+        if self.watcher is not None:
+            self.watcher.stop()
+        else:
+            self.scanner.remove(self.input)
+
+    def join(self, timeout=None):
+        """
+        Wait for the thread of a stopped pin to exit.
+
+        Returns:
+            bool: False if the thread is still running after `timeout`
+        """
+        if self.watcher is None or self.watcher.ident is None:
+            return True
+        self.watcher.join(timeout)
+        return not self.watcher.is_alive()
 
     def update_pin(self, pin, reading):
-        self.notifier.notify(self.name, self.get_state(reading))
+        if self.stopped:
+            return
+        state, payload = self.states[reading == HIGH]
+        self.notifies += 1
+        self.notifier.notify(self.name, state, payload)
 
     def get_state(self, reading):
         """Get state to report for GPIO reading"""
-        if reading == GPIO.HIGH:
-            return self.config['iot_states']['HIGH']
-        else:
-            return self.config['iot_states']['LOW']
+        return self.states[reading == HIGH].state
+
+    def current_state(self):
+        """State of the last accepted reading, None before the first"""
+        reading = self.input.debouncer.reading
+        return None if reading is None else self.get_state(reading)
+
+    @property
+    def thread(self):
+        """Thread watching the pin"""
+        return self.watcher or self.scanner
+
+    def run(self):
+        if self.watcher is not None:
+            self.watcher.start()
+
+
+class CounterPin(object):
+    """Count pulses on a pin and publish them on an interval"""
+
+    STATES = ('count', 'rate', 'total')
+    # config that `reconfigure()` applies without restarting the pin
+    RECONFIGURABLE = ('interval', 'state')
+
+    def __init__(self, notifier, name, config, totals=None):
+        """
+        Setup a pulse counting pin, for flow meters, anemometers and the
+        like.
+
+        Edges are counted by a PulseCounter without involving the notifier.
+        Every `interval` seconds a thread publishes
+
+            {'count': pulses in the interval,
+             'rate': pulses per second in the interval,
+             'total': pulses counted ever,
+             'state': one of the above, for single value Adafruit feeds}
+
+        and saves the total to `totals`.
+
+        Config keys: `pin`, `resistor`, `edge` (`rising`, `falling` or
+        `both`, default `rising`), `bouncetime` in milliseconds, `interval`
+        in seconds (default 60) and `state`, which of count, rate or total
+        is the state (default `total`).
+
+        Args:
+            notifier (Notifier): notifier to publish with
+            name (str): thing name
+            config (dict): thing config
+            totals (Totals): running totals that survive restarts
+        """
+        self.name = name
+        self.config = config
+        self.notifier = notifier
+        self.totals = totals
+        self.check_config(config)
+        setup_input_pin(config['pin'], config.get('resistor'))
+        self.counter = PulseCounter(config['pin'],
+                                    edge=config.get('edge', 'rising'),
+                                    bouncetime=config.get('bouncetime'))
+        self.interval = config.get('interval', 60)
+        self.state = config.get('state', 'total')
+        # not sampled, see Thingpin.sample_rates()
+        self.input = None
+        self.watcher = None
+        self.notifies = 0
+        self.total = 0
+        self.last = None
+        self.published_count = 0
+        self.published_at = clock_ns()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.started = False
+        self.timer = threading.Thread(target=self.publish_loop,
+                                      name='Counter-{}'.format(name))
+        self.timer.daemon = True
+
+    def check_config(self, config):
+        if config.get('state', 'total') not in self.STATES:
+            raise ValueError('thing {}: invalid state {}'.format(
+                self.name, config['state']))
+
+    @property
+    def thread(self):
+        """Thread publishing the counts"""
+        return self.timer
+
+    def current_state(self):
+        """Last published value, None before the first publish"""
+        return self.last
+
+    def start_counting(self):
+        """Start counting pulses, without the publish thread"""
+        self.counter.start()
+        self.started = True
+        self.published_at = clock_ns()
 
     def run(self):
-        self.watcher.start()
+        self.start_counting()
+        self.timer.start()
+
+    def publish_loop(self):
+        while not self.stopped.wait(self.interval):
+            self.publish()
+
+    def publish(self):
+        """Publish and save the pulses counted since the last publish"""
+        with self.lock:
+            now = clock_ns()
+            count = self.counter.count
+            pulses = count - self.published_count
+            seconds = (now - self.published_at) / 1e9
+            self.published_count = count
+            self.published_at = now
+
+            if self.totals is not None:
+                total = self.totals.add(self.name, pulses)
+                try:
+                    self.totals.save()
+                except (IOError, OSError):
+                    logging.getLogger('thingpin').exception(
+                        'saving totals failed')
+            else:
+                self.total += pulses
+                total = self.total
+
+            value = {
+                'count': pulses,
+                'rate': round(pulses / seconds, 3) if seconds > 0 else 0.0,
+                'total': total,
+            }
+            value['state'] = value[self.state]
+            self.last = value
+            self.notifies += 1
+        self.notifier.notify(self.name, value)
+
+    def reconfigure(self, config, compiled=None):
+        """
+        Apply a changed config to the running pin if possible.
+
+        Returns:
+            bool: True if applied, False if the pin must be restarted
+        """
+        def fixed(c):
+            return dict((k, v) for k, v in c.items()
+                        if k not in self.RECONFIGURABLE)
+        if fixed(config) != fixed(self.config):
+            return False
+        self.check_config(config)
+        # the new interval applies after the current one
+        self.interval = config.get('interval', 60)
+        self.state = config.get('state', 'total')
+        self.config = config
+        return True
+
+    def stop(self):
+        """Stop counting and publish the pulses of the last interval"""
+        if not self.started or self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.counter.stop()
+        self.publish()
+
+    def join(self, timeout=None):
+        """Wait for the publish thread of a stopped pin, see `Pin.join()`"""
+        if self.timer.ident is None:
+            return True
+        self.timer.join(timeout)
+        return not self.timer.is_alive()
+
+
+State = collections.namedtuple('State', 'state payload')
+
+
+class FrozenDict(dict):
+    """Read only dict, so that compiled states can be shared safely"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('{} is read only'.format(type(self).__name__))
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+
+def freeze(value):
+    """Copy config value with dicts made read only and lists made tuples"""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def expand_things(things, profiles=None):
+    """
+    Expand the `things` config into one config per thing.
+
+    A thing may take its settings from a profile with `profile: NAME`,
+    its own keys override those of the profile. A thing with `pins`
+    instead of `pin` is a template for one thing per pin: its name is
+    formatted with `{n}`, the position of the pin in the list counting from
+    `first` (default 1), and `{pin}`. For example the profile
+
+        {'zone': {'resistor': 'pull_up',
+                  'iot_states': {'HIGH': {'state': 'open'},
+                                 'LOW': {'state': 'closed'}}}}
+
+    with the things
+
+        {'zone{n}': {'profile': 'zone', 'pins': '4-11, 16-27'}}
+
+    expands to 20 things `zone1` to `zone20`. The expanded configs are
+    shallow: they all share the `iot_states` of the profile, so the pins
+    share one compiled state table.
+
+    Args:
+        things (dict of str: dict): `things` config section
+        profiles (dict of str: dict): `profiles` config section
+
+    Returns:
+        dict of str: dict: config of each thing
+
+    Raises:
+        ValueError: for an unknown profile, a template name without a
+            placeholder, or a thing name or pin used more than once
+    """
+    profiles = profiles or {}
+    expanded = {}
+    owners = {}
+
+    def add(name, config):
+        if name in expanded:
+            raise ValueError('thing {} defined more than once'.format(name))
+        pin = config.get('pin')
+        if pin in owners:
+            raise ValueError('pin {} used by {} and {}'.format(
+                pin, owners[pin], name))
+        owners[pin] = name
+        expanded[name] = config
+
+    for name in sorted(things):
+        config = things[name]
+        if 'profile' not in config and 'pins' not in config:
+            add(name, config)
+            continue
+
+        shared = {}
+        if 'profile' in config:
+            if config['profile'] not in profiles:
+                raise ValueError('thing {}: unknown profile {}'.format(
+                    name, config['profile']))
+            shared.update(profiles[config['profile']])
+        shared.update((k, v) for k, v in config.items()
+                      if k not in ('profile', 'pins', 'first'))
+
+        if 'pins' not in config:
+            add(name, shared)
+            continue
+        if '{' not in name:
+            raise ValueError('thing {} with pins needs {{n}} or {{pin}} in '
+                             'its name'.format(name))
+        for n, pin in enumerate(parse_pins(config['pins']),
+                                config.get('first', 1)):
+            add(name.format(n=n, pin=pin), dict(shared, pin=pin))
+    return expanded
+
+
+def parse_pins(pins):
+    """
+    Parse a pin list.
+
+    Args:
+        pins (int, str or list): a pin, a list of pins, or pins and
+            inclusive ranges separated by commas like `4-11, 16`
+
+    Returns:
+        list of int
+    """
+    if isinstance(pins, int):
+        return [pins]
+    if not isinstance(pins, (list, tuple)):
+        pins = str(pins).split(',')
+    parsed = []
+    for item in pins:
+        if isinstance(item, int):
+            parsed.append(item)
+            continue
+        first, _, last = str(item).partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise ValueError('invalid pin range {}'.format(item))
+        if last < first:
+            raise ValueError('invalid pin range {}'.format(item))
+        parsed.extend(range(first, last + 1))
+    return parsed
@@ -0,0 +1,70 @@
+import os
+import json
+import logging
+import threading
+
+
+class Totals(object):
+    """
+    Running totals of counter things, kept in a JSON file.
+
+    Counter things add the pulses of each publish interval, and the file is
+    rewritten after each publish, so totals survive restarts with at most
+    one interval of pulses lost on a crash.
+    """
+
+    def __init__(self, path):
+        """
+        Load or create totals.
+
+        Args:
+            path (str): JSON file of thing name: total
+        """
+        self.log = logging.getLogger('thingpin')
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        # counters save from their own threads, one write at a time
+        self.save_lock = threading.Lock()
+        self.totals = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.totals = dict((str(k), int(v))
+                                       for k, v in json.load(f).items())
+            except (ValueError, TypeError, AttributeError):
+                self.log.exception('ignoring invalid totals {}'.format(
+                    self.path))
+
+    def get(self, name):
+        """Total of thing `name`, 0 if it has none yet"""
+        with self.lock:
+            return self.totals.get(name, 0)
+
+    def add(self, name, count):
+        """
+        Add to the total of a thing.
+
+        Returns:
+            int: the new total
+        """
+        with self.lock:
+            total = self.totals[name] = self.totals.get(name, 0) + count
+            return total
+
+    def save(self):
+        """Write the totals, replacing the file atomically"""
+        with self.save_lock:
+            # taken under the save lock, so a later save never writes older
+            # totals
+            with self.lock:
+                data = json.dumps(self.totals, sort_keys=True)
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)